@@ -2,8 +2,12 @@
 import os, sys
 import math
 import random
+import copy
 import numpy as np
-from shapely.geometry import Polygon, Point # using to replace sympy
+from .geometry import Polygon, PolygonSet
+from .frame_stack import FrameStack
+from .recorder import FrameRecorder
+from .video import EpisodeRecorder
 import pygame
 
 GREEN = (0, 255, 0)
@@ -18,6 +22,111 @@ def safe_load_line(name, handle):
 
     return l[1].split(',')
 
+# Parsed levels, shared by every environment in the process
+_level_cache = {}
+# Open binary level files, by path
+_pack_cache = {}
+
+def load_level_pack(filename):
+    ''' The cached LevelPack of a binary level file '''
+    key = os.path.abspath(filename)
+    pack = _pack_cache.get(key)
+    if pack is None:
+        from .level_file import LevelPack
+        pack = LevelPack(filename)
+        _pack_cache[key] = pack
+    return pack
+
+def load_level(filename):
+    ''' Parse a level file once and return the cached Level for its path.
+        Binary level files (see level_file) hold one level or more:
+        'levels.nml' is the first, 'levels.nml:3' the fourth.
+    '''
+    key = os.path.abspath(filename)
+    level = _level_cache.get(key)
+    if level is None:
+        path, index = filename, 0
+        if ':' in os.path.basename(filename):
+            path, index = filename.rsplit(':', 1)
+            index = int(index)
+        if path.endswith('.nml'):
+            level = load_level_pack(path)[index]
+        else:
+            with open(filename, 'r') as file:
+                level = Level(file)
+        _level_cache[key] = level
+    return level
+
+def parse_level(handle):
+    ''' Read the values of a text level file into arrays, as they are in
+        the file (before the corrections Gate and Surface apply).
+        Returns a dict of the Level.from_arrays arguments.
+    '''
+    D = safe_load_line('Dimensions', handle)
+    width, height = int(D[0]), int(D[1])
+
+    D = safe_load_line('Gates', handle)
+    ngates = int(D[0])
+    gate_pos = np.zeros((ngates, 3))
+    # Corners, top and bottom of each gate, 4 (x, y) points each
+    gate_geometry = np.zeros((ngates, 3, 4, 2))
+    for i in range(ngates):
+        gate_pos[i] = [float(v) for v in safe_load_line('GatePos', handle)]
+        for j, name in enumerate(['Gate', 'Top', 'Bottom']):
+            for k, axis in enumerate('XY'):
+                gate_geometry[i, j, :, k] = [float(v) for v in
+                        safe_load_line(name + axis, handle)]
+
+    D = safe_load_line('Surfaces', handle)
+    nsurfaces = int(D[0])
+    surface_deep = np.zeros((nsurfaces,), dtype=np.uint8)
+    surface_offsets = np.zeros((nsurfaces + 1,), dtype=np.uint32)
+    points = []
+    for i in range(nsurfaces):
+        surface_deep[i] = safe_load_line('IsDeepTissue', handle)[0] == 'true'
+        sx = [float(x) for x in safe_load_line('SurfaceX', handle)]
+        sy = [float(y) for y in safe_load_line('SurfaceY', handle)]
+        points.append(np.array([sx, sy]).transpose())
+        surface_offsets[i + 1] = surface_offsets[i] + len(sx)
+    if points:
+        surface_xy = np.concatenate(points)
+    else:
+        surface_xy = np.zeros((0, 2))
+
+    return dict(width=width, height=height, gate_pos=gate_pos,
+            gate_geometry=gate_geometry, surface_deep=surface_deep,
+            surface_offsets=surface_offsets, surface_xy=surface_xy)
+
+def write_level(handle, width, height, gate_pos, gate_geometry,
+        surface_deep, surface_offsets, surface_xy):
+    ''' Write level values (see parse_level) as a text level file.
+        Floats are written so that parse_level reads them back exactly.
+    '''
+    def line(name, values):
+        handle.write('{}: {}\n'.format(name,
+            ','.join(repr(float(v)) for v in values)))
+
+    handle.write('Dimensions: {},{}\n'.format(int(width), int(height)))
+    handle.write('Gates: {}\n'.format(len(gate_pos)))
+    for pos, geometry in zip(gate_pos, gate_geometry):
+        line('GatePos', pos)
+        for points, name in zip(geometry, ['Gate', 'Top', 'Bottom']):
+            line(name + 'X', points[:, 0])
+            line(name + 'Y', points[:, 1])
+    handle.write('Surfaces: {}\n'.format(len(surface_deep)))
+    for i, deep in enumerate(surface_deep):
+        points = surface_xy[surface_offsets[i]:surface_offsets[i + 1]]
+        handle.write('IsDeepTissue: {}\n'.format(
+            'true' if deep else 'false'))
+        line('SurfaceX', points[:, 0])
+        line('SurfaceY', points[:, 1])
+
+def scale_width(width, scale):
+    ''' Line width on a canvas scaled by (sx, sy), at least 1 pixel '''
+    if scale is None:
+        return width
+    return max(1, int(round(width * min(scale))))
+
 def rgb2gray(rgb):
     r, g, b = rgb[0,:,:], rgb[1,:,:], rgb[2,:,:]
     gray = 0.2989 * r + 0.5870 * g + 0.1140 * b
@@ -31,14 +140,37 @@ class Environment:
     record_interval_t = 3
 
     def __init__(self, mode, stack_size, log_file=None,
-            filename=None, max_time=150, img_dim=224):
+            filename=None, max_time=150, img_dim=224,
+            direct_render=False, supersample=1, uint8_frames=False,
+            async_record=True, record_video=False, frame_skip=1,
+            swept_collision=False, max_gates=None):
         self.t = 0
         self.height = 0
         self.width = 0
         self.needle = None
         self.max_time = max_time
+        # Physics substeps per step, with a single render
+        if frame_skip < 1:
+            raise ValueError('frame_skip must be at least 1, not {}'.format(
+                frame_skip))
+        self.frame_skip = frame_skip
+        # Test the path of the needle tip over each step against the gates
+        # and deep tissue, not only where it ends, so that fast needles
+        # cannot jump over them
+        self.swept_collision = swept_collision
+        # Pad the per-gate flags of the state to this many gates, so levels
+        # with fewer gates give states of the same size
+        self.max_gates = max_gates
         self.next_gate = None
         self.filename = filename
+        self.level = None
+        self.gates = []
+        self.surfaces = []
+        self.ngates = 0
+        self.nsurfaces = 0
+        self.surface_polys = PolygonSet([])
+        self._surface_mask = []
+        self._surface_mask_tip = None
         if not os.path.exists('./out'):
             os.mkdir('./out')
         self.mode = mode
@@ -50,6 +182,24 @@ class Environment:
         self.stack_size = stack_size
         self.log_file = log_file
         self.img_dim = img_dim
+        # Draw straight at img_dim (times supersample) instead of drawing
+        # at full size and scaling down
+        self.direct_render = direct_render
+        self.supersample = supersample
+        self.render_scale = None
+        # Keep the image stack as uint8 grayscale in a ring buffer
+        self.uint8_frames = uint8_frames
+        self.frames = None
+        if uint8_frames:
+            self.frames = FrameStack(stack_size, img_dim, img_dim)
+        # Save the periodic recording frames on a background thread
+        self.async_record = async_record
+        self.recorder = None
+        self.font = None
+        # Stream recorded episodes into one video file each instead of PNGs
+        self.video = EpisodeRecorder() if record_video else None
+        # Optional StepTimers, timing the phases of step
+        self.timers = None
 
         self.is_init = False  # One-time stuff to do at reset
         # Create screen for scaling down
@@ -64,9 +214,6 @@ class Environment:
     def reset(self, random_needle=False):
         ''' Create a new environment. Currently based on attached filename '''
         self.done = False
-        self.ngates = 0
-        self.gates = []
-        self.surfaces = []
         self.t = 0
         # environment damage is the sum of the damage to all surfaces
         self.damage = 0
@@ -75,12 +222,22 @@ class Environment:
         self.episode += 1
         self.record = (self.episode == 1 or
                        self.episode % self.record_interval == 0)
+        if self.video is not None:
+            self.video.end()
         self.total_reward = 0.
         self.last_reward = 0.
 
-        if self.filename is not None:
-            with open(self.filename, 'r') as file:
-                self.load(file)
+        if self.filename is not None and self.level is None:
+            self.set_level(load_level(self.filename))
+
+        # Only the mutable state of the level needs resetting
+        for gate in self.gates:
+            gate.reset()
+        for surface in self.surfaces:
+            surface.reset()
+        if self.ngates > 0:
+            self.next_gate = 0
+            self.gates[0].status = 'next'
 
         self.needle = Needle(self.width, self.height,
                 self.log_file, random_pos=random_needle)
@@ -89,14 +246,84 @@ class Environment:
         # Save the Surface creation
         if not self.is_init:
             self.is_init = True
-            self.screen = pygame.Surface((self.width, self.height))
+            if self.direct_render:
+                # Level geometry is mapped to the canvas at draw time
+                size = self.img_dim * self.supersample
+                self.render_scale = (float(size) / self.width,
+                                     float(size) / self.height)
+                self.screen = pygame.Surface((size, size))
+            else:
+                self.screen = pygame.Surface((self.width, self.height))
+            # Static layer with the surfaces and gates
+            self.background = pygame.Surface(self.screen.get_size())
+        self._background_key = None
 
         if self.mode in ['rgb_array', 'both']:
-            frame = self.render(save_image=False)
-            # Create image stack
-            gray = rgb2gray(frame)
-            self.stack = [gray] * (self.stack_size)
-            ob = np.concatenate(self.stack)
+            if self.uint8_frames:
+                self.frames.reset(self._draw())
+            else:
+                frame = self.render(save_image=False)
+                # Create image stack
+                gray = rgb2gray(frame)
+                self.stack = [gray] * (self.stack_size)
+
+        return self._observation()
+
+    def get_state(self):
+        ''' Snapshot of the mutable state of the episode: the needle, gate
+            statuses, surface damage, counters and the image stack.
+            Level geometry is shared, not copied, so a snapshot is only
+            valid for this environment's level.
+        '''
+        snapshot = {'t': self.t,
+                    'done': self.done,
+                    'damage': self.damage,
+                    'next_gate': self.next_gate,
+                    'last_dist': self.last_dist,
+                    'total_reward': self.total_reward,
+                    'last_reward': self.last_reward,
+                    'needle': self.needle.get_state(),
+                    'gates': tuple(gate.status for gate in self.gates),
+                    'surfaces': tuple(s.damage for s in self.surfaces),
+                    'frames': None}
+        if self.mode in ['rgb_array', 'both']:
+            if self.uint8_frames:
+                snapshot['frames'] = self.frames.get_state()
+            else:
+                snapshot['frames'] = list(self.stack)
+        return snapshot
+
+    def set_state(self, snapshot):
+        ''' Restore a snapshot from get_state, without reloading or
+            redrawing anything.
+            @returns the observation, as reset does
+        '''
+        self.t = snapshot['t']
+        self.done = snapshot['done']
+        self.damage = snapshot['damage']
+        self.next_gate = snapshot['next_gate']
+        self.last_dist = snapshot['last_dist']
+        self.total_reward = snapshot['total_reward']
+        self.last_reward = snapshot['last_reward']
+        self.needle.set_state(snapshot['needle'])
+        for gate, status in zip(self.gates, snapshot['gates']):
+            gate.set_status(status)
+        for surface, damage in zip(self.surfaces, snapshot['surfaces']):
+            surface.set_damage(damage)
+        if snapshot['frames'] is not None:
+            if self.uint8_frames:
+                self.frames.set_state(snapshot['frames'])
+            else:
+                self.stack = list(snapshot['frames'])
+        return self._observation()
+
+    def _observation(self):
+        ''' The observation for the current state and image stack '''
+        if self.mode in ['rgb_array', 'both']:
+            if self.uint8_frames:
+                ob = self.frames.view()
+            else:
+                ob = np.concatenate(self.stack)
 
         if self.mode in ['state', 'both']:
             state = self._get_state().reshape((1,-1))
@@ -108,23 +335,43 @@ class Environment:
         elif self.mode == 'both':
             return ob, state
 
-    def render(self, mode='rgb_array', save_image=False, save_path='./out/'):
+    def _update_background(self):
+        ''' Redraw the static layer, only when a gate status or a surface
+            damage (and so its color) changed since the last draw
+        '''
+        key = (tuple(gate.status for gate in self.gates),
+               tuple(surface.damage for surface in self.surfaces))
+        if key == self._background_key:
+            return
+        self._background_key = key
 
-        self.screen.fill(self.background_color)
+        self.background.fill(self.background_color)
 
         for surface in self.surfaces:
-            surface.draw(self.screen)
+            surface.draw(self.background, self.render_scale)
 
         for gate in self.gates:
-            gate.draw(self.screen)
+            gate.draw(self.background, self.render_scale)
 
-        self.needle.draw(self.screen)
+    def _draw(self):
+        ''' Draw the current frame and return the surface holding it
+            at img_dim
+        '''
+        self._update_background()
+        self.screen.blit(self.background, (0, 0))
+
+        self.needle.draw(self.screen, self.render_scale)
 
         # --- Done with drawing ---
 
         # Scale if needed
         surface = self.screen
-        if self.scaled_screen is not None:
+        if self.direct_render:
+            if self.supersample > 1:
+                pygame.transform.smoothscale(self.screen,
+                    [self.img_dim, self.img_dim], self.scaled_screen)
+                surface = self.scaled_screen
+        elif self.scaled_screen is not None:
             # Precreate surface with final dim and use ~DestSurface
             # Also consider smoothscale
             if self.img_dim < 224:
@@ -133,34 +380,74 @@ class Environment:
                 scale = pygame.transform.scale
             scale(self.screen, [self.img_dim, self.img_dim], self.scaled_screen)
             surface = self.scaled_screen
+        return surface
+
+    def _overlay_text(self):
+        ''' Text drawn on saved frames '''
+        debug = False
+        if debug:
+            if self.next_gate is not None:
+                reward_s = "w:{:.2f}, g:({:.0f}, {:.0f}), " \
+                "n:({:.0f}, {:.0f})".format(
+                    self.needle.w,
+                    self.gates[self.next_gate].x,
+                    self.gates[self.next_gate].y,
+                    self.needle.x, self.needle.y)
+            else:
+                reward_s = ""
+        else:
+            reward_s = "TR:{:.5f}, R:{:.5f}".format(
+                    self.total_reward, self.last_reward)
+            #reward_s = "w:{:.5f}, x:{:.5f}, y:{:.5f}".format(
+            #        self.needle.w, self.needle.x, self.needle.y)
+        return reward_s
+
+    def _draw_overlay(self, surface):
+        # draw text
+        if self.font is None:
+            self.font = pygame.font.SysFont('Arial', 13)
+        txtSurface = self.font.render(self._overlay_text(), False, (0, 0, 0))
+        surface.blit(txtSurface, (10, 10))
+
+    def _save_file(self, save_path):
+        return os.path.join(save_path,
+                '{:06d}_{:03d}.png'.format(self.episode, self.t))
+
+    def get_frame(self, overlay=True):
+        ''' Current frame as a uint8 [W, H, 3] array, with the reward text '''
+        surface = self._draw()
+        if overlay:
+            self._draw_overlay(surface)
+        return pygame.surfarray.array3d(surface)
+
+    def record_frame(self, save_path='./out/'):
+        ''' Queue the current frame to be saved by the background recorder.
+            Never blocks: frames are dropped if the recorder falls behind.
+        '''
+        if self.recorder is None:
+            self.recorder = FrameRecorder()
+        frame = pygame.surfarray.array3d(self._draw())
+        return self.recorder.record(frame, self._overlay_text(),
+                self._save_file(save_path))
+
+    def close(self):
+        ''' Finish writing recorded frames '''
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.video is not None:
+            self.video.end()
+
+    def render(self, mode='rgb_array', save_image=False, save_path='./out/'):
+
+        surface = self._draw()
 
         if save_image:
-            # draw text
-            myfont = pygame.font.SysFont('Arial', 13)
-            debug = False
-            if debug:
-                if self.next_gate is not None:
-                    reward_s = "w:{:.2f}, g:({:.0f}, {:.0f}), " \
-                    "n:({:.0f}, {:.0f})".format(
-                        self.needle.w,
-                        self.gates[self.next_gate].x,
-                        self.gates[self.next_gate].y,
-                        self.needle.x, self.needle.y)
-                else:
-                    reward_s = ""
-            else:
-                reward_s = "TR:{:.5f}, R:{:.5f}".format(
-                        self.total_reward, self.last_reward)
-                #reward_s = "w:{:.5f}, x:{:.5f}, y:{:.5f}".format(
-                #        self.needle.w, self.needle.x, self.needle.y)
-            txtSurface = myfont.render(reward_s, False, (0, 0, 0))
-            surface.blit(txtSurface, (10, 10))
+            self._draw_overlay(surface)
 
             if not os.path.exists(save_path):
                 os.mkdir(save_path)
-            save_file = os.path.join(save_path,
-                    '{:06d}_{:03d}.png'.format(self.episode, self.t))
-            pygame.image.save(surface, save_file)
+            pygame.image.save(surface, self._save_file(save_path))
 
         # Return the figure in a numpy buffer
         if mode == 'rgb_array':
@@ -179,34 +466,30 @@ class Environment:
     Load an environment file.
     '''
     def load(self, handle):
+        self.set_level(Level(handle))
 
-        D = safe_load_line('Dimensions', handle)
-        self.height = int(D[1])
-        self.width = int(D[0])
-        #print " - width=%d, height=%d"%(self.width, self.height)
-
-        D = safe_load_line('Gates', handle)
-        self.ngates = int(D[0])
-        #print " - num gates=%d"%(self.ngates)
-
-        for _ in range(self.ngates):
-            gate = Gate(self.width, self.height)
-            gate.load(handle)
-            self.gates.append(gate)
+    def set_level(self, level):
+        ''' Use a parsed level. Gates and surfaces share its geometry
+            and only carry their own mutable state
+        '''
+        if self.max_gates is not None and level.ngates > self.max_gates:
+            raise ValueError('The level has {} gates, more than max_gates {}'
+                .format(level.ngates, self.max_gates))
+        self.level = level
+        self.width = level.width
+        self.height = level.height
+        self.ngates = level.ngates
+        self.nsurfaces = level.nsurfaces
+        self.gates = [gate.copy() for gate in level.gates]
+        self.surfaces = [s.copy() for s in level.surfaces]
+        self.surface_polys = level.surface_polys
+        self._surface_mask_tip = None
 
+        self.next_gate = None
         if self.ngates > 0:
             self.next_gate = 0
             self.gates[0].status = 'next'
 
-        D = safe_load_line('Surfaces', handle)
-        self.nsurfaces = int(D[0])
-        #print " - num surfaces=%d"%(self.nsurfaces)
-
-        for i in range(self.nsurfaces):
-            s = Surface(self.width, self.height)
-            s.load(handle)
-            self.surfaces.append(s)
-
     def _get_state(self):
         ''' Get state in a way the NN can read it '''
         if self.next_gate is not None:
@@ -228,6 +511,8 @@ class Environment:
         state.append(float(self.needle.dw))
         for gate in self.gates:
             state.append(1.0 if gate.status == 'passed' else 0.0)
+        if self.max_gates is not None:
+            state += [0.0] * (self.max_gates - self.ngates)
         state.append(float(gate_x) / self.width)
         state.append(float(gate_y) / self.height)
         state.append(float(gate_w) / two_pi)
@@ -237,23 +522,104 @@ class Environment:
 
     def step(self, action):
         """
-            Move one time step forward
+            Move one time step forward, or frame_skip physics substeps with
+            the same action. Rewards are summed over the substeps and the
+            world is only rendered after the last one.
             Returns:
               * state of the world (in our case, an image)
               * reward
               * done
         """
+        start_t = self.t
+        reward = 0.
+        for _ in range(self.frame_skip):
+            substep_reward, done = self._substep(action)
+            reward += substep_reward
+            if done:
+                break
+
+        self.last_reward = reward
+        self.total_reward += reward
+
+        timers = self.timers
+        if timers is not None:
+            t = timers.now()
+
+        # Record every record_interval_t time steps
+        if self.record and (self.t // self.record_interval_t !=
+                start_t // self.record_interval_t):
+            if self.video is not None:
+                if self.video.path is None:
+                    self.video.begin(os.path.join('./out',
+                        '{:06d}'.format(self.episode)))
+                self.video.add_frame(self.get_frame())
+            elif self.async_record:
+                self.record_frame()
+            else:
+                self.render(mode='rgb_array', save_image=True)
+            if timers is not None:
+                t = timers.add('record', t)
+
+        if self.mode in ['rgb_array', 'both'] and self.uint8_frames:
+            surface = self._draw()
+            if timers is not None:
+                t = timers.add('render', t)
+            # View into the ring buffer, valid through the next step
+            self.frames.push(surface)
+            ob = self.frames.view()
+            if timers is not None:
+                t = timers.add('stack', t)
+        elif self.mode in ['rgb_array', 'both']:
+            """ if from image to action """
+            frame = self.render(mode='rgb_array')
+            if timers is not None:
+                t = timers.add('render', t)
+            self.stack.pop(0)
+            self.stack.append(rgb2gray(frame))
+            ob = np.concatenate(self.stack)
+            assert len(self.stack) == self.stack_size
+            if timers is not None:
+                t = timers.add('stack', t)
+
+        if self.mode in ['state', 'both']:
+            """ else from state to action"""
+            state = self._get_state().reshape((1,-1))
+            if timers is not None:
+                t = timers.add('state', t)
+
+        if self.mode == 'rgb_array':
+            return ob, reward, done
+        elif self.mode == 'state':
+            return state, reward, done
+        elif self.mode == 'both':
+            return (ob, state), reward, done
+
+    def _substep(self, action):
+        ''' Move the needle one time step and check damage and gates.
+            @returns reward, done
+        '''
+        timers = self.timers
+        if timers is not None:
+            t = timers.now()
+
         needle_surface = self._surface_with_needle()
+        prev_tip = self.needle.tip if self.swept_collision else None
         self.needle.move(action, needle_surface)
+        if timers is not None:
+            t = timers.add('geometry', t)
         new_damage = self._get_new_damage(action, needle_surface)
         self.damage += new_damage
         self.t += 1
+        if timers is not None:
+            t = timers.add('damage', t)
 
         # calculate reward and done
         reward = 0
         done = False
 
-        status = self._update_and_get_next_gate_status()
+        status = self._update_and_get_next_gate_status(prev_tip)
+        if timers is not None:
+            t = timers.add('geometry', t)
         if status == 'passed':
             self.last_dist = None
             reward += 100
@@ -294,7 +660,12 @@ class Environment:
             #reward -= 0.5
             #done = True
 
-        if self._deep_tissue_intersect():
+        if timers is not None:
+            t = timers.add('reward', t)
+        deep_tissue = self._deep_tissue_intersect(prev_tip)
+        if timers is not None:
+            t = timers.add('geometry', t)
+        if deep_tissue:
             reward -= 100.
             done = True
 
@@ -311,34 +682,13 @@ class Environment:
 
         reward /= 10
 
-        self.last_reward = reward
-        self.total_reward += reward
-
-        if self.record and self.t % self.record_interval_t == 0:
-            self.render(mode='rgb_array', save_image=True)
-
-        if self.mode in ['rgb_array', 'both']:
-            """ if from image to action """
-            frame = self.render(mode='rgb_array')
-            self.stack.pop(0)
-            self.stack.append(rgb2gray(frame))
-            ob = np.concatenate(self.stack)
-            assert len(self.stack) == self.stack_size
-
-        if self.mode in ['state', 'both']:
-            """ else from state to action"""
-            state = self._get_state().reshape((1,-1))
-
-        if self.mode == 'rgb_array':
-            return ob, reward, done
-        elif self.mode == 'state':
-            return state, reward, done
-        elif self.mode == 'both':
-            return (ob, state), reward, done
+        if timers is not None:
+            timers.add('reward', t)
+        return reward, done
 
     def _surface_with_needle(self):
-        for s in self.surfaces:
-            if self._needle_in_surface(s):
+        for s, inside in zip(self.surfaces, self._surfaces_with_needle()):
+            if inside:
                 return s
         return None
 
@@ -349,18 +699,32 @@ class Environment:
             return 0.
 
     def _needle_in_surface(self, s):
-        return s.poly.contains(self.needle.tip)
+        return s.poly.contains(*self.needle.tip)
+
+    def _surfaces_with_needle(self):
+        ''' Which surfaces contain the needle tip.
+            The result is reused until the tip moves, since the deep
+            tissue check and the next step test the same position.
+        '''
+        tip = self.needle.tip
+        if tip != self._surface_mask_tip:
+            self._surface_mask = self.surface_polys.contains(*tip)
+            self._surface_mask_tip = tip
+        return self._surface_mask
 
-    def _update_and_get_next_gate_status(self):
+    def _update_and_get_next_gate_status(self, prev_tip=None):
         """
             verify if the game is in a valid state and can
             keep playing
+            prev_tip: where the tip started the step, to test its whole
+                      path instead of only its end
         """
         # have we passed a new gate?
         if self.next_gate is None:
             return 'done'
 
-        status = self.gates[self.next_gate].update_status(self.needle.tip)
+        status = self.gates[self.next_gate].update_status(self.needle.tip,
+                prev_tip)
         # if you passed or failed the gate
         if status == 'failed' or status == 'passed':
             # increment to the next gate
@@ -373,16 +737,82 @@ class Environment:
         return status
 
 
-    def _deep_tissue_intersect(self):
+    def _deep_tissue_intersect(self, prev_tip=None):
         """
             check each surface, does the needle intersect the
             surface? is the surface deep?
+            prev_tip: where the tip started the step, to test its whole
+                      path instead of only its end
         """
-        for s in self.surfaces:
-            if s.deep and self._needle_in_surface(s):
+        if prev_tip is not None:
+            for s in self.surfaces:
+                if s.deep and s.poly.intersects_segment(
+                        prev_tip[0], prev_tip[1], *self.needle.tip):
+                    return True
+            return False
+        for s, inside in zip(self.surfaces, self._surfaces_with_needle()):
+            if inside and s.deep:
                 return True
         return False
 
+class Level:
+    ''' Immutable parsed level file.
+
+        Holds the dimensions and the template gates and surfaces with
+        their geometry. Environments copy the templates and never modify
+        the level itself, so one Level can be shared by all of them.
+    '''
+    def __init__(self, handle=None):
+        ''' Parse a text level file. Without a handle the level is empty,
+            for from_arrays to fill. '''
+        if handle is not None:
+            self._build(**parse_level(handle))
+
+    @classmethod
+    def from_arrays(cls, width, height, gate_pos, gate_geometry,
+            surface_deep, surface_offsets, surface_xy):
+        ''' Level from the values of a level file, see parse_level.
+            The arrays are copied, so they can be memory-mapped.
+        '''
+        level = cls()
+        level._build(width, height, gate_pos, gate_geometry, surface_deep,
+                surface_offsets, surface_xy)
+        return level
+
+    def _build(self, width, height, gate_pos, gate_geometry, surface_deep,
+            surface_offsets, surface_xy):
+        self.width = int(width)
+        self.height = int(height)
+        self.ngates = len(gate_pos)
+        self.nsurfaces = len(surface_deep)
+
+        gates = []
+        for pos, geometry in zip(gate_pos, gate_geometry):
+            gate = Gate(self.width, self.height)
+            gate.set_geometry(pos, *geometry)
+            gates.append(gate)
+        self.gates = tuple(gates)
+
+        surfaces = []
+        for i in range(self.nsurfaces):
+            s = Surface(self.width, self.height)
+            s.set_geometry(bool(surface_deep[i]),
+                surface_xy[surface_offsets[i]:surface_offsets[i + 1]])
+            surfaces.append(s)
+        self.surfaces = tuple(surfaces)
+
+        # Geometry is shared between copies: make sure nobody writes to it
+        for gate in self.gates:
+            for a in (gate.corners, gate.top, gate.bottom):
+                a.setflags(write=False)
+        for s in self.surfaces:
+            s.corners.setflags(write=False)
+
+        # All surfaces are tested for the needle tip at once
+        self.surface_polys = PolygonSet([s.poly for s in self.surfaces])
+        self.surface_deep = np.array([s.deep for s in self.surfaces],
+                dtype=bool)
+
 class Gate:
     color_passed = np.array([100., 175., 100.])
     color_failed = np.array([175., 100., 100.])
@@ -408,34 +838,82 @@ class Gate:
         self.box = None
         self.bottom_box = None
         self.top_box = None
+        # Geometry mapped to a scaled canvas, see _scaled_geometry
+        self._scaled = None
 
         self.env_width = env_width
         self.env_height = env_height
 
-    def update_status(self, p):
+    def copy(self):
+        ''' Copy sharing the geometry, with fresh status and colors '''
+        gate = copy.copy(self)
+        gate.reset()
+        return gate
+
+    def reset(self):
+        self.status = None
+        self.c1 = self.color1
+        self.c2 = self.color2
+        self.c3 = self.color3
+        self.highlight = None
+
+    def set_status(self, status):
+        ''' Set the status and the colors that go with it '''
+        self.reset()
+        self.status = status
+        if status == 'failed':
+            color = self.color_failed
+        elif status == 'passed':
+            color = self.color_passed
+        else:
+            return
+        self.c1 = self.c2 = self.c3 = color
+
+    def _hit(self, poly, p, prev):
+        if prev is None:
+            return poly.contains(*p)
+        return poly.intersects_segment(prev[0], prev[1], p[0], p[1])
+
+    def update_status(self, p, prev=None):
         ''' take in current position,
             see if you passed or failed the gate
+            prev: previous position. When given, the whole path from prev
+                  to p is tested
         '''
-        if self.status != 'passed' and \
-                (self.top_box.contains(p) or self.bottom_box.contains(p)):
+        if self.status != 'passed' and (self._hit(self.top_box, p, prev) or
+                self._hit(self.bottom_box, p, prev)):
             self.status = 'failed'
             self.c1 = self.color_failed
             self.c2 = self.color_failed
             self.c3 = self.color_failed
-        elif self.status == 'next' and self.box.contains(p):
+        elif self.status == 'next' and self._hit(self.box, p, prev):
             self.status = 'passed'
             self.c1 = self.color_passed
             self.c2 = self.color_passed
             self.c3 = self.color_passed
         return self.status
 
-    def draw(self, surface):
-        pygame.draw.polygon(surface, self.c1, self.corners)
+    def _scaled_geometry(self, scale):
+        ''' Corners, top and bottom on a canvas scaled by (sx, sy).
+            Computed once per scale.
+        '''
+        if self._scaled is None or self._scaled[0] != scale:
+            s = np.array(scale)
+            self._scaled = (scale,
+                (self.corners * s, self.top * s, self.bottom * s))
+        return self._scaled[1]
+
+    def draw(self, surface, scale=None):
+        corners, top, bottom = self.corners, self.top, self.bottom
+        if scale is not None:
+            corners, top, bottom = self._scaled_geometry(scale)
+        pygame.draw.polygon(surface, self.c1, corners)
         # If next gate, outline in green
         if self.status == 'next':
-            pygame.draw.polygon(surface, GREEN, self.corners, 20)
-        pygame.draw.polygon(surface, self.c2, self.top)
-        pygame.draw.polygon(surface, self.c3, self.bottom)
+            pygame.draw.polygon(surface, GREEN, corners,
+                    scale_width(20, scale))
+        pygame.draw.polygon(surface, self.c2, top)
+        pygame.draw.polygon(surface, self.c3, bottom)
 
     '''
     Load Gate from file at the current position.
@@ -450,16 +928,23 @@ class Gate:
         bottomx = safe_load_line('BottomX', handle)
         bottomy = safe_load_line('BottomY', handle)
 
+        def points(xs, ys):
+            return np.array([[float(x) for x in xs], [float(y) for y in ys]]).T
+
+        self.set_geometry([float(p) for p in pos], points(cornersx, cornersy),
+                points(topx, topy), points(bottomx, bottomy))
+
+    def set_geometry(self, pos, corners, top, bottom):
+        ''' Set the gate from its values in the level file: pos is
+            (x, y, w) with x and y relative to the window, the others are
+            [4, 2] arrays of points '''
         self.x = self.env_width * float(pos[0])
         self.y = self.env_height * float(pos[1])
         self.w = float(pos[2])
 
-        self.top[:, 0] = [float(x) for x in topx]
-        self.top[:, 1] = [float(y) for y in topy]
-        self.bottom[:, 0] = [float(x) for x in bottomx]
-        self.bottom[:, 1] = [float(y) for y in bottomy]
-        self.corners[:, 0] = [float(x) for x in cornersx]
-        self.corners[:, 1] = [float(y) for y in cornersy]
+        self.top[:] = top
+        self.bottom[:] = bottom
+        self.corners[:] = corners
 
         # apply corrections to make sure the gates are oriented right
         self.w *= -1
@@ -501,10 +986,35 @@ class Surface:
         self.env_height = env_height
 
         self.poly = None
+        # Corners mapped to a scaled canvas
+        self._scaled = None
 
-    def draw(self, surface):
+    def copy(self):
+        ''' Copy sharing the geometry, with fresh damage and color '''
+        s = copy.copy(self)
+        s.reset()
+        return s
+
+    def reset(self):
+        self.damage = 0
+        self.color = np.array(self.deep_color if self.deep else self.light_color)
+
+    def set_damage(self, damage):
+        ''' Set the damage and the color that goes with it '''
+        if damage == 0:
+            self.reset()
+        else:
+            self.damage = damage
+            self._update_color()
+
+    def draw(self, surface, scale=None):
         ''' update damage and surface color '''
-        pygame.draw.polygon(surface, self.color, self.corners)
+        corners = self.corners
+        if scale is not None:
+            if self._scaled is None or self._scaled[0] != scale:
+                self._scaled = (scale, self.corners * np.array(scale))
+            corners = self._scaled[1]
+        pygame.draw.polygon(surface, self.color, corners)
 
     '''
     Load surface from file at the current position
@@ -514,10 +1024,15 @@ class Surface:
 
         sx = [float(x) for x in safe_load_line('SurfaceX', handle)]
         sy = [float(x) for x in safe_load_line('SurfaceY', handle)]
-        self.corners = np.array([sx, sy]).transpose()
+        self.set_geometry(isdeep[0] == 'true', np.array([sx, sy]).transpose())
+
+    def set_geometry(self, deep, points):
+        ''' Set the surface from its values in the level file: points is an
+            [N, 2] array with y going up '''
+        self.corners = np.array(points, dtype=np.float64)
         self.corners[:, 1] = self.env_height - self.corners[:, 1]
 
-        self.deep = isdeep[0] == 'true'
+        self.deep = deep
         self.deep_color = np.array([207., 69., 32.])
         self.light_color = np.array([232., 146., 124.])
         self.color = np.array(self.deep_color if self.deep else self.light_color)
@@ -576,7 +1091,10 @@ class Needle:
 
         # Save adjusted thread points since we don't use them for anything
         self.thread_points = [(self.x, env_height - self.y)]
-        self.tip = Point(np.array([self.x, self.env_height - self.y]))
+        # Thread points mapped to a scaled canvas, extended as we move
+        self.scaled_thread = []
+        self.thread_scale = None
+        self.tip = (self.x, self.env_height - self.y)
         self.path_length = 0.
 
         self.log_file = log_file
@@ -584,9 +1102,24 @@ class Needle:
         self.load()
 
 
-    def draw(self, surface):
-        self._draw_thread(surface)
-        self._draw_needle(surface)
+    def get_state(self):
+        ''' Pose, velocities and thread. The thread has at most one
+            point per step '''
+        return (self.x, self.y, self.w, self.dx, self.dy, self.dw,
+                self.path_length, tuple(self.thread_points))
+
+    def set_state(self, state):
+        (self.x, self.y, self.w, self.dx, self.dy, self.dw,
+            self.path_length, thread_points) = state
+        self.thread_points = list(thread_points)
+        self.scaled_thread = []
+        self.thread_scale = None
+        self.tip = (self.x, self.env_height - self.y)
+        self._compute_corners()
+
+    def draw(self, surface, scale=None):
+        self._draw_thread(surface, scale)
+        self._draw_needle(surface, scale)
 
     def _compute_corners(self):
         """
@@ -613,12 +1146,26 @@ class Needle:
 
         self.corners = np.array([[x, y], [top_x, top_y], [bot_x, bot_y]])
 
-    def _draw_needle(self, surface):
-        pygame.draw.polygon(surface, self.needle_color, self.corners)
+    def _draw_needle(self, surface, scale=None):
+        corners = self.corners
+        if scale is not None:
+            corners = corners * np.array(scale)
+        pygame.draw.polygon(surface, self.needle_color, corners)
 
-    def _draw_thread(self, surface):
+    def _draw_thread(self, surface, scale=None):
         if len(self.thread_points) > 1:
-            pygame.draw.lines(surface, self.thread_color, False, self.thread_points, 10)
+            points = self.thread_points
+            if scale is not None:
+                # Only map the points added since the last draw
+                if scale != self.thread_scale:
+                    self.thread_scale = scale
+                    self.scaled_thread = []
+                sx, sy = scale
+                for x, y in self.thread_points[len(self.scaled_thread):]:
+                    self.scaled_thread.append((x * sx, y * sy))
+                points = self.scaled_thread
+            pygame.draw.lines(surface, self.thread_color, False, points,
+                    scale_width(10, scale))
     def load(self):
         """
             Load the current needle position
@@ -691,21 +1238,65 @@ class Needle:
             self.path_length += dlength
 
         self.dx, self.dy, self.dw = dx, dy, dw
-        self.tip = Point(np.array([self.x, self.env_height - self.y]))
+        self.tip = (self.x, self.env_height - self.y)
         self._compute_corners()
 
 class PID:
-    def __init__(self, Parameters, width, height):
+    ''' Parameters are the (x, y) gains of PIDcontroller, or the
+        (kp, ki, kd) gains of steer '''
+    def __init__(self, Parameters, width, height, max_action=0.25 * math.pi):
         self.parameters = Parameters
         self.width = width
         self.height = height
+        self.max_action = max_action
+        # How far before the gate steer aims, relative to its distance
+        self.lead = 0.5
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.
+        self.last_error = None
+
+    def steer(self, env):
+        ''' Action for Environment.step turning the needle towards the
+            center of the next gate (or straight on past the last one),
+            from the error in heading '''
+        needle = env.needle
+        if env.next_gate is not None:
+            gate = env.gates[env.next_gate]
+            dx, dy = gate.x - needle.x, gate.y - needle.y
+            # Aim before the gate on the line through it, coming closer
+            # to the gate as the needle does, so that the needle crosses
+            # it square rather than into a wall
+            ax, ay = gate.corners[1] - gate.corners[0]
+            nx, ny = ay, ax  # Normal to the long axis, with y up
+            norm = math.sqrt(nx * nx + ny * ny)
+            if norm > 0:
+                nx, ny = nx / norm, ny / norm
+                if nx * dx + ny * dy < 0:
+                    nx, ny = -nx, -ny
+                lead = self.lead * math.sqrt(dx * dx + dy * dy)
+                dx, dy = dx - lead * nx, dy - lead * ny
+        else:
+            dx, dy = 1., 0.
+        # The needle moves at angle pi - w, after adding the action to w
+        error = math.pi - math.atan2(dy, dx) - needle.w
+        error = (error + math.pi) % two_pi - math.pi
+        self.integral += error
+        derivative = 0. if self.last_error is None else \
+            error - self.last_error
+        self.last_error = error
+        kp, ki, kd = self.parameters
+        action = kp * error + ki * self.integral + kd * derivative
+        return np.array([min(max(action, -self.max_action),
+            self.max_action)])
 
     """" needle_pos = [needle.x, needle.y, needle.w]"""
 
     def GetSelfState(self, needle_pos):
         x = needle_pos[0] * self.width  ## x
         y = needle_pos[1] * self.height  ## y
-        w = needle_pos[2] * pi - pi  ## w
+        w = needle_pos[2] * math.pi - math.pi  ## w
         state = np.array([x, y, -w])
         # print("needle position: "+ str(x) +" "+ str(y))
         return state
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pygame
+
+# Integer luma weights (0.2989, 0.5870, 0.1140) scaled by 256
+GRAY_WEIGHTS = (77, 150, 29)
+
+class FrameStack:
+    ''' The last stack_size frames as uint8 grayscale.
+
+        Frames are appended to a buffer of 2 * stack_size slots, and when
+        it is full the newest stack_size - 1 frames are moved back to its
+        start. The stack is so always a contiguous, ordered (oldest first)
+        view of the buffer and no array is allocated per step. The slots
+        written by a push never overlap the previous view, so an
+        observation stays valid through the next step.
+        Frames keep the surfarray (x, y) layout of Environment.render.
+    '''
+    def __init__(self, stack_size, width, height):
+        self.stack_size = stack_size
+        self.data = np.zeros((2 * stack_size, width, height), dtype=np.uint8)
+        self.end = stack_size # slot after the newest frame
+        # Scratch buffers for the integer grayscale conversion
+        self._acc = np.zeros((width, height), dtype=np.uint16)
+        self._tmp = np.zeros((width, height), dtype=np.uint16)
+
+    def _gray(self, surface, out):
+        ''' Write the grayscale of a pygame surface into out '''
+        pixels = pygame.surfarray.pixels3d(surface)
+        np.multiply(pixels[:, :, 0], GRAY_WEIGHTS[0], out=self._acc,
+                dtype=np.uint16)
+        for c in (1, 2):
+            np.multiply(pixels[:, :, c], GRAY_WEIGHTS[c], out=self._tmp,
+                    dtype=np.uint16)
+            self._acc += self._tmp
+        del pixels # unlock the surface
+        np.right_shift(self._acc, 8, out=out, casting='unsafe')
+
+    def reset(self, surface):
+        ''' Fill the whole stack with the frame on surface '''
+        k = self.stack_size
+        self._gray(surface, self.data[0])
+        self.data[1:k] = self.data[0]
+        self.end = k
+
+    def push(self, surface):
+        ''' Add the frame on surface, dropping the oldest one '''
+        k = self.stack_size
+        if self.end == len(self.data):
+            # Slots [k, 2k) hold the previous view: [0, k) is free
+            self.data[:k - 1] = self.data[self.end - k + 1:self.end]
+            self.end = k - 1
+        self._gray(surface, self.data[self.end])
+        self.end += 1
+
+    def get_state(self):
+        ''' Copy of the stack, for set_state '''
+        return self.view().copy()
+
+    def set_state(self, stack):
+        k = self.stack_size
+        self.data[:k] = stack
+        self.end = k
+
+    def view(self):
+        ''' Stack of shape [stack_size, W, H], oldest frame first.
+            This is a view into the buffer: it stays valid through the next
+            push and may change after that, so copy it to keep it longer.
+        '''
+        return self.data[self.end - self.stack_size:self.end]
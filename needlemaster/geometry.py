@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+'''
+Point-in-polygon and segment-polygon tests for the level geometry.
+
+Edges and bounding boxes are precomputed once per polygon, and the
+containment test is a crossing-number (even-odd) test, vectorized over
+batches of points.
+Like shapely's Polygon.contains, points on the boundary are not
+contained.
+
+A segment intersects a polygon when some point of it is strictly
+inside. The segment is cut where it meets the edges, and the pieces
+between the cuts are each entirely inside or outside, so testing the
+ends and the middle of every piece is exact (up to rounding).
+'''
+from fractions import Fraction
+import numpy as np
+
+def _edges(corners):
+    ''' Start and end coordinates of every edge of a closed polygon '''
+    corners = np.asarray(corners, dtype=np.float64).reshape((-1, 2))
+    x0, y0 = corners[:, 0], corners[:, 1]
+    # Slicing is much cheaper than np.roll on a few points
+    x1 = np.concatenate([x0[1:], x0[:1]])
+    y1 = np.concatenate([y0[1:], y0[:1]])
+    return x0, y0, x1, y1
+
+# Relative error bound of the floating point cross product
+# (Shewchuk's ccwerrboundA)
+_EPS = np.finfo(np.float64).eps / 2
+_CROSS_ERR = (3.0 + 16.0 * _EPS) * _EPS
+
+def _exact_cross(cross, uncertain, x0, y0, x1, y1, px, py):
+    ''' Replace the uncertain entries of cross with their exact sign '''
+    shape = cross.shape
+    cross = cross.copy()
+    args = [np.broadcast_to(a, shape) for a in (x0, y0, x1, y1, px, py)]
+    for idx in zip(*np.nonzero(uncertain)):
+        ax0, ay0, ax1, ay1, apx, apy = [Fraction(float(a[idx])) for a in args]
+        exact = (ax1 - ax0) * (apy - ay0) - (ay1 - ay0) * (apx - ax0)
+        cross[idx] = (exact > 0) - (exact < 0)
+    return cross
+
+def _cross(x0, y0, x1, y1, px, py):
+    ''' Side of the edge the point is on (0 when collinear), for one point '''
+    left = (x1 - x0) * (py - y0)
+    right = (y1 - y0) * (px - x0)
+    cross = left - right
+    if abs(cross) <= _CROSS_ERR * (abs(left) + abs(right)) and (left or right):
+        x0, y0, x1, y1, px, py = [Fraction(a) for a in (x0, y0, x1, y1, px, py)]
+        exact = (x1 - x0) * (py - y0) - (y1 - y0) * (px - x0)
+        return (exact > 0) - (exact < 0)
+    return cross
+
+def _contains_point(edges, px, py):
+    ''' Crossing-number test of one point against a list of edges.
+        Plain Python is faster than NumPy for a handful of edges.
+    '''
+    inside = False
+    for x0, y0, x1, y1 in edges:
+        straddle = (y0 > py) != (y1 > py)
+        if not straddle and not (min(x0, x1) <= px <= max(x0, x1) and
+                min(y0, y1) <= py <= max(y0, y1)):
+            continue
+        cross = _cross(x0, y0, x1, y1, px, py)
+        if cross == 0:
+            if (min(x0, x1) <= px <= max(x0, x1) and
+                    min(y0, y1) <= py <= max(y0, y1)):
+                return False # on the boundary
+        elif straddle and (cross > 0) == (y1 > y0):
+            inside = not inside
+    return inside
+
+def _segment_cuts(edges, ax, ay, bx, by):
+    ''' Parameters in (0, 1) along the segment from a to b where it meets
+        an edge. Edges parallel to the segment are skipped: where the
+        segment runs along one, the neighbouring edges cut it.
+    '''
+    dx, dy = bx - ax, by - ay
+    cuts = []
+    for x0, y0, x1, y1 in edges:
+        ex, ey = x1 - x0, y1 - y0
+        denom = dx * ey - dy * ex
+        if denom == 0:
+            continue
+        t = ((x0 - ax) * ey - (y0 - ay) * ex) / denom
+        u = ((x0 - ax) * dy - (y0 - ay) * dx) / denom
+        if 0. < t < 1. and 0. <= u <= 1.:
+            cuts.append(t)
+    return cuts
+
+def _segment_points(x0, y0, x1, y1, ax, ay, bx, by):
+    ''' Vectorized _segment_cuts for segments of shape [N, 1] against edges.
+        Returns the test points of every segment, shape [N, E + 3]: its
+        ends and the middle of every piece between cuts.
+    '''
+    dx, dy = bx - ax, by - ay
+    ex, ey = x1 - x0, y1 - y0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denom = dx * ey - dy * ex
+        t = ((x0 - ax) * ey - (y0 - ay) * ex) / denom
+        u = ((x0 - ax) * dy - (y0 - ay) * dx) / denom
+        cut = (denom != 0) & (t > 0.) & (t < 1.) & (u >= 0.) & (u <= 1.)
+    # Edges that do not cut give empty pieces at the end
+    n = t.shape[0]
+    zeros, ones = np.zeros((n, 1)), np.ones((n, 1))
+    t = np.concatenate([zeros, np.sort(np.where(cut, t, 1.), axis=-1), ones],
+        axis=-1)
+    params = np.concatenate([zeros, (t[:, :-1] + t[:, 1:]) / 2, ones],
+        axis=-1)
+    return ax + params * dx, ay + params * dy
+
+def _contains(x0, y0, x1, y1, px, py):
+    ''' Crossing-number test of points against edges.
+        Edge arrays broadcast against the point arrays: the last axis
+        is the edge axis. NaN edges are ignored (used for padding).
+    '''
+    with np.errstate(invalid='ignore'):
+        # Side of the edge the point is on (0 when collinear)
+        left = (x1 - x0) * (py - y0)
+        right = (y1 - y0) * (px - x0)
+        cross = left - right
+
+        # Points very close to an edge: recompute the sign exactly
+        uncertain = np.abs(cross) <= _CROSS_ERR * (np.abs(left) + np.abs(right))
+        uncertain &= (left != 0) | (right != 0)
+        if uncertain.any():
+            cross = _exact_cross(cross, uncertain, x0, y0, x1, y1, px, py)
+
+        # Edges straddling the horizontal ray going right from the point.
+        # The ray hits an edge when the point lies to its left for an
+        # upward edge and to its right for a downward one.
+        straddle = (y0 > py) != (y1 > py)
+        hit = straddle & (cross != 0) & ((cross > 0) == (y1 > y0))
+        crossings = np.count_nonzero(hit, axis=-1)
+
+        # Exclude points lying on an edge
+        on_edge = ((cross == 0) &
+                   (px >= np.fmin(x0, x1)) & (px <= np.fmax(x0, x1)) &
+                   (py >= np.fmin(y0, y1)) & (py <= np.fmax(y0, y1)))
+    return (crossings % 2 == 1) & ~on_edge.any(axis=-1)
+
+class Polygon:
+    ''' Simple polygon with precomputed edges and bounding box '''
+
+    def __init__(self, corners):
+        self.x0, self.y0, self.x1, self.y1 = _edges(corners)
+        self.min_x, self.max_x = self.x0.min(), self.x0.max()
+        self.min_y, self.max_y = self.y0.min(), self.y0.max()
+        self.edges = list(zip(self.x0.tolist(), self.y0.tolist(),
+            self.x1.tolist(), self.y1.tolist()))
+
+    def contains(self, x, y):
+        ''' Whether the point (x, y) is strictly inside the polygon '''
+        if (x <= self.min_x or x >= self.max_x or
+                y <= self.min_y or y >= self.max_y):
+            return False
+        return _contains_point(self.edges, float(x), float(y))
+
+    def contains_points(self, x, y):
+        ''' Vectorized contains for arrays of x and y. Returns a bool array '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        inside = ((x > self.min_x) & (x < self.max_x) &
+                  (y > self.min_y) & (y < self.max_y))
+        idx = np.nonzero(inside)
+        if len(idx[0]) > 0:
+            inside[idx] = _contains(self.x0, self.y0, self.x1, self.y1,
+                x[idx][..., None], y[idx][..., None])
+        return inside
+
+    def intersects_segment(self, ax, ay, bx, by):
+        ''' Whether some point of the segment from (ax, ay) to (bx, by) is
+            strictly inside the polygon '''
+        if (max(ax, bx) <= self.min_x or min(ax, bx) >= self.max_x or
+                max(ay, by) <= self.min_y or min(ay, by) >= self.max_y):
+            return False
+        if self.contains(ax, ay) or self.contains(bx, by):
+            return True
+        ax, ay, bx, by = float(ax), float(ay), float(bx), float(by)
+        # The ends may both lie on the boundary, so test the middle even
+        # with no cuts
+        cuts = [0.] + sorted(_segment_cuts(self.edges, ax, ay, bx, by)) + [1.]
+        for t0, t1 in zip(cuts[:-1], cuts[1:]):
+            t = (t0 + t1) / 2
+            if t1 > t0 and self.contains(ax + t * (bx - ax),
+                    ay + t * (by - ay)):
+                return True
+        return False
+
+    def intersects_segments(self, ax, ay, bx, by):
+        ''' Vectorized intersects_segment for arrays of segment ends.
+            Returns a bool array '''
+        ax, ay, bx, by = [np.asarray(a, dtype=np.float64).ravel()
+            for a in (ax, ay, bx, by)]
+        near = ((np.fmax(ax, bx) > self.min_x) & (np.fmin(ax, bx) < self.max_x) &
+                (np.fmax(ay, by) > self.min_y) & (np.fmin(ay, by) < self.max_y))
+        hit = np.zeros(near.shape, dtype=bool)
+        idx = np.nonzero(near)[0]
+        if len(idx) > 0:
+            px, py = _segment_points(self.x0, self.y0, self.x1, self.y1,
+                ax[idx, None], ay[idx, None], bx[idx, None], by[idx, None])
+            inside = _contains(self.x0, self.y0, self.x1, self.y1,
+                px[..., None], py[..., None])
+            hit[idx] = inside.any(axis=-1)
+        return hit
+
+class PolygonSet:
+    ''' A group of polygons tested together.
+        Edges are padded with NaN to a common count so that a batch of
+        points is tested against every polygon in one vectorized call.
+    '''
+
+    def __init__(self, polygons):
+        self.polygons = list(polygons)
+        n = len(self.polygons)
+        max_edges = max([len(p.x0) for p in self.polygons] + [0])
+        self.x0, self.y0, self.x1, self.y1 = [
+            np.full((n, max_edges), np.nan) for _ in range(4)]
+        for i, p in enumerate(self.polygons):
+            e = len(p.x0)
+            self.x0[i, :e] = p.x0
+            self.y0[i, :e] = p.y0
+            self.x1[i, :e] = p.x1
+            self.y1[i, :e] = p.y1
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def contains(self, x, y):
+        ''' List of bools telling which polygons contain the point (x, y) '''
+        return [p.contains(x, y) for p in self.polygons]
+
+    def contains_points(self, x, y):
+        ''' Mask of shape [N, len(polygons)] for arrays of N points '''
+        x = np.asarray(x, dtype=np.float64).reshape((-1, 1, 1))
+        y = np.asarray(y, dtype=np.float64).reshape((-1, 1, 1))
+        return _contains(self.x0, self.y0, self.x1, self.y1, x, y)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+'''
+Binary level files.
+
+A file holds one level or more (a pack). Each level is stored as the
+values of its text level file (see environment.parse_level), in
+little-endian arrays:
+
+    header   '<4sHHI': b'NMLV', version, float size (4 or 8), level count
+    index    '<IIIIIQ' per level: width, height, gates, surfaces,
+             surface points, offset of the level's arrays
+    names    '<I' byte count, then the level names, one per line (utf-8)
+    arrays   for each level, each array starting on 8 bytes:
+               gate_pos         [gates, 3] float (x, y, w)
+               gate_geometry    [gates, 3, 4, 2] float (corners, top, bottom)
+               surface_xy       [points, 2] float
+               surface_offsets  [surfaces + 1] uint32
+               surface_deep     [surfaces] uint8
+
+LevelPack memory-maps a file, so opening a pack of thousands of levels
+reads only its index, and each level is read when it is first used.
+'''
+import os
+import struct
+import numpy as np
+
+from .environment import Level, parse_level
+
+MAGIC = b'NMLV'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+ENTRY = struct.Struct('<IIIIIQ')
+NAMES = struct.Struct('<I')
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+def _level_arrays(level, dtype):
+    return [np.ascontiguousarray(level['gate_pos'], dtype=dtype),
+            np.ascontiguousarray(level['gate_geometry'], dtype=dtype),
+            np.ascontiguousarray(level['surface_xy'], dtype=dtype),
+            np.ascontiguousarray(level['surface_offsets'], dtype='<u4'),
+            np.ascontiguousarray(level['surface_deep'], dtype=np.uint8)]
+
+def write_levels(filename, levels, names=None, dtype=np.float32):
+    ''' Write levels to a binary level file.
+        @param levels: dicts of level values, as returned by parse_level
+        @param names: a name per level (e.g. the text file it came from)
+        @param dtype: float32, or float64 to keep the text values exactly
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype.kind != 'f' or dtype.itemsize not in (4, 8):
+        raise ValueError('Levels are stored as float32 or float64, not ' +
+            str(dtype))
+    if names is None:
+        names = [''] * len(levels)
+    names = '\n'.join(names).encode('utf-8')
+
+    entries = []
+    blocks = []
+    offset = _align(HEADER.size + ENTRY.size * len(levels) + NAMES.size +
+        len(names))
+    for level in levels:
+        entries.append(ENTRY.pack(level['width'], level['height'],
+            len(level['gate_pos']), len(level['surface_deep']),
+            len(level['surface_xy']), offset))
+        for a in _level_arrays(level, dtype):
+            data = a.tobytes()
+            blocks.append(data + b'\0' * (_align(len(data)) - len(data)))
+            offset += len(blocks[-1])
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, dtype.itemsize, len(levels)))
+        f.write(b''.join(entries))
+        f.write(NAMES.pack(len(names)))
+        f.write(names)
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+        for block in blocks:
+            f.write(block)
+
+def convert_levels(filenames, output, dtype=np.float32):
+    ''' Convert text level files into one binary level file, naming each
+        level after its file '''
+    levels = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            levels.append(parse_level(f))
+    write_levels(output, levels,
+        [os.path.basename(f) for f in filenames], dtype)
+
+class LevelPack:
+    ''' The levels of a binary level file, memory-mapped.
+        pack[i] is the Level (parsed on first use), pack.names[i] its name.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, version, float_size, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(filename + ' is not a binary level file')
+        if version != VERSION:
+            raise ValueError('{} has version {}, expected {}'.format(
+                filename, version, VERSION))
+        self.dtype = np.dtype('<f{}'.format(float_size))
+        self.entries = [ENTRY.unpack_from(self.data, HEADER.size + i *
+            ENTRY.size) for i in range(count)]
+        start = HEADER.size + count * ENTRY.size
+        length = NAMES.unpack_from(self.data, start)[0]
+        start += NAMES.size
+        names = bytes(self.data[start:start + length]).decode('utf-8')
+        self.names = names.split('\n') if count > 0 else []
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def arrays(self, i):
+        ''' Values of level i, as views into the file (see parse_level) '''
+        width, height, ngates, nsurfaces, npoints, offset = self.entries[i]
+        shapes = [((ngates, 3), self.dtype),
+                  ((ngates, 3, 4, 2), self.dtype),
+                  ((npoints, 2), self.dtype),
+                  ((nsurfaces + 1,), np.dtype('<u4')),
+                  ((nsurfaces,), np.dtype(np.uint8))]
+        arrays = []
+        for shape, dtype in shapes:
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(self.data, dtype=dtype, count=count,
+                offset=offset).reshape(shape))
+            offset += _align(count * dtype.itemsize)
+        gate_pos, gate_geometry, surface_xy, surface_offsets, surface_deep = \
+            arrays
+        return dict(width=width, height=height, gate_pos=gate_pos,
+                gate_geometry=gate_geometry, surface_deep=surface_deep,
+                surface_offsets=surface_offsets, surface_xy=surface_xy)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('level {} out of range'.format(i))
+        level = self._levels.get(i)
+        if level is None:
+            level = Level.from_arrays(**self.arrays(i))
+            self._levels[i] = level
+        return level
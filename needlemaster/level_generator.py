@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+'''
+Seeded procedural levels.
+
+LevelGenerator draws levels like the hand-made ones in data/: gates from
+left to right, each a box whose long axis is tilted at most max_tilt from
+vertical, and tissue hills rising from the bottom edge, some with deep
+tissue inside. Levels are valid by construction or rejection:
+
+    * gates lie inside the window and do not overlap
+    * deep tissue touches no gate and does not cross the straight path
+      from the needle's start through the centers of the gates in order
+
+Level i of a seed is the same whatever was generated before it, so
+processes can share a seed and generate levels on the fly:
+
+    generator = LevelGenerator(seed)
+    env.set_level(generator.level(i))
+'''
+import math
+import random
+import numpy as np
+
+from .environment import Level, write_level
+from .geometry import Polygon
+
+# Gate proportions of the hand-made levels, relative to the gate's length:
+# its width, and the depth of the top and bottom walls
+GATE_WIDTH = 0.6
+GATE_WALL = 1. / 10.8
+
+# Where Needle starts, as a (x, y from the top) tip position
+NEEDLE_START = (96., 108.)
+
+def gate_geometry(x, y, w, length, height):
+    ''' Corners, top and bottom of a gate as in a level file: [3, 4, 2]
+        points with y from the top of the window.
+        @param x, y: center, with y from the bottom as in GatePos
+        @param w: angle of the gate's long axis
+    '''
+    cx, cy = x, height - y
+    ux, uy = math.cos(w), math.sin(w)
+    vx, vy = uy, -ux
+    half_l, half_w = length / 2., GATE_WIDTH * length / 2.
+    inner = half_l - GATE_WALL * length
+    def point(a, b):
+        return [cx + a * ux + b * vx, cy + a * uy + b * vy]
+    return np.array([
+        [point(half_l, half_w), point(-half_l, half_w),
+         point(-half_l, -half_w), point(half_l, -half_w)],
+        [point(half_l, half_w), point(inner, half_w),
+         point(inner, -half_w), point(half_l, -half_w)],
+        [point(-half_l, half_w), point(-inner, half_w),
+         point(-inner, -half_w), point(-half_l, -half_w)]])
+
+def _overlaps(a, b):
+    ''' Whether two polygons overlap: an edge of one crosses the other,
+        or one holds the other '''
+    if (a.max_x <= b.min_x or b.max_x <= a.min_x or
+            a.max_y <= b.min_y or b.max_y <= a.min_y):
+        return False
+    for p, q in [(a, b), (b, a)]:
+        x0, y0, x1, y1 = np.array(p.edges).T
+        if q.intersects_segments(x0, y0, x1, y1).any():
+            return True
+    return False
+
+class LevelGenerator(object):
+    ''' Random levels from a seed.
+
+        @param gates: (min, max) number of gates
+        @param gate_size: (min, max) gate length, relative to the height
+        @param gate_spacing: least horizontal distance between consecutive
+                             gates, relative to the width
+        @param max_tilt: most the gates turn from vertical, in radians
+        @param surfaces: (min, max) number of tissue hills
+        @param deep_prob: chance a hill has deep tissue inside
+    '''
+    def __init__(self, seed=0, width=1920, height=1080, gates=(1, 4),
+            gate_size=(0.1, 0.2), gate_spacing=0.15, max_tilt=math.pi / 4,
+            surfaces=(0, 2), deep_prob=0.5, x_range=(0.15, 0.9),
+            y_range=(0.1, 0.9), retries=5):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.gates = gates
+        self.gate_size = gate_size
+        self.gate_spacing = gate_spacing
+        self.max_tilt = max_tilt
+        self.surfaces = surfaces
+        self.deep_prob = deep_prob
+        self.x_range = x_range
+        self.y_range = y_range
+        self.retries = retries
+        self.count = 0
+
+    def _gates(self, rng):
+        x0, x1 = self.x_range
+        # Fewer gates if they do not fit at this spacing
+        most = int((x1 - x0) / self.gate_spacing) + 1
+        n = rng.randint(self.gates[0], min(self.gates[1], most))
+        pos = np.zeros((n, 3))
+        geometry = np.zeros((n, 3, 4, 2))
+        polys = []
+        if n == 0:
+            return pos, geometry, polys
+        slack = (x1 - x0) - (n - 1) * self.gate_spacing
+        xs = sorted(rng.uniform(0., slack) for _ in range(n))
+        xs = [x0 + i * self.gate_spacing + x for i, x in enumerate(xs)]
+        for i in range(n):
+            for _ in range(self.retries):
+                pos[i], geometry[i] = self._gate(rng, xs[i])
+                poly = Polygon(geometry[i, 0])
+                if not any(_overlaps(poly, p) for p in polys):
+                    break
+            else:
+                # No room for this gate, so the level has fewer
+                return pos[:i], geometry[:i], polys
+            polys.append(poly)
+        return pos, geometry, polys
+
+    def _gate(self, rng, x):
+        length = rng.uniform(*self.gate_size) * self.height
+        w = math.pi / 2 + rng.uniform(-self.max_tilt, self.max_tilt)
+        if w > math.pi / 2:
+            w -= math.pi
+        # Keep the whole box inside the window
+        c, s = abs(math.cos(w)), abs(math.sin(w))
+        half_x = (c * length + s * GATE_WIDTH * length) / 2.
+        half_y = (s * length + c * GATE_WIDTH * length) / 2.
+        x = min(max(x * self.width, half_x), self.width - half_x)
+        y = rng.uniform(max(self.y_range[0] * self.height, half_y),
+            min(self.y_range[1] * self.height, self.height - half_y))
+        pos = [round(x / self.width, 4), round(y / self.height, 4), w]
+        return pos, np.round(gate_geometry(pos[0] * self.width,
+            pos[1] * self.height, w, length, self.height), 4)
+
+    def _hill(self, rng):
+        ''' A hill of tissue rising from the bottom edge, y from the
+            bottom '''
+        span = rng.uniform(0.2, 0.6) * self.width
+        x0 = rng.uniform(0., self.width - span)
+        k = rng.randint(1, 3)
+        xs = sorted(x0 + rng.uniform(0.1, 0.9) * span for _ in range(k))
+        return np.array([[x0, 0.]] +
+            [[x, rng.uniform(0.2, 0.8) * self.height] for x in xs] +
+            [[x0 + span, 0.]])
+
+    def _deep(self, rng, hill, scale):
+        ''' Deep tissue inside a hill: the middle of its span, scaled down '''
+        x0, x1 = hill[0, 0], hill[-1, 0]
+        a, b = sorted([rng.uniform(0.1, 0.9), rng.uniform(0.1, 0.9)])
+        xs = np.linspace(x0 + a * (x1 - x0), x0 + b * (x1 - x0), 3)
+        ys = scale * np.interp(xs[1:2], hill[:, 0], hill[:, 1])
+        return np.array([[xs[0], 0.], [xs[1], ys[0]], [xs[2], 0.]])
+
+    def _blocks(self, deep, gate_polys, path):
+        ''' Whether deep tissue (y from the bottom) touches a gate or
+            crosses the path '''
+        poly = Polygon(np.stack([deep[:, 0], self.height - deep[:, 1]], 1))
+        if poly.intersects_segments(*path).any():
+            return True
+        return any(_overlaps(poly, gate) for gate in gate_polys)
+
+    def arrays(self, index=None):
+        ''' Values of a level, as parse_level returns them. Without an
+            index, the next level of the seed '''
+        if index is None:
+            index = self.count
+            self.count += 1
+        # Seeding random.Random is far cheaper than a NumPy RandomState
+        rng = random.Random(self.seed * 2 ** 32 + index)
+
+        gate_pos, geometry, gate_polys = self._gates(rng)
+        points = np.concatenate([[NEEDLE_START],
+            geometry[:, 0].mean(axis=1)]) if len(geometry) else \
+            np.zeros((1, 2))
+        path = (points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+
+        polygons, deep = [], []
+        for _ in range(rng.randint(*self.surfaces)):
+            hill = self._hill(rng)
+            polygons.append(hill)
+            deep.append(False)
+            if rng.random() >= self.deep_prob:
+                continue
+            scale = rng.uniform(0.4, 0.8)
+            for _ in range(self.retries):
+                tissue = self._deep(rng, hill, scale)
+                if not self._blocks(tissue, gate_polys, path):
+                    polygons.append(tissue)
+                    deep.append(True)
+                    break
+                scale *= 0.5
+
+        offsets = np.zeros(len(polygons) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(p) for p in polygons])
+        xy = np.round(np.concatenate(polygons), 4) if polygons else \
+            np.zeros((0, 2))
+        return dict(width=self.width, height=self.height, gate_pos=gate_pos,
+                gate_geometry=geometry,
+                surface_deep=np.array(deep, dtype=np.uint8),
+                surface_offsets=offsets, surface_xy=xy)
+
+    def level(self, index=None):
+        ''' A Level, see arrays '''
+        return Level.from_arrays(**self.arrays(index))
+
+    def write(self, filename, index=None):
+        ''' Write a level as a text level file and return its values '''
+        values = self.arrays(index)
+        with open(filename, 'w') as f:
+            write_level(f, **values)
+        return values
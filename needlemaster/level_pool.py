@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+
+from .environment import Environment, load_level, load_level_pack
+from .level_stats import INDEX_NAME, load_index
+
+SAMPLING = ['uniform', 'weighted', 'curriculum']
+
+def level_files(path):
+    ''' Level names and load_level paths of a directory (its
+        environment_*.txt files and the levels of its .nml packs) or of
+        a binary pack '''
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path)
+            if (f.startswith('environment_') and f.endswith('.txt')) or
+            f.endswith('.nml'))
+    else:
+        files = [path]
+    names, paths = [], []
+    for f in files:
+        if f.endswith('.nml'):
+            pack = load_level_pack(f)
+            for i in range(len(pack)):
+                names.append(pack.names[i] or
+                    '{}:{}'.format(os.path.basename(f), i))
+                paths.append('{}:{}'.format(f, i))
+        else:
+            names.append(os.path.basename(f))
+            paths.append(f)
+    return names, paths
+
+def is_level_pool(path):
+    ''' A directory or a whole binary pack holds a pool of levels '''
+    return os.path.isdir(path) or path.endswith('.nml')
+
+def make_environment(**kwargs):
+    ''' An Environment for a level file, or a LevelPoolEnvironment for a
+        directory or pack '''
+    if is_level_pool(kwargs.get('filename') or ''):
+        return LevelPoolEnvironment(**kwargs)
+    for key in ['level_sampling', 'level_filter']:
+        kwargs.pop(key, None)
+    return Environment(**kwargs)
+
+class LevelPoolEnvironment(Environment):
+    ''' An Environment that plays a level drawn from a pool at each reset.
+
+        Every level of the pool is loaded once, when the pool is created, so
+        one process can train across all of them. The level of the current
+        episode is env.level_id (its index) and env.info['level'] (its
+        name).
+
+        level_sampling chooses the level drawn:
+            uniform     any level alike
+            weighted    in proportion to level_weights
+            curriculum  favoring levels whose gates are rarely passed: each
+                        level's score is a running average of the fraction
+                        of gates passed in its episodes, and levels are
+                        drawn in proportion to 1 - score, mixed with
+                        curriculum_floor of uniform sampling
+
+        level_filter keeps only the levels whose record in a level_stats
+        index passes it, e.g. level_stats.solvable. The index is
+        level_index, by default level_index.json next to the levels.
+        level_weights are for the levels kept.
+
+        The state has a flag per gate, so it is padded to max_gates gates,
+        by default the most gates of a level in the pool, and keeps one
+        size across levels.
+    '''
+    def __init__(self, mode, stack_size, filename=None,
+            level_sampling='uniform', level_weights=None, level_filter=None,
+            level_index=None, curriculum_rate=0.1, curriculum_floor=0.1,
+            max_gates=None, **kwargs):
+        if level_sampling not in SAMPLING:
+            raise ValueError(level_sampling + ' is not a level sampling, '
+                'options are ' + ', '.join(SAMPLING))
+        self.level_names, paths = level_files(filename)
+        if level_filter is not None:
+            # Keep the levels whose level_stats record passes the filter
+            if level_index is None:
+                directory = filename if os.path.isdir(filename) else \
+                    os.path.dirname(filename)
+                level_index = os.path.join(directory, INDEX_NAME)
+            records = load_index(level_index)
+            keep = [i for i, name in enumerate(self.level_names)
+                if name in records and level_filter(records[name])]
+            self.level_names = [self.level_names[i] for i in keep]
+            paths = [paths[i] for i in keep]
+        if not paths:
+            raise ValueError('No levels in ' + filename)
+        self.levels = [load_level(p) for p in paths]
+        most = max(level.ngates for level in self.levels)
+        if max_gates is None:
+            max_gates = most
+        elif max_gates < most:
+            raise ValueError('A level has {} gates, more than max_gates {}'
+                .format(most, max_gates))
+        self.level_sampling = level_sampling
+        if level_weights is None:
+            level_weights = np.ones(len(self.levels))
+        level_weights = np.asarray(level_weights, dtype=np.float64)
+        if level_weights.shape != (len(self.levels),):
+            raise ValueError('{} level weights for {} levels'.format(
+                len(level_weights), len(self.levels)))
+        self.level_weights = level_weights / level_weights.sum()
+        self.curriculum_rate = curriculum_rate
+        self.curriculum_floor = curriculum_floor
+        self.level_scores = np.zeros(len(self.levels))
+        self.level_episodes = np.zeros(len(self.levels), dtype=np.int64)
+        self.level_id = None
+        self.info = {}
+        # The pool picks the level, not the file
+        Environment.__init__(self, mode, stack_size, filename=None,
+            max_gates=max_gates, **kwargs)
+
+    def level_probabilities(self):
+        n = len(self.levels)
+        if self.level_sampling == 'weighted':
+            return self.level_weights
+        elif self.level_sampling == 'curriculum':
+            p = 1. - self.level_scores
+            if p.sum() <= 0.:
+                return np.full(n, 1. / n)
+            return ((1. - self.curriculum_floor) * p / p.sum() +
+                self.curriculum_floor / n)
+        return np.full(n, 1. / n)
+
+    def _episode_score(self):
+        ''' Fraction of the gates passed in the episode so far '''
+        if self.ngates == 0:
+            return 1.
+        passed = sum(1 for g in self.gates if g.status == 'passed')
+        return float(passed) / self.ngates
+
+    def end_episode(self):
+        ''' Count the current episode in its level's score. Called by reset,
+            for episodes that took at least one step '''
+        i = self.level_id
+        if i is None or self.t == 0:
+            return
+        score = self._episode_score()
+        if self.level_episodes[i] == 0:
+            self.level_scores[i] = score
+        else:
+            self.level_scores[i] += self.curriculum_rate * (score -
+                self.level_scores[i])
+        self.level_episodes[i] += 1
+
+    def reset(self, random_needle=False, level_id=None):
+        ''' Start an episode on level level_id, or on a level drawn from
+            the pool '''
+        self.end_episode()
+        if level_id is None:
+            level_id = np.random.choice(len(self.levels),
+                p=self.level_probabilities())
+        level = self.levels[level_id]
+        # The screens are sized for the first level
+        if self.is_init and (level.width, level.height) != (self.width,
+                self.height):
+            self.is_init = False
+        if level is not self.level:
+            self.set_level(level)
+        self.level_id = level_id
+        self.info = {'level': self.level_names[level_id],
+                     'level_id': level_id}
+        return Environment.reset(self, random_needle=random_needle)
+
+    def get_state(self):
+        snapshot = Environment.get_state(self)
+        snapshot['level_id'] = self.level_id
+        return snapshot
+
+    def set_state(self, snapshot):
+        ''' Restore a snapshot, switching to its level if needed '''
+        level_id = snapshot['level_id']
+        if self.levels[level_id] is not self.level:
+            self.set_level(self.levels[level_id])
+        self.level_id = level_id
+        self.info = {'level': self.level_names[level_id],
+                     'level_id': level_id}
+        return Environment.set_state(self, snapshot)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+'''
+Level statistics and solvability, precomputed for a level pool.
+
+level_record(env, name) describes the level loaded in an environment:
+
+    ngates, nsurfaces, ndeep  counts of gates, surfaces and deep surfaces
+    gate_distances            lengths of the straight path from the needle
+                              start through the gate centers, in pixels
+    path_length               their sum
+    turning_angles            turns of that path in degrees, the first
+                              from the needle's starting heading
+    max_turn                  the largest of them
+    tissue_area, deep_area    fractions of the window covered by any
+                              tissue and by deep tissue
+    solvable                  whether the PID controller passed every gate
+                              headless, without deep tissue or too much
+                              damage. A False is a hint, not a proof: the
+                              controller steers straight at the gates.
+    pid_outcome               'solved', 'deep_tissue', 'damage', 'missed'
+                              (a gate failed or left) or 'timeout'
+    pid_steps, pid_gates_passed, pid_reward
+
+build_index runs level_record over many levels in worker processes and
+writes the records to a JSON index, which LevelPoolEnvironment can filter
+its levels on.
+'''
+import json
+import multiprocessing
+import numpy as np
+
+from .environment import Environment, PID, load_level
+
+# Name of a directory's index, looked for by LevelPoolEnvironment
+INDEX_NAME = 'level_index.json'
+# Spacing of the grid of points that estimates tissue areas, in pixels
+AREA_GRID = 8
+PID_GAINS = (1., 0., 0.)
+
+def _path(env):
+    ''' Needle start and gate centers, with y up as the needle has it '''
+    points = [(96., env.height - 108.)]
+    points += [(g.x, g.y) for g in env.gates]
+    return np.array(points)
+
+def _areas(env):
+    ''' Fractions of the window covered by tissue and by deep tissue '''
+    if env.nsurfaces == 0:
+        return 0., 0.
+    # Only the grid points in the bounding box of the surfaces can be in one
+    polys = env.surface_polys.polygons
+    x0, x1 = min(p.min_x for p in polys), max(p.max_x for p in polys)
+    y0, y1 = min(p.min_y for p in polys), max(p.max_y for p in polys)
+    grid = np.arange(AREA_GRID / 2., max(env.width, env.height), AREA_GRID)
+    xs = grid[(grid > x0) & (grid < min(x1, env.width))]
+    ys = grid[(grid > y0) & (grid < min(y1, env.height))]
+    x, y = np.meshgrid(xs, ys)
+    inside = env.surface_polys.contains_points(x.ravel(), y.ravel())
+    deep = np.array([s.deep for s in env.surfaces], dtype=bool)
+    cells = float(len(grid[grid < env.width]) * len(grid[grid < env.height]))
+    return (float(inside.any(axis=1).sum()) / cells,
+            float(inside[:, deep].any(axis=1).sum()) / cells)
+
+def pid_rollout(env, gains=PID_GAINS):
+    ''' Play an episode of the current level with the PID controller,
+        without recording.
+        @returns outcome, steps, gates passed, total reward
+    '''
+    env.reset()
+    env.record = False
+    pid = PID(gains, env.width, env.height)
+    done = False
+    while not done:
+        prev_tip = env.needle.tip if env.swept_collision else None
+        _, _, done = env.step(pid.steer(env))
+    passed = sum(1 for g in env.gates if g.status == 'passed')
+    if env._deep_tissue_intersect(prev_tip):
+        outcome = 'deep_tissue'
+    elif env.damage > 100:
+        outcome = 'damage'
+    elif passed == env.ngates:
+        outcome = 'solved'
+    elif any(g.status == 'failed' for g in env.gates):
+        outcome = 'missed'
+    else:
+        outcome = 'timeout'
+    return outcome, env.t, passed, float(env.total_reward)
+
+def level_record(env, name, gains=PID_GAINS):
+    ''' Statistics record of the level loaded in env (see the module) '''
+    points = _path(env)
+    legs = np.diff(points, axis=0)
+    distances = np.sqrt((legs ** 2).sum(axis=1))
+    # The needle starts facing right
+    headings = np.concatenate([[0.], np.arctan2(legs[:, 1], legs[:, 0])])
+    turns = (np.diff(headings) + np.pi) % (2 * np.pi) - np.pi
+    turns = np.degrees(np.abs(turns))
+    tissue_area, deep_area = _areas(env)
+    outcome, steps, passed, reward = pid_rollout(env, gains)
+    return {'name': name,
+            'ngates': env.ngates,
+            'nsurfaces': env.nsurfaces,
+            'ndeep': sum(1 for s in env.surfaces if s.deep),
+            'gate_distances': [round(float(d), 2) for d in distances],
+            'path_length': round(float(distances.sum()), 2),
+            'turning_angles': [round(float(a), 2) for a in turns],
+            'max_turn': round(float(turns.max()), 2) if len(turns) else 0.,
+            'tissue_area': round(tissue_area, 4),
+            'deep_area': round(deep_area, 4),
+            'solvable': outcome == 'solved',
+            'pid_outcome': outcome,
+            'pid_steps': steps,
+            'pid_gates_passed': passed,
+            'pid_reward': round(reward, 4)}
+
+# One environment per worker process, reused for all its levels
+_worker_env = None
+
+def _record(job):
+    global _worker_env
+    name, path, env_kwargs = job
+    if _worker_env is None:
+        _worker_env = Environment('state', 1, filename=path,
+            async_record=False, **env_kwargs)
+    env = _worker_env
+    if path.endswith('.txt'):
+        with open(path, 'r') as f:
+            env.load(f)
+    else:
+        env.set_level(load_level(path))
+    try:
+        return level_record(env, name)
+    except Exception as e:
+        return {'name': name, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+def build_index(names, paths, output, workers=None, env_kwargs=None,
+        progress=None):
+    ''' Write the records of levels to a JSON index, computing them in
+        workers processes (all CPUs by default).
+        @param paths: load_level paths of the levels, named by names
+        @param progress: called with the count of records done so far
+        @returns the records, in the order of names
+    '''
+    jobs = [(n, p, env_kwargs or {}) for n, p in zip(names, paths)]
+    records = []
+    if workers == 1:
+        results = map(_record, jobs)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_record, jobs, chunksize=16)
+    try:
+        for record in results:
+            records.append(record)
+            if progress is not None:
+                progress(len(records))
+    finally:
+        if workers != 1:
+            pool.terminate()
+    with open(output, 'w') as f:
+        json.dump({'levels': records}, f, indent=1)
+    return records
+
+def solvable(record):
+    ''' Level filter keeping the levels the PID controller solved '''
+    return record.get('solvable', False)
+
+def load_index(filename):
+    ''' Records of an index, by level name '''
+    with open(filename, 'r') as f:
+        return dict((r['name'], r) for r in json.load(f)['levels'])
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import atexit
+import struct
+import threading
+import traceback
+import zlib
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+import numpy as np
+import pygame
+
+def _png_chunk(tag, data):
+    chunk = tag + data
+    return (struct.pack('>I', len(data)) + chunk +
+            struct.pack('>I', zlib.crc32(chunk) & 0xffffffff))
+
+def write_png(save_file, rgb, level=6):
+    ''' Write a [H, W, 3] uint8 array as PNG.
+        zlib releases the GIL while compressing, unlike pygame.image.save,
+        so this does not hold up the training thread.
+    '''
+    height, width = rgb.shape[:2]
+    # Each row starts with filter type 0 (none)
+    rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape((height, -1))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    with open(save_file, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', header))
+        f.write(_png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level)))
+        f.write(_png_chunk(b'IEND', b''))
+
+class FrameRecorder:
+    ''' Saves frames as PNG files on a background thread.
+
+        Frames are queued as raw arrays together with their overlay text.
+        The font is created once and all drawing and encoding happens on
+        the recorder thread. When the queue is full new frames are dropped
+        (and counted) so the caller never waits on the disk. A frame that
+        fails to save is reported and counted in errors. The queued frames
+        are written at exit.
+    '''
+    def __init__(self, max_queue=64, font_name='Arial', font_size=13):
+        self.font_name = font_name
+        self.font_size = font_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.saved = 0
+        self.errors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, frame, text, save_file):
+        ''' Queue a frame for saving without blocking.
+            @param frame: uint8 array of shape [W, H, 3] (surfarray layout)
+            @returns whether the frame was queued
+        '''
+        try:
+            self.queue.put_nowait((frame, text, save_file))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _save(self, frame, text, save_file):
+        if self.font is None:
+            self.font = pygame.font.SysFont(self.font_name, self.font_size)
+        surface = pygame.surfarray.make_surface(frame)
+        if text:
+            surface.blit(self.font.render(text, False, (0, 0, 0)), (10, 10))
+        save_path = os.path.dirname(save_file)
+        if save_path and not os.path.exists(save_path):
+            os.makedirs(save_path)
+        rgb = pygame.surfarray.array3d(surface).transpose((1, 0, 2))
+        write_png(save_file, rgb)
+
+    def _run(self):
+        self.font = None
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._save(*item)
+                self.saved += 1
+            except Exception:
+                # Keep the thread alive for the next frames
+                self.errors += 1
+                sys.stderr.write('FrameRecorder: could not save {}\n'.format(
+                    item[2]))
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        ''' Wait until every queued frame has been written '''
+        self.queue.join()
+
+    def close(self):
+        ''' Write the queued frames and stop the thread '''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
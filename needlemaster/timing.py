@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+
+# Monotonic and high resolution; python 2 only has time.time
+clock = getattr(time, 'perf_counter', time.time)
+
+class StepTimers:
+    ''' Per-step phase timings, cheap enough to leave on in live runs.
+
+        Code being timed reads the clock with now() and charges the time
+        since to a phase with add(phase, start), which returns the new
+        start. A phase may be charged several times in a step. The loop
+        that owns the timers calls end_step() once per step, which keeps
+        each phase's total for the step, and log() every so often to write
+        them to TensorBoard as histograms.
+
+        Timed code holds a reference that is None when timing is off:
+
+            timers = self.timers
+            if timers is not None:
+                t = timers.now()
+            ...
+            if timers is not None:
+                t = timers.add('render', t)
+    '''
+    def __init__(self):
+        self.current = {}
+        self.samples = {}
+        self.now = clock
+
+    def add(self, phase, start):
+        now = clock()
+        self.current[phase] = self.current.get(phase, 0.) + now - start
+        return now
+
+    def end_step(self):
+        for phase, duration in self.current.items():
+            if phase in self.samples:
+                self.samples[phase].append(duration)
+            else:
+                self.samples[phase] = [duration]
+        self.current = {}
+
+    def summary(self):
+        ''' Mean, median, 99th percentile and max of each phase in ms, and
+            the number of steps the phase was seen in '''
+        stats = {}
+        for phase, samples in self.samples.items():
+            ms = 1000. * np.array(samples)
+            stats[phase] = {'mean': float(ms.mean()),
+                            'p50': float(np.percentile(ms, 50)),
+                            'p99': float(np.percentile(ms, 99)),
+                            'max': float(ms.max()),
+                            'count': len(ms)}
+        return stats
+
+    def log(self, tb_writer, step):
+        ''' Write the per-step times (in ms) to a SummaryWriter and
+            clear them '''
+        for phase, stats in self.summary().items():
+            tb_writer.add_histogram('timing/' + phase,
+                1000. * np.array(self.samples[phase]), step)
+            tb_writer.add_scalar('timing/{}_mean'.format(phase),
+                stats['mean'], step)
+            tb_writer.add_scalar('timing/{}_p99'.format(phase),
+                stats['p99'], step)
+        self.samples = {}
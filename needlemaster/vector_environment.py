@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+
+from .environment import load_level, VELOCITY, two_pi
+
+# Gate status codes, one per (needle, gate)
+GATE_NONE = 0
+GATE_NEXT = 1
+GATE_PASSED = 2
+GATE_FAILED = 3
+
+class VectorEnvironment:
+    ''' Steps N needles against the same level in one call.
+
+        All per-needle state is kept in NumPy arrays and every step is
+        batched over the needles. Kinematics and reward follow
+        Environment.step/Needle.move exactly. Only 'state' observations
+        are supported. Needles that finish an episode are reset
+        automatically: the observation returned for them is the first
+        observation of their new episode.
+    '''
+    def __init__(self, num_envs, filename, max_time=150, random_needle=False,
+            swept_collision=False):
+        self.num_envs = num_envs
+        self.filename = filename
+        self.max_time = max_time
+        self.random_needle = random_needle
+        # See Environment.swept_collision
+        self.swept_collision = swept_collision
+
+        # The level is only read, so the cached templates can be used as is
+        level = load_level(filename)
+        self.level = level
+        self.width = level.width
+        self.height = level.height
+        self.ngates = level.ngates
+        self.nsurfaces = level.nsurfaces
+        self.gates = level.gates
+        self.surfaces = level.surfaces
+
+        self.gate_x = np.array([g.x for g in self.gates], dtype=np.float64)
+        self.gate_y = np.array([g.y for g in self.gates], dtype=np.float64)
+        self.gate_w = np.array([g.w for g in self.gates], dtype=np.float64)
+        self.surface_deep = level.surface_deep
+
+        # Needle geometry constants (see Needle._compute_corners)
+        self.scale = np.sqrt(self.width ** 2 + self.height ** 2)
+        self.length = 0.12 * self.scale
+
+        n = num_envs
+        self.x = np.zeros(n)
+        self.y = np.zeros(n)
+        self.w = np.zeros(n)
+        self.dx = np.zeros(n)
+        self.dy = np.zeros(n)
+        self.dw = np.zeros(n)
+        self.t = np.zeros(n, dtype=np.int64)
+        # -1 marks that there is no next gate
+        self.next_gate = np.zeros(n, dtype=np.int64)
+        self.gate_status = np.zeros((n, self.ngates), dtype=np.int8)
+        self.surface_damage = np.zeros((n, self.nsurfaces))
+        self.damage = np.zeros(n)
+        # nan marks that there is no last distance
+        self.last_dist = np.zeros(n)
+        self.total_reward = np.zeros(n)
+        self.done = np.zeros(n, dtype=bool)
+        # Total reward of the last finished episode of each needle
+        self.episode_reward = np.zeros(n)
+
+        self.reset()
+
+    def reset(self, mask=None):
+        ''' Reset the needles selected by the boolean mask (all by default)
+            and return the observations of all needles
+        '''
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        count = int(mask.sum())
+
+        if self.random_needle:
+            self.x[mask] = np.random.randint(0, self.width, size=count)
+            self.y[mask] = np.random.randint(0, self.height, size=count)
+            self.w[mask] = np.random.random(size=count) * two_pi
+        else:
+            self.x[mask] = 96
+            self.y[mask] = self.height - 108
+            self.w[mask] = math.pi # face right
+        self.dx[mask] = 0.
+        self.dy[mask] = 0.
+        self.dw[mask] = 0.
+        self.t[mask] = 0
+        self.damage[mask] = 0.
+        self.surface_damage[mask] = 0.
+        self.last_dist[mask] = np.nan
+        self.total_reward[mask] = 0.
+        self.done[mask] = False
+
+        self.gate_status[mask] = GATE_NONE
+        if self.ngates > 0:
+            self.next_gate[mask] = 0
+            self.gate_status[mask, 0] = GATE_NEXT
+        else:
+            self.next_gate[mask] = -1
+
+        return self._get_state()
+
+    def _tip_in_surfaces(self):
+        ''' Returns a [N, nsurfaces] mask of the tips inside each surface '''
+        return self.level.surface_polys.contains_points(
+                self.x, self.height - self.y)
+
+    def _move(self, dw, in_tissue):
+        ''' Batched Needle.action2motion and Needle.move '''
+        dw = np.clip(dw, -math.pi, math.pi)
+        dx = np.cos(math.pi - self.w - dw) * VELOCITY
+        dy = -np.sin(math.pi - self.w - dw) * VELOCITY
+
+        dw = np.where(in_tissue, dw * 0.5, dw)
+        dw = np.where(in_tissue & (np.abs(dw) > 0.01), 0.02 * np.sign(dw), dw)
+
+        self.w += dw
+        wrap = np.abs(self.w) > two_pi
+        self.w[wrap] -= np.sign(self.w[wrap]) * two_pi
+
+        self.x = np.clip(self.x + dx, 0, self.width)
+        self.y = np.clip(self.y - dy, 0, self.height)
+
+        self.dx, self.dy, self.dw = dx, dy, dw
+
+    def _hits(self, poly, idx, prev_x, prev_y):
+        ''' Mask of the needles idx whose tip (or tip path from the
+            previous position) is inside poly '''
+        x, y = self.x[idx], self.height - self.y[idx]
+        if prev_x is None:
+            return poly.contains_points(x, y)
+        return poly.intersects_segments(prev_x[idx], prev_y[idx], x, y)
+
+    def _update_gates(self, prev_x=None, prev_y=None):
+        ''' Batched Environment._update_and_get_next_gate_status.
+            prev_x, prev_y: tip positions before the move, for swept tests
+            Returns masks of the needles that passed, failed and are done
+        '''
+        n = self.num_envs
+        passed = np.zeros(n, dtype=bool)
+        failed = np.zeros(n, dtype=bool)
+        finished = self.next_gate < 0
+
+        for g, gate in enumerate(self.gates):
+            idx = np.nonzero(self.next_gate == g)[0]
+            if len(idx) == 0:
+                continue
+            # The next gate is never 'passed', so only the boxes matter
+            hit = (self._hits(gate.top_box, idx, prev_x, prev_y) |
+                   self._hits(gate.bottom_box, idx, prev_x, prev_y))
+            through = ~hit & self._hits(gate.box, idx, prev_x, prev_y)
+            self.gate_status[idx[hit], g] = GATE_FAILED
+            self.gate_status[idx[through], g] = GATE_PASSED
+            failed[idx[hit]] = True
+            passed[idx[through]] = True
+
+        advance = passed | failed
+        self.next_gate[advance] += 1
+        more = advance & (self.next_gate < self.ngates)
+        self.gate_status[np.nonzero(more)[0], self.next_gate[more]] = GATE_NEXT
+        self.next_gate[advance & ~more] = -1
+
+        return passed, failed, finished
+
+    def step(self, actions):
+        ''' Move every needle one time step forward
+            @param actions: array of shape [N, 1]
+            Returns:
+              * states of all needles, shape [N, state_dim]
+              * rewards, shape [N]
+              * dones, shape [N]
+        '''
+        actions = np.asarray(actions, dtype=np.float64).reshape(
+                (self.num_envs, -1))
+        dw = actions[:, 0]
+
+        # Surface containing the tip before the move (first match wins)
+        inside = self._tip_in_surfaces()
+        in_tissue = inside.any(axis=1)
+        if self.nsurfaces > 0:
+            surface_idx = np.argmax(inside, axis=1)
+        else:
+            surface_idx = np.zeros(self.num_envs, dtype=np.int64)
+
+        prev_x = prev_y = None
+        if self.swept_collision:
+            prev_x, prev_y = self.x.copy(), self.height - self.y
+        self._move(dw, in_tissue)
+
+        # Damage from Surface.get_update_damage_and_color
+        new_damage = np.where(in_tissue & (np.abs(dw) > 0.02),
+                (np.abs(dw) / 2.0 - 0.01) * 100, 0.)
+        rows = np.nonzero(in_tissue)[0]
+        cols = surface_idx[rows]
+        self.surface_damage[rows, cols] = np.minimum(
+                self.surface_damage[rows, cols] + new_damage[rows], 100)
+        self.damage += new_damage
+        self.t += 1
+
+        reward = np.zeros(self.num_envs)
+        passed, failed, done = self._update_gates(prev_x, prev_y)
+        reward[passed] += 100
+        reward[failed] -= 1
+        self.last_dist[passed | failed | done] = np.nan
+
+        # Distance reward component
+        has_gate = self.next_gate >= 0
+        gate_idx = np.where(has_gate, self.next_gate, 0)
+        if self.ngates > 0:
+            x2gate = self.x - self.gate_x[gate_idx]
+            y2gate = self.y - self.gate_y[gate_idx]
+            dist = np.sqrt(x2gate * x2gate + y2gate * y2gate)
+        else:
+            dist = np.zeros(self.num_envs)
+        delta = (self.last_dist - dist) / 1000
+        delta = np.where(delta < 0, delta * 10., delta)
+        delta = np.where(delta == 0, -0.5, delta)
+        use_delta = has_gate & ~np.isnan(self.last_dist)
+        reward[use_delta] += delta[use_delta]
+        self.last_dist[has_gate] = dist[has_gate]
+
+        # Time penalty
+        reward[~done] -= 0.01
+
+        if self.swept_collision:
+            deep = np.zeros(self.num_envs, dtype=bool)
+            idx = np.arange(self.num_envs)
+            for s in self.surfaces:
+                if s.deep:
+                    deep |= self._hits(s.poly, idx, prev_x, prev_y)
+        else:
+            deep = (self._tip_in_surfaces() & self.surface_deep).any(axis=1)
+        reward[deep] -= 100.
+        done |= deep
+
+        # Damage component
+        reward -= new_damage / 100
+
+        # Check for excessive damage
+        excessive = self.damage > 100
+        reward[excessive] -= 50
+        done |= excessive
+
+        done |= self.t > self.max_time
+
+        reward /= 10
+
+        self.total_reward += reward
+        self.done = done.copy()
+        self.episode_reward[done] = self.total_reward[done]
+
+        if done.any():
+            state = self.reset(done)
+        else:
+            state = self._get_state()
+        return state, reward, done
+
+    def _get_state(self):
+        ''' Batched Environment._get_state '''
+        n = self.num_envs
+        has_gate = self.next_gate >= 0
+        gate_idx = np.where(has_gate, self.next_gate, 0)
+        if self.ngates > 0:
+            gate_x = np.where(has_gate, self.gate_x[gate_idx], 0.)
+            gate_y = np.where(has_gate, self.gate_y[gate_idx], 0.)
+            gate_w = np.where(has_gate, self.gate_w[gate_idx], 0.)
+        else:
+            gate_x = gate_y = gate_w = np.zeros(n)
+
+        # Back of the needle (see Needle._compute_corners)
+        w = self.w
+        x = self.x
+        y = self.height - self.y
+        lcosw = self.length * np.cos(w)
+        lsinw = self.length * np.sin(w)
+        scale = 0.03 * self.scale
+        top_w = w - math.pi/2
+        bot_w = w + math.pi/2
+        top_x = x - scale * np.cos(top_w) + lcosw
+        top_y = y - scale * np.sin(top_w) + lsinw
+        bot_x = x - scale * np.cos(bot_w) + lcosw
+        bot_y = y - scale * np.sin(bot_w) + lsinw
+
+        state = np.empty((n, 11 + self.ngates), dtype=np.float32)
+        state[:, 0] = self.x / self.width
+        state[:, 1] = self.y / self.height
+        state[:, 2] = (top_x + bot_x) / (2.0 * self.width)
+        state[:, 3] = (top_y + bot_y) / (2.0 * self.height)
+        state[:, 4] = self.w / two_pi
+        state[:, 5] = self.dx
+        state[:, 6] = self.dy
+        state[:, 7] = self.dw
+        state[:, 8:8 + self.ngates] = self.gate_status == GATE_PASSED
+        state[:, -3] = gate_x / self.width
+        state[:, -2] = gate_y / self.height
+        state[:, -1] = gate_w / two_pi
+        return state
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+'''
+Episode video recording.
+
+Each episode is streamed into a single file: an mp4 written through an
+ffmpeg pipe when ffmpeg is installed, otherwise a compressed npz holding
+the uint8 frames in chunks.
+'''
+import os
+import shutil
+import subprocess
+import numpy as np
+
+def find_ffmpeg(name='ffmpeg'):
+    which = getattr(shutil, 'which', None)
+    if which is None: # python 2
+        from distutils.spawn import find_executable as which
+    return which(name)
+
+class EpisodeRecorder:
+    ''' Streams the frames of one episode at a time into a video file.
+
+        Frames use the pygame surfarray layout [W, H, 3], as returned by
+        pygame.surfarray.array3d.
+    '''
+    def __init__(self, fps=10, use_ffmpeg=None, chunk_size=64, crf=23):
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.crf = crf
+        self.ffmpeg = find_ffmpeg() if use_ffmpeg in (None, True) else None
+        if use_ffmpeg and self.ffmpeg is None:
+            raise ValueError('ffmpeg was requested but is not installed')
+        self.path = None
+        self.pipe = None
+        self.chunks = []
+        self.chunk = None
+        self.nframes = 0
+
+    def begin(self, path):
+        ''' Start an episode. path is given without extension.
+            @returns the file the episode is written to
+        '''
+        self.end()
+        save_path = os.path.dirname(path)
+        if save_path and not os.path.exists(save_path):
+            os.makedirs(save_path)
+        ext = '.mp4' if self.ffmpeg else '.npz'
+        self.path = path + ext
+        self.nframes = 0
+        return self.path
+
+    def _open_pipe(self, width, height):
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '{}x{}'.format(width, height),
+               '-r', str(self.fps), '-i', '-',
+               '-c:v', 'libx264', '-crf', str(self.crf),
+               '-pix_fmt', 'yuv420p', self.path]
+        self.pipe = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def add_frame(self, frame):
+        ''' Append a [W, H, 3] uint8 frame to the current episode '''
+        if self.path is None:
+            raise ValueError('add_frame called outside of an episode')
+        rgb = np.ascontiguousarray(frame.transpose((1, 0, 2)))
+        height, width = rgb.shape[:2]
+        if self.ffmpeg:
+            if self.pipe is None:
+                # yuv420p needs even dimensions
+                self._open_pipe(width - width % 2, height - height % 2)
+            rgb = np.ascontiguousarray(
+                rgb[:height - height % 2, :width - width % 2])
+            self.pipe.stdin.write(rgb.tobytes())
+        else:
+            if self.chunk is None or len(self.chunk) == self.chunk_size:
+                self.chunk = []
+                self.chunks.append(self.chunk)
+            self.chunk.append(rgb)
+        self.nframes += 1
+
+    def end(self):
+        ''' Finish the current episode and close its file '''
+        if self.path is None:
+            return
+        if self.pipe is not None:
+            self.pipe.stdin.close()
+            self.pipe.wait()
+            self.pipe = None
+        elif self.chunks:
+            arrays = {'frames_{:05d}'.format(i): np.stack(chunk)
+                for i, chunk in enumerate(self.chunks)}
+            np.savez_compressed(self.path, fps=self.fps, **arrays)
+        self.chunks = []
+        self.chunk = None
+        self.path = None
+
+def load_episode(path):
+    ''' Load a recorded episode as a uint8 array of shape [T, H, W, 3] '''
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            keys = sorted(k for k in data.files if k.startswith('frames_'))
+            return np.concatenate([data[k] for k in keys])
+
+    ffprobe = find_ffmpeg('ffprobe')
+    ffmpeg = find_ffmpeg()
+    if ffprobe is None or ffmpeg is None:
+        raise ValueError('ffmpeg and ffprobe are needed to read ' + path)
+    size = subprocess.check_output([ffprobe, '-v', 'error',
+        '-select_streams', 'v:0', '-show_entries', 'stream=width,height',
+        '-of', 'csv=p=0', path]).decode().strip().split(',')
+    width, height = int(size[0]), int(size[1])
+    raw = subprocess.check_output([ffmpeg, '-loglevel', 'error', '-i', path,
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'])
+    return np.frombuffer(raw, dtype=np.uint8).reshape((-1, height, width, 3))
@@ -1,66 +1,76 @@
-import random
 from collections import namedtuple
 import torch
 import numpy as np
 
 
 Transition = namedtuple('Transition', ('timestep', 'state', 'action', 'reward', 'nonterminal'))
-<<<<<<< HEAD
 # blank_trans = Transition(0, torch.zeros(12, 224, 224, dtype=torch.uint8), None, 0, False)
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-=======
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
 
 
 # Segment tree data structure where parent node values are sum/max
 # of children node values
+# The tree is a flat array (children of node i at 2i + 1 and 2i + 2) with
+# the leaves padded to a power of two, so all leaves are at the same depth
+# and a batch of values is searched or updated one level at a time
 class SegmentTree():
   def __init__(self, size):
     self.index = 0
     self.size = size
     self.full = False  # Used to track actual capacity
-    self.sum_tree = [0] * (2 * size - 1)  # Initialise fixed size tree with all (priority) zeros
+    self.depth = int(np.ceil(np.log2(max(size, 2))))
+    self.tree_start = 2 ** self.depth - 1  # Tree index of the first leaf
+    self.sum_tree = np.zeros((self.tree_start + 2 ** self.depth,), dtype=np.float64)  # Initialise fixed size tree with all (priority) zeros
     self.data = [None] * size  # Wrap-around cyclic buffer
     self.max = 1  # Initial max value to return (1 = 1^ω)
 
-  # Propagates value up tree given a tree index
-  def _propagate(self, index, value):
-    parent = (index - 1) // 2
-    left, right = 2 * parent + 1, 2 * parent + 2
-    self.sum_tree[parent] = self.sum_tree[left] + self.sum_tree[right]
-    if parent != 0:
-      self._propagate(parent, value)
-
-  # Updates value given a tree index
-  def update(self, index, value):
-    self.sum_tree[index] = value  # Set new value
-    self._propagate(index, value)  # Propagate value
-    self.max = max(value, self.max)
+  # Propagates values up tree given an array of tree indices
+  def _propagate(self, indices):
+    for _ in range(self.depth):
+      indices = np.unique((indices - 1) // 2)
+      self.sum_tree[indices] = self.sum_tree[2 * indices + 1] + self.sum_tree[2 * indices + 2]
+
+  # Propagates value up tree given a single tree index
+  def _propagate_index(self, index):
+    while index != 0:
+      index = (index - 1) // 2
+      self.sum_tree[index] = self.sum_tree[2 * index + 1] + self.sum_tree[2 * index + 2]
+
+  # Updates values given tree indices (scalars or arrays)
+  def update(self, indices, values):
+    indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+    values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+    self.sum_tree[indices] = values  # Set new values
+    self._propagate(indices)  # Propagate values
+    self.max = max(values.max(), self.max)
 
   def append(self, data, value):
     self.data[self.index] = data  # Store data in underlying data structure
-    self.update(self.index + self.size - 1, value)  # Update tree
+    index = self.index + self.tree_start
+    self.sum_tree[index] = value  # Update tree
+    self._propagate_index(index)
     self.index = (self.index + 1) % self.size  # Update index
     self.full = self.full or self.index == 0  # Save when capacity reached
     self.max = max(value, self.max)
 
-  # Searches for the location of a value in sum tree
-  def _retrieve(self, index, value):
-    left, right = 2 * index + 1, 2 * index + 2
-    if left >= len(self.sum_tree):
-      return index
-    elif value <= self.sum_tree[left]:
-      return self._retrieve(left, value)
-    else:
-      return self._retrieve(right, value - self.sum_tree[left])
-
-  # Searches for a value in sum tree and returns value, data index and tree index
-  def find(self, value):
-    index = self._retrieve(0, value)  # Search for index of item from root
-    data_index = index - self.size + 1
-    # Return value, data index, tree index
-    return (self.sum_tree[index], data_index, index)
+  # Searches for the locations of an array of values in sum tree
+  def _retrieve(self, values):
+    indices = np.zeros(values.shape, dtype=np.int64)
+    for _ in range(self.depth):
+      left = 2 * indices + 1
+      left_values = self.sum_tree[left]
+      go_right = values > left_values
+      values = values - left_values * go_right
+      indices = left + go_right
+    return indices
+
+  # Searches for values in sum tree and returns values, data indices and tree indices
+  def find(self, values):
+    indices = self._retrieve(np.asarray(values, dtype=np.float64))  # Search for indices of items from root
+    data_index = indices - self.tree_start
+    # Return values, data indices, tree indices
+    return (self.sum_tree[indices], data_index, indices)
 
   # Returns data given a data index
   def get(self, data_index):
@@ -71,10 +81,7 @@ class SegmentTree():
 
 class ReplayMemory():
   def __init__(self, args, capacity, default_img):
-<<<<<<< HEAD
     self.device = device
-======
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
     self.capacity = capacity
     self.history = args.history_length
     self.discount = args.discount
@@ -83,13 +90,8 @@ class ReplayMemory():
     self.priority_weight = args.priority_weight
     self.priority_exponent = args.priority_exponent
     self.t = 0  # Internal episode timestep counter
-<<<<<<< HEAD
     self.transitions = SegmentTree(capacity)  # Store transitions in a wrap-around cyclic buffer within a sum tree for querying priorities
-=======
-    # Store transitions in a wrap-around cyclic buffer within a sum tree
-    # for querying priorities
     # For placing into next_state of terminal actions
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
     def_img = default_img[-1].to(dtype=torch.uint8, device=torch.device('cpu'))
     self.blank_trans = Transition(0, def_img, None, 0, False)
 
@@ -119,34 +121,38 @@ class ReplayMemory():
         transition[t] = self.blank_trans  # If prev (next) frame is terminal
     return transition
 
-  # Returns a valid sample from a segment
-  def _get_sample_from_segment(self, segment, i):
-    valid = False
-    while not valid:
-      # Uniformly sample an element from within a segment
-      sample = random.uniform(i * segment, (i + 1) * segment)
-      # Retrieve sample from tree with un-normalised probability
-      prob, idx, tree_idx = self.transitions.find(sample)
+  # Returns valid samples, one from each of batch_size segments
+  def _get_samples_from_segments(self, batch_size, p_total):
+    segment = p_total / batch_size
+    probs = np.zeros((batch_size,))
+    idxs = np.zeros((batch_size,), dtype=np.int64)
+    tree_idxs = np.zeros((batch_size,), dtype=np.int64)
+    invalid = np.arange(batch_size)
+    while len(invalid) > 0:
+      # Uniformly sample an element from within each segment still needing one
+      samples = (invalid + np.random.uniform(size=len(invalid))) * segment
+      # Retrieve samples from tree with un-normalised probability
+      probs[invalid], idxs[invalid], tree_idxs[invalid] = self.transitions.find(samples)
       # Resample if transition straddled current index or probablity 0
-      if (self.transitions.index - idx) % self.capacity > self.n \
-          and (idx - self.transitions.index) % self.capacity >= self.history \
-          and prob != 0:
-        # Note that conditions are valid but extra conservative
-        # around buffer index 0
-        valid = True
-
+      # Note that conditions are valid but extra conservative
+      # around buffer index 0
+      valid = (((self.transitions.index - idxs) % self.capacity > self.n) &
+               ((idxs - self.transitions.index) % self.capacity >= self.history) &
+               (probs != 0))
+      invalid = np.flatnonzero(~valid)
+    return probs, idxs, tree_idxs
+
+  # Returns the sample stored at a valid data index
+  def _get_sample(self, idx):
     # Retrieve all required transition data (from t - h to t + n)
     transition = self._get_transition(idx)
     # Create un-discretised state and nth next state
-<<<<<<< HEAD
 
     # for trans in transition[:self.history]:
     #     ss = trans.state
     state = torch.stack([trans.state for trans in transition[:self.history]]).to(dtype=torch.float32, device=self.device).div_(255)
 
     next_state = torch.stack([trans.state for trans in transition[self.n:self.n + self.history]]).to(dtype=torch.float32, device=self.device).div_(255)
-=======
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
     # Discrete action to be used as index
     action = torch.tensor(
         [transition[self.history - 1].action], dtype=torch.int64,
@@ -163,25 +169,24 @@ class ReplayMemory():
         [transition[self.history + self.n - 1].nonterminal],
         dtype=torch.float32, device=self.device)
 
-    return prob, idx, tree_idx, state, action, R, next_state, nonterminal
+    return state, action, R, next_state, nonterminal
 
   def sample(self, batch_size):
     # Retrieve sum of all priorities
     # (used to create a normalised probability distribution)
     p_total = self.transitions.total()
     # Batch size number of segments, based on sum over all probabilities
-    segment = p_total / batch_size
-    batch = [self._get_sample_from_segment(segment, i)
-        for i in range(batch_size)]  # Get batch of valid samples
-    probs, idxs, tree_idxs, states, actions, \
-        returns, next_states, nonterminals = zip(*batch)
+    probs, idxs, tree_idxs = self._get_samples_from_segments(
+        batch_size, p_total)  # Get batch of valid samples
+    batch = [self._get_sample(idx) for idx in idxs]
+    states, actions, returns, next_states, nonterminals = zip(*batch)
     states = torch.stack(states)
     next_states =  torch.stack(next_states) # bug here seg 6: (1, 84, 84)
     actions = torch.cat(actions)
     returns = torch.cat(returns)
     nonterminals = torch.stack(nonterminals)
     # Calculate normalised probabilities
-    probs = np.array(probs, dtype = np.float32)/p_total
+    probs = probs.astype(np.float32)/p_total
     capacity = self.capacity if self.transitions.full \
         else self.transitions.index
     # Compute importance-sampling weights w
@@ -195,7 +200,7 @@ class ReplayMemory():
 
   def update_priorities(self, idxs, priorities):
     priorities = np.power(priorities, self.priority_exponent)
-    [self.transitions.update(idx, priority) for idx, priority in zip(idxs, priorities)]
+    self.transitions.update(idxs, priorities)
 
   # Set up internal state for iterator
   def __iter__(self):
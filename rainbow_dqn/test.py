@@ -3,12 +3,8 @@ import plotly
 from plotly.graph_objs import Scatter
 from plotly.graph_objs.scatter import Line
 import torch
-<<<<<<< HEAD
+from needlemaster.video import EpisodeRecorder
 from .environment import Environment
-=======
-
-#from .env import Env
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
 
 
 # Globals
@@ -24,34 +20,35 @@ img_stack = 4
 def test(args, T, dqn, val_mem, test_path, result_path, evaluate=False):
 
   global Ts, rewards, Qs, best_avg_reward
-<<<<<<< HEAD
   # env = Environment(args)
   env = Environment(args.policy_name, img_stack, args.filename)
 
   ## for pycharm
   # env = Environment(args.policy_name, img_stack, env_path)
   # env.eval()
-=======
+
   T_rewards, T_Qs = [], []
 
   # Test performance over several episodes
   done = True
-  for _ in range(args.evaluation_episodes):
+  video = EpisodeRecorder()
+  for episode in range(args.evaluation_episodes):
     while True:
       if done:
         state, reward_sum, done = env.reset(), 0, False
+        video.begin(os.path.join(test_path,
+          'test_{:09d}_{:02d}'.format(T, episode)))
+        video.add_frame(env.get_frame())
 
-<<<<<<< HEAD
       # gpu_state = state.to(dtype=torch.float32, device=args.device).div_(255)
       state = state.to(args.device)
       action = dqn.act_e_greedy(state)  # Choose an action ε-greedily
-=======
->>>>>>> 0b468b99146f0e23d2d2773d2938d305054247d5
       state, reward, done = env.step(action)  # Step
       reward_sum += reward
+      video.add_frame(env.get_frame())
 
       if done:
-        env.render(save_image=True, save_path=test_path)
+        video.end()
         T_rewards.append(reward_sum)
         break
 
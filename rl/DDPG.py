@@ -20,17 +20,22 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 class DDPG(object):
     def __init__(self, state_dim, action_dim, img_stack,
-            max_action, mode, lr, bn=False, actor_lr=None):
+            max_action, mode, lr, bn=False, actor_lr=None, img_dim=224,
+            load_encoder=''):
 
         self.max_action = max_action
         self.action_dim = action_dim
         self.mode = mode
         actor_lr = lr if actor_lr is None else actor_lr
         if self.mode == 'rgb_array':
-            self.actor = ActorImage(action_dim, img_stack, max_action).to(device)
-            self.actor_target = ActorImage(action_dim, img_stack, max_action).to(device)
-            self.critic = CriticImage( action_dim, img_stack).to(device)
-            self.critic_target = CriticImage( action_dim, img_stack).to(device)
+            self.actor = ActorImage(action_dim, img_stack, max_action, img_dim=img_dim).to(device)
+            self.actor_target = ActorImage(action_dim, img_stack, max_action, img_dim=img_dim).to(device)
+            self.critic = CriticImage( action_dim, img_stack, img_dim=img_dim).to(device)
+            self.critic_target = CriticImage( action_dim, img_stack, img_dim=img_dim).to(device)
+            if load_encoder != '':
+                print("Loading encoder model...")
+                for model in [self.actor, self.critic]:
+                    model.encoder.load_state_dict(torch.load(load_encoder))
         elif self.mode == 'state':
             self.actor = ActorState(state_dim, action_dim, max_action, bn=bn).to(device)
             self.actor_target = ActorState(state_dim, action_dim, max_action, bn=bn).to(device)
@@ -130,6 +135,11 @@ class DDPG(object):
         actor_loss.backward()
         self.actor_optimizer.step()
 
+        self.update_targets(tau, actor_tau)
+
+        return critic_loss.item(), actor_loss.item()
+
+    def update_targets(self, tau, actor_tau):
         # Update the frozen target models
         for param, target_param in zip(self.critic.parameters(), self.critic_target.parameters()):
             target_param.data.copy_(tau * param.data + (1 - tau) * target_param.data)
@@ -137,8 +147,6 @@ class DDPG(object):
         for param, target_param in zip(self.actor.parameters(), self.actor_target.parameters()):
             target_param.data.copy_(actor_tau * param.data + (1 - actor_tau) * target_param.data)
 
-        return critic_loss.item(), actor_loss.item()
-
     def save(self, path):
         torch.save(self.actor.state_dict(), os.path.join(path, 'actor.pth'))
         torch.save(self.critic.state_dict(), os.path.join(path, 'critic.pth'))
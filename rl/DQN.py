@@ -39,7 +39,7 @@ class DQN(object):
         self.q_optimizer = torch.optim.Adam(self.q.parameters(), lr=lr)
 
         if load_encoder != '':
-            print "Loading encoder model..."
+            print("Loading encoder model...")
             for model in [self.q, self.q_target]:
                     model.encoder.load_state_dict(torch.load(load_encoder))
 
@@ -131,12 +131,15 @@ class DQN(object):
 
         replay_buffer.update_priorities(indices, prios)
 
+        self.update_targets(tau)
+
+        return q_loss.item(), None
+
+    def update_targets(self, tau):
         # Update the frozen target models
         for param, param_t in zip(self.q.parameters(), self.q_target.parameters()):
             param_t.data.copy_(tau * param.data + (1 - tau) * param_t.data)
 
-        return q_loss.item(), None
-
     def save(self, path):
         torch.save(self.q.state_dict(), os.path.join(path, 'q.pth'))
         torch.save(self.q_target.state_dict(), os.path.join(path, 'q_target.pth'))
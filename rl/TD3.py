@@ -36,12 +36,12 @@ class TD3:
                 return CriticImage(action_dim, img_stack, bn=bn,
                          img_dim=img_dim).to(device)
 
-            self.critics = [create_critic() for _ in xrange(2)]
-            self.critic_targets = [create_critic() for _ in xrange(2)]
+            self.critics = [create_critic() for _ in range(2)]
+            self.critic_targets = [create_critic() for _ in range(2)]
 
             # Load encoder if requested
             if load_encoder != '':
-                print "Loading encoder model..."
+                print("Loading encoder model...")
                 for model in [self.actor] + self.critics:
                      model.encoder.load_state_dict(torch.load(load_encoder))
 
@@ -53,8 +53,8 @@ class TD3:
             def create_critic():
                 return CriticState(state_dim, action_dim, bn=bn).to(device)
 
-            self.critics = [create_critic() for _ in xrange(2)]
-            self.critic_targets = [create_critic() for _ in xrange(2)]
+            self.critics = [create_critic() for _ in range(2)]
+            self.critic_targets = [create_critic() for _ in range(2)]
         else:
             raise ValueError('Unrecognized mode ' + mode)
 
@@ -170,22 +170,25 @@ class TD3:
             actor_loss.backward()
             self.actor_optimizer.step()
 
-            # Update the frozen target models
-            for critic, critic_t in zip(self.critics, self.critic_targets):
-                for param, param_t in zip(critic.parameters(),
-                        critic_t.parameters()):
-                    param_t.data.copy_(tau * param.data +
-                            (1 - tau) * param_t.data)
-
-            for param, param_t in zip(self.actor.parameters(),
-                    self.actor_target.parameters()):
-                param_t.data.copy_(actor_tau * param.data + (1 - actor_tau) * param_t.data)
+            self.update_targets(tau, actor_tau)
 
             ret_actor_loss = actor_loss.item()
 
         mean_crit_loss = sum([c.item() for c in critic_mean_losses]) / 2.
         return mean_crit_loss, ret_actor_loss
 
+    def update_targets(self, tau, actor_tau):
+        # Update the frozen target models
+        for critic, critic_t in zip(self.critics, self.critic_targets):
+            for param, param_t in zip(critic.parameters(),
+                    critic_t.parameters()):
+                param_t.data.copy_(tau * param.data +
+                        (1 - tau) * param_t.data)
+
+        for param, param_t in zip(self.actor.parameters(),
+                self.actor_target.parameters()):
+            param_t.data.copy_(actor_tau * param.data + (1 - actor_tau) * param_t.data)
+
     def save(self, path):
         torch.save(self.actor.state_dict(), pjoin(path, 'actor.pth'))
         torch.save(self.actor_target.state_dict(), pjoin(path, 'actor_t.pth'))
@@ -0,0 +1,296 @@
+'''
+Actor/learner training.
+
+Actor processes each step their own Environment with a CPU copy of the
+policy actor, and write transitions into a shared-memory ring. The
+learner moves completed episodes from the rings into its replay buffer,
+so every episode stays contiguous (as FrameReplayBuffer expects), trains
+continuously and publishes the actor weights every args.weight_sync
+updates.
+
+With args.batched_inference the actors instead send their observations
+to an InferenceServer in the learner, which runs them through one copy of
+the actor in batches and sends back the actions.
+'''
+import copy
+import time
+import threading
+import multiprocessing.sharedctypes as sharedctypes
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from .utils import OUNoise
+from .inference import InferenceServer
+
+# CUDA cannot be used in forked children, spawn them instead
+if hasattr(mp, 'get_context'):
+    mp = mp.get_context('spawn')
+
+class TransitionRing(object):
+    ''' Ring of transitions in shared memory, for one writer and one reader.
+        The writer waits while the ring is full. The reader only takes
+        transitions up to the end of the last completed episode, so the
+        capacity must exceed the longest episode.
+    '''
+    def __init__(self, capacity, state_shape, state_dtype, action_dim):
+        self.capacity = capacity
+        state_spec = ((capacity,) + tuple(state_shape), np.dtype(state_dtype))
+        self.specs = [state_spec, state_spec,
+            ((capacity, action_dim), np.dtype(np.float32)),
+            ((capacity,), np.dtype(np.float32)),
+            ((capacity,), np.dtype(np.uint8))]
+        self.buffers = [sharedctypes.RawArray('b',
+            int(np.prod(shape)) * dtype.itemsize) for shape, dtype in self.specs]
+        self.written = sharedctypes.RawValue('l', 0)
+        self.episode_end = sharedctypes.RawValue('l', 0)
+        self.read = sharedctypes.RawValue('l', 0)
+        self._make_views()
+
+    def _make_views(self):
+        self.arrays = [np.frombuffer(buf, dtype=dtype).reshape(shape)
+            for buf, (shape, dtype) in zip(self.buffers, self.specs)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['arrays']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+    def put(self, stop, state, new_state, action, reward, done):
+        ''' Write a transition, waiting for space.
+            @returns False if stop was set while waiting
+        '''
+        while self.written.value - self.read.value >= self.capacity:
+            if stop.is_set():
+                return False
+            time.sleep(0.001)
+        slot = self.written.value % self.capacity
+        for array, x in zip(self.arrays,
+                (state, new_state, action, reward, done)):
+            array[slot] = x
+        self.written.value += 1
+        if done:
+            self.episode_end.value = self.written.value
+        return True
+
+    def drain(self, add):
+        ''' Pass the transitions of the completed episodes to add.
+            @returns the number of transitions
+        '''
+        start, end = self.read.value, self.episode_end.value
+        for i in range(start, end):
+            slot = i % self.capacity
+            state, new_state, action, reward, done = [a[slot]
+                for a in self.arrays]
+            add(state, new_state, action, float(reward), bool(done))
+        self.read.value = end
+        return end - start
+
+def _select_action(actor, state, mode):
+    ''' TD3.select_action on the CPU '''
+    state = torch.from_numpy(np.asarray(state))
+    if mode == 'rgb_array':
+        state = state.unsqueeze(0).float() / 255.0
+    else:
+        state = state.float()
+    with torch.no_grad():
+        return actor(state).numpy().flatten()
+
+def serve_actors(server, conns):
+    ''' Answer the observations sent over each connection with actions
+        from server, in one thread per connection, until its actor exits
+    '''
+    def serve(conn):
+        try:
+            while True:
+                conn.send(server.act(conn.recv()))
+        except EOFError:
+            pass
+        finally:
+            # An actor waiting for an action sees EOFError
+            conn.close()
+    threads = [threading.Thread(target=serve, args=(conn,))
+        for conn in conns]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    return threads
+
+def run_actor(actor_id, args, env_kwargs, ring, shared_actor, version, lock,
+        stop, max_action, conn=None):
+    ''' Actor process: step an environment and write to ring until stop.
+        With a connection conn, actions come from the InferenceServer on
+        its other end instead of shared_actor.
+    '''
+    from needlemaster.level_pool import make_environment
+
+    # Many actors share the machine
+    torch.set_num_threads(1)
+    seed = int(args.seed) + 1000 * (actor_id + 1)
+    np.random.seed(seed % 2 ** 32)
+    torch.manual_seed(seed)
+
+    env = make_environment(**dict(env_kwargs, record_video=False))
+    actor = copy.deepcopy(shared_actor)
+    actor.eval()
+    actor_version = -1
+    action_dim = ring.specs[2][0][1]
+    ou_noise = OUNoise(action_dim)
+
+    state = env.reset(random_needle=args.random_needle)
+    while not stop.is_set():
+        if conn is None and version.value != actor_version:
+            with lock:
+                actor.load_state_dict(shared_actor.state_dict())
+                actor_version = version.value
+
+        if args.ou_noise:
+            noise = ou_noise.sample()
+        else:
+            noise = np.random.normal(0, args.expl_noise, size=action_dim)
+        if conn is not None:
+            conn.send(state)
+            action = conn.recv()
+        else:
+            action = _select_action(actor, state, args.mode)
+        action = np.clip(action + noise, -max_action, max_action)
+
+        # state, a view into the frame stack with uint8 frames, stays
+        # valid through this step
+        new_state, reward, done = env.step(action)
+        if not ring.put(stop, state, new_state, action, reward, done):
+            break
+
+        if done:
+            state = env.reset(random_needle=args.random_needle)
+            ou_noise.reset()
+        else:
+            state = new_state
+
+def train_actor_learner(args, env_kwargs, env, policy, replay_buffer,
+        max_action, evaluate, result_path, log_f):
+    ''' Train with args.actors actor processes feeding the replay buffer.
+        @param env: the learner's environment, used for evaluation
+        @param evaluate: called with the step count, returns the average
+                         evaluation reward
+    '''
+    state = env.reset()
+    # Room for two of the longest episodes
+    capacity = 2 * (env.max_time + 2)
+    rings = [TransitionRing(capacity, np.shape(state),
+        np.asarray(state).dtype, policy.action_dim)
+        for _ in range(args.actors)]
+
+    # Actors copy their weights from a shared CPU actor
+    shared_actor = copy.deepcopy(policy.actor).cpu()
+    shared_actor.share_memory()
+    version = mp.Value('l', 0)
+    lock = mp.Lock()
+    stop = mp.Event()
+
+    server = None
+    conns = [None] * args.actors
+    if args.batched_inference:
+        model = copy.deepcopy(policy.actor)
+        model.eval()
+        server = InferenceServer(model, args.mode, max_batch=args.actors)
+        pipes = [mp.Pipe() for _ in range(args.actors)]
+        conns = [actor_end for _, actor_end in pipes]
+
+    def publish():
+        with lock:
+            shared_actor.load_state_dict(policy.actor.state_dict())
+            version.value += 1
+        if server is not None:
+            server.load_state_dict(policy.actor.state_dict())
+
+    def check_actors():
+        for p in processes:
+            if not p.is_alive():
+                raise RuntimeError('Actor process {} exited with code {}'.format(
+                    p.pid, p.exitcode))
+
+    processes = [mp.Process(target=run_actor, args=(i, args, env_kwargs,
+        ring, shared_actor, version, lock, stop, max_action, conn))
+        for i, (ring, conn) in enumerate(zip(rings, conns))]
+    for p in processes:
+        p.daemon = True
+        p.start()
+    if server is not None:
+        # The actors hold their ends now: close ours so theirs see EOF
+        for _, actor_end in pipes:
+            actor_end.close()
+        serve_actors(server, [learner_end for learner_end, _ in pipes])
+
+    beta_start = 0.4
+    beta_frames = 25000
+    best_avg_reward = -1e5
+    total_timesteps = 0
+    updates = 0
+    episode = {'num': 0, 'reward': 0., 'steps': 0}
+    next_eval = args.eval_freq
+
+    def add(state, new_state, action, reward, done):
+        replay_buffer.add(state, new_state, action, reward, done)
+        episode['reward'] += reward
+        episode['steps'] += 1
+        if done:
+            s = ("Actor TS:{:04d} E:{:04d} S:{:03d} R: {:.3f} U:{}".format(
+                total_timesteps, episode['num'], episode['steps'],
+                episode['reward'], updates))
+            print(s)
+            log_f.write(s + '\n')
+            replay_buffer.save()
+            episode['num'] += 1
+            episode['reward'], episode['steps'] = 0., 0
+
+    policy.actor.train()
+    try:
+        while total_timesteps < args.max_timesteps:
+            for ring in rings:
+                total_timesteps += ring.drain(add)
+
+            if (total_timesteps <= args.learning_start or
+                    len(replay_buffer) < args.batch_size):
+                check_actors()
+                time.sleep(0.01)
+                continue
+
+            beta = min(1.0, beta_start + total_timesteps *
+                (1.0 - beta_start) / beta_frames)
+            # The update count drives the delayed policy updates
+            policy.train(replay_buffer, updates, beta, args)
+            updates += 1
+            if updates % args.weight_sync == 0:
+                publish()
+                check_actors()
+
+            if total_timesteps >= next_eval:
+                next_eval = total_timesteps + args.eval_freq
+                policy.actor.eval()
+                print("---------------------------------------")
+                print("Evaluating policy")
+                avg_reward = evaluate(total_timesteps)
+                if server is not None:
+                    m = server.metrics()
+                    print("Inference: {} requests, batch {:.2f}, "
+                        "latency {:.2f} ms".format(m['requests'],
+                        m['batch_size_mean'], 1000. * m['latency_mean']))
+                    server.reset_metrics()
+                if avg_reward > best_avg_reward:
+                    best_avg_reward = avg_reward
+                    policy.save(result_path)
+                replay_buffer.save(flush=True)
+                policy.actor.train()
+    finally:
+        stop.set()
+        for p in processes:
+            p.join()
+        if server is not None:
+            server.close()
+
+    print("Best Reward: ", best_avg_reward)
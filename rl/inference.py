@@ -0,0 +1,175 @@
+'''
+Batched policy inference.
+
+Many environments (threads, or a vectorized environment) ask for actions
+from one model. Requests are collected for up to a latency budget and
+run as a single forward pass.
+'''
+import threading
+import time
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+import numpy as np
+import torch
+
+class _Request(object):
+    __slots__ = ('obs', 'time', 'event', 'action', 'error')
+
+    def __init__(self, obs):
+        self.obs = obs
+        self.time = time.time()
+        self.event = threading.Event()
+        self.action = None
+        self.error = None
+
+class InferenceServer:
+    ''' Batches observations from many callers into one forward pass.
+
+        Works with ActorImage/QImage (observations of shape
+        [stack, W, H], scaled from uint8 to [0, 1]) and ActorState/QState
+        (observations of shape [1, state_dim]), as in TD3.select_action.
+        A request waits at most max_wait seconds for others to join its
+        batch. postprocess maps the output rows (a numpy array) to actions,
+        e.g. an argmax for Q networks.
+
+        Put the model in eval mode before serving from it, and update its
+        weights through load_state_dict so no forward pass sees half of
+        them.
+    '''
+    def __init__(self, model, mode, device=None, max_batch=64,
+            max_wait=0.002, postprocess=None):
+        if mode not in ['rgb_array', 'state']:
+            raise ValueError('Unrecognized mode ' + mode)
+        self.model = model
+        self.mode = mode
+        self.device = device if device is not None else \
+            next(model.parameters()).device
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.postprocess = postprocess
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.reset_metrics()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset_metrics(self):
+        self.batches = 0
+        self.requests = 0
+        self.queue_depth_sum = 0
+        self.queue_depth_max = 0
+        self.latency_sum = 0.
+        self.latency_max = 0.
+        self.batch_sizes = np.zeros((self.max_batch + 1,), dtype=np.int64)
+
+    def metrics(self):
+        ''' Batch size and queue depth seen by the server since the last
+            reset_metrics, and request latency in seconds '''
+        batches = max(self.batches, 1)
+        requests = max(self.requests, 1)
+        return {'batches': self.batches,
+                'requests': self.requests,
+                'batch_size_mean': float(self.requests) / batches,
+                'queue_depth_mean': float(self.queue_depth_sum) / batches,
+                'queue_depth_max': self.queue_depth_max,
+                'latency_mean': self.latency_sum / requests,
+                'latency_max': self.latency_max}
+
+    def log(self, tb_writer, step):
+        ''' Write the metrics to a SummaryWriter and reset them '''
+        for name, value in self.metrics().items():
+            tb_writer.add_scalar('inference/' + name, value, step)
+        if self.batches > 0:
+            sizes = np.repeat(np.arange(len(self.batch_sizes)),
+                self.batch_sizes)
+            tb_writer.add_histogram('inference/batch_size', sizes, step)
+        self.reset_metrics()
+
+    def load_state_dict(self, state_dict):
+        with self.lock:
+            self.model.load_state_dict(state_dict)
+
+    def act(self, obs):
+        ''' Action for one observation. Blocks until its batch has run '''
+        request = _Request(obs)
+        self.queue.put(request)
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action
+
+    def act_batch(self, observations):
+        ''' Actions for a batch of observations, run directly in this
+            thread (e.g. for a vectorized environment) '''
+        return self._forward(observations)
+
+    def _forward(self, observations):
+        batch = np.stack([np.asarray(obs) for obs in observations])
+        x = torch.from_numpy(batch).to(self.device).float()
+        if self.mode == 'rgb_array':
+            x /= 255.0
+        else:
+            x = x.reshape((len(batch), -1))
+        with self.lock, torch.no_grad():
+            out = self.model(x)
+        out = out.cpu().numpy()
+        if self.postprocess is not None:
+            return self.postprocess(out)
+        return out
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            requests = [first]
+            stop = False
+            # Wait for more requests until the first one's budget runs out
+            deadline = first.time + self.max_wait
+            while len(requests) < self.max_batch:
+                try:
+                    timeout = deadline - time.time()
+                    if timeout > 0:
+                        request = self.queue.get(timeout=timeout)
+                    else:
+                        request = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                requests.append(request)
+
+            depth = self.queue.qsize()
+            try:
+                actions = self._forward([r.obs for r in requests])
+            except Exception as e:
+                for r in requests:
+                    r.error = e
+                    r.event.set()
+                if stop:
+                    return
+                continue
+
+            now = time.time()
+            for r, action in zip(requests, actions):
+                r.action = action
+                latency = now - r.time
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+                r.event.set()
+            self.batches += 1
+            self.requests += len(requests)
+            self.batch_sizes[len(requests)] += 1
+            self.queue_depth_sum += depth
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+            if stop:
+                return
+
+    def close(self):
+        ''' Serve the queued requests and stop the thread '''
+        self.queue.put(None)
+        self.thread.join()
@@ -8,7 +8,10 @@ from torch.utils.tensorboard import SummaryWriter
 
 cur_dir= os.path.dirname(abspath(__file__))
 sys.path.append(abspath(pjoin(cur_dir, '..')))
-from needlemaster.environment import Environment
+from needlemaster.level_pool import make_environment
+from needlemaster.level_stats import solvable
+from needlemaster.video import EpisodeRecorder
+from needlemaster.timing import StepTimers
 
 import matplotlib
 matplotlib.use('Agg')
@@ -24,17 +27,24 @@ def evaluate_policy(tb_writer, total_times, total_rewards,
     #policy.actor.eval() # set for batchnorm
     rewards = []
     actions = []
-    for _ in xrange(args.evaluation_episodes):
+    video = EpisodeRecorder()
+    for episode in xrange(args.evaluation_episodes):
         reward_sum = 0
         done = False
         state = env.reset(random_needle=args.random_needle)
+        video.begin(pjoin(test_path, 'eval_{:09d}_{:02d}'.format(
+            time, episode)))
+        video.add_frame(env.get_frame())
         while not done:
             action = policy.select_action(state)
             actions.append(action)
             state, reward, done = env.step(action)
             reward_sum += reward
+            frame = env.get_frame()
+            video.add_frame(frame)
 
-        img = env.render(save_image=True, save_path=test_path)
+        video.end()
+        img = frame.transpose((2, 0, 1))
         rewards.append(reward_sum)
     avg_reward = np.array(rewards, dtype=np.float32).mean()
     actions = np.array(actions, dtype=np.float32)
@@ -56,11 +66,16 @@ def evaluate_policy(tb_writer, total_times, total_rewards,
     print ("---------------------------------------")
     return avg_reward
 
+def frame_bytes(args):
+    ''' Bytes of one observation frame in image mode '''
+    # uint8 frames, or float64 from rgb2gray
+    return args.img_dim ** 2 * (1 if args.uint8_frames else 8)
+
 def run(args):
     args.policy = args.policy.lower()
 
     env_data_name = os.path.splitext(
-        os.path.basename(args.filename))[0]
+        os.path.basename(os.path.normpath(args.filename)))[0]
 
     times, rewards, best_avg_reward = [], [], -1e5
 
@@ -101,8 +116,19 @@ def run(args):
     log_f = open('log_' + base_filename + '.txt', 'w')
 
     """ setting up environment """
-    env = Environment(filename = args.filename, mode=args.mode,
-            stack_size = args.stack_size, img_dim=args.img_dim)
+    env_kwargs = dict(filename = args.filename, mode=args.mode,
+            stack_size = args.stack_size, img_dim=args.img_dim,
+            direct_render=args.direct_render, supersample=args.supersample,
+            uint8_frames=args.uint8_frames, record_video=args.record_video,
+            frame_skip=args.frame_skip, swept_collision=args.swept_collision,
+            level_sampling=args.level_sampling,
+            level_filter=solvable if args.solvable_only else None)
+    # A directory or level pack trains on all of its levels at once
+    env = make_environment(**env_kwargs)
+    pool = hasattr(env, 'levels')
+    if pool:
+        print("Training on {} levels from {}".format(len(env.levels),
+            args.filename))
 
     """ setting up PID controller """
     #action_constrain = [10, np.pi/20]
@@ -159,12 +185,46 @@ def run(args):
     #except:
     #    pass
 
-    if args.buffer == 'simple':
-        replay_buffer = ReplayBuffer(int(args.max_size))
+    # Image stacks share frames, store each frame only once
+    replay_path = args.replay_path if args.replay_path else None
+    if args.buffer == 'simple' and args.mode == 'rgb_array':
+        replay_buffer = FrameReplayBuffer(int(args.max_size),
+            path=replay_path)
+    elif args.buffer == 'simple':
+        replay_buffer = ReplayBuffer(int(args.max_size), path=replay_path)
+    elif args.buffer == 'priority' and args.mode == 'rgb_array':
+        replay_buffer = PrioritizedFrameReplayBuffer(int(args.max_size),
+            path=replay_path)
     elif args.buffer == 'priority':
-        replay_buffer = NaivePrioritizedBuffer(int(args.max_size))
+        replay_buffer = PrioritizedReplayBuffer(int(args.max_size),
+            path=replay_path)
     else:
         raise ValueError(args.buffer + ' is not a buffer name')
+    if args.mode == 'rgb_array':
+        nframes = int(args.max_size) + args.stack_size
+        print("Replay buffer: {} entries, {:.2f} GB of frames".format(
+            int(args.max_size), nframes * frame_bytes(args) / 2. ** 30))
+    if len(replay_buffer) > 0:
+        print("Resuming with {} entries in the replay buffer".format(
+            len(replay_buffer)))
+
+    if args.actors > 0:
+        if args.policy not in ['ddpg', 'td3']:
+            raise ValueError('Actor processes need an actor policy, not ' +
+                args.policy)
+        from .actor_learner import train_actor_learner
+        def evaluate(timesteps):
+            return evaluate_policy(tb_writer, times, rewards, env, args,
+                policy, timesteps, test_path)
+        train_actor_learner(args, env_kwargs, env, policy, replay_buffer,
+            max_action, evaluate, result_path, log_f)
+        return
+
+    # Per-step phase timings, flushed to TensorBoard every timing_freq steps
+    timers = None
+    if args.timing_freq > 0:
+        timers = StepTimers()
+        env.timers = timers
 
     state = env.reset()
     total_timesteps = 0
@@ -207,14 +267,18 @@ def run(args):
               else:
                   print("Greedy={}, std={}. Evaluating policy".format(
                     epsilon_greedy, noise_std)) # debug
+              # Evaluation steps are not training steps, leave them untimed
+              env.timers = None
               best_reward = evaluate_policy(
                   tb_writer, times, rewards, env, args,
                 policy, total_timesteps, test_path)
+              env.timers = timers
 
               ## save model parameters if improved
               if best_reward > best_avg_reward:
                   best_avg_reward = best_reward
                   policy.save(result_path)
+              replay_buffer.save(flush=True)
 
 
         """ exploration rate decay """
@@ -225,28 +289,41 @@ def run(args):
         # print("action based on PID: " + str(action))
 
         """ action selected based on pure policy """
+        if timers is not None:
+            t = timers.now()
         if total_timesteps > args.learning_start:
             action2 = policy.select_action(state)
         else:
             action2 = zero_noise
 
         action = np.clip(action2 + noise, -max_action, max_action)
+        if timers is not None:
+            t = timers.add('select_action', t)
 
         #print "action: ", action, "noise: ", noise, "action2: ", action2 # debug
 
         # Perform action
         new_state, reward, done = env.step(action)
+        if timers is not None:
+            t = timers.add('env_step', t)
 
         # Store data in replay buffer
         replay_buffer.add(state, new_state, action, reward, done)
+        if timers is not None:
+            t = timers.add('buffer_add', t)
 
         ## Train over the past episode
         if done:
+            level_str = ''
+            if pool:
+                level_str = ' L: ' + env.info['level']
+                tb_writer.add_scalar('level_reward/' + env.info['level'],
+                    env.total_reward, total_timesteps)
             if total_timesteps < args.learning_start:
                 str = ("Exploring TS:{:04d} E:{:04d} S:{:03d} R: {:.3f} ".format(
                     total_timesteps,
                     episode_num, env.t, env.total_reward,
-                    )) # debug
+                    )) + level_str # debug
                 print str
 
                 log_f.write(str + '\n')
@@ -267,14 +344,19 @@ def run(args):
                 beta = min(1.0, beta_start + total_timesteps *
                     (1.0 - beta_start) / beta_frames)
 
+                if timers is not None:
+                    t = timers.now()
                 critic_loss, actor_loss = policy.train(
                     replay_buffer, total_timesteps, beta, args)
+                if timers is not None:
+                    timers.add('train', t)
 
                 str = ("Training TS:{:04d} E:{:04d} S:{:03d} R: {:.3f} "
                     "CL: {:.5f} AL: {:.5f}".format(
                     total_timesteps,
                     episode_num, env.t, env.total_reward,
-                    critic_loss, actor_loss if actor_loss else 0)) # debug
+                    critic_loss, actor_loss if actor_loss else 0)) + \
+                    level_str # debug
                 print str
 
                 log_f.write(str + '\n')
@@ -286,6 +368,9 @@ def run(args):
                 else:
                     policy.q.eval()
 
+            # Keep an on-disk buffer resumable
+            replay_buffer.save()
+
             # Reset environment
             done = False
             new_state = env.reset(random_needle=args.random_needle)
@@ -297,6 +382,11 @@ def run(args):
         state = new_state
         total_timesteps += 1
 
+        if timers is not None:
+            timers.end_step()
+            if total_timesteps % args.timing_freq == 0:
+                timers.log(tb_writer, total_timesteps)
+
     print("Best Reward: ", best_reward)
 
 if __name__ == "__main__":
@@ -341,13 +431,30 @@ if __name__ == "__main__":
     parser.add_argument("--noise_clip", default=0.1, type=float,
         help='TD3 Range to clip target policy noise') # was 0.5
 
-    # For images, need smaller (1e4)
     parser.add_argument("--max_size", default=1e6, type=float,
         help='Size of replay buffer (bigger is better)')
+    parser.add_argument("--max-memory", default=8., type=float,
+        help='Most memory for the frames of an image replay buffer, in GB. '
+        'Caps max_size in rgb_array mode')
+    parser.add_argument("--actors", default=0, type=int,
+        help="Number of actor processes stepping environments while the "
+        "main process trains (0 to step and train in turn)")
+    parser.add_argument("--weight-sync", default=100, type=int,
+        help="Training updates between copies of the weights to the actors")
+    parser.add_argument("--batched-inference", default=False,
+        action='store_true',
+        help="Actors get their actions from the main process, which runs "
+        "their observations through the actor in batches")
+    parser.add_argument("--replay-path", default='', type=str,
+        help="Directory for a memory-mapped replay buffer. "
+        "An existing buffer there is resumed")
     parser.add_argument("--stack-size", default=3, type=int,
         help='How much history to use')
     parser.add_argument("--evaluation_episodes", default=1, type=int,
         help='How many times to evaluate actor (1 is enough)')
+    parser.add_argument("--timing-freq", default=0, type=int,
+        help='Time the phases of every step and write them to TensorBoard '
+        'every this many steps (0: off)')
     parser.add_argument("--profile", default=False, action="store_true",
         help="Profile the program for performance")
     parser.add_argument("--mode", default = 'state',
@@ -360,6 +467,31 @@ if __name__ == "__main__":
         action='store_true', help="Choose whether to use batchnorm")
     parser.add_argument("--img-dim", default = 224, type=int,
         help="Size of img (224 is max, 112/56 is optional)")
+    parser.add_argument("--direct-render", default = False,
+        action='store_true',
+        help="Draw directly at img-dim instead of scaling down a full frame")
+    parser.add_argument("--supersample", default = 1, type=int,
+        help="Supersampling factor used to antialias --direct-render")
+    parser.add_argument("--uint8-frames", default = False,
+        action='store_true',
+        help="Keep the image stack as uint8 grayscale in a ring buffer")
+    parser.add_argument("--frame-skip", default = 1, type=int,
+        help="Repeat each action for this many physics steps, rendering "
+        "only after the last one")
+    parser.add_argument("--swept-collision", default = False,
+        action='store_true',
+        help="Test the whole path of the needle tip over each step against "
+        "gates and deep tissue")
+    parser.add_argument("--level-sampling", default = 'uniform',
+        help="How a level is drawn at each reset when filename is a "
+        "directory or level pack: uniform or curriculum")
+    parser.add_argument("--solvable-only", default = False,
+        action='store_true',
+        help="Train only on the levels of the pool that the level index "
+        "(see scripts/level_stats.py) marks solvable")
+    parser.add_argument("--record-video", default = False,
+        action='store_true',
+        help="Record episodes into one video file each instead of PNGs")
     parser.add_argument("--action-steps", default = 50, type=int,
         help="Number of gradations allowed for action by DQN")
 
@@ -384,16 +516,23 @@ if __name__ == "__main__":
     parser.add_argument("--load-encoder", default='', type=str,
         help="File from which to load the encoder model")
 
-    parser.add_argument("filename", help='File for environment')
+    parser.add_argument("filename", help='File for environment, or a '
+        'directory or .nml level pack to train on all of its levels')
     parser.add_argument("policy", default="TD3", type=str,
             help="Policy type. DDPG/TD3/DQN")
 
     args = parser.parse_args()
     args.ou_noise = not args.no_ou_noise
+    if args.frame_skip < 1:
+        parser.error('--frame-skip must be at least 1')
 
     # Check for replay buffer that's too big
-    if args.mode == 'rgb_array' and args.max_size > 1e4:
-        args.max_size = 1e4
+    if args.mode == 'rgb_array':
+        max_frames = int(args.max_memory * 2 ** 30 / frame_bytes(args))
+        if args.max_size > max_frames - args.stack_size:
+            args.max_size = max_frames - args.stack_size
+            print("Capping max_size to {} to fit --max-memory".format(
+                int(args.max_size)))
 
     if args.profile:
         import cProfile
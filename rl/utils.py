@@ -1,3 +1,5 @@
+import os
+import json
 import numpy as np
 import torch
 import torch.nn as nn
@@ -12,43 +14,154 @@ plt.style.use('seaborn-whitegrid')
 # https://github.com/openai/baselines/blob/master/baselines/deepq/replay_buffer.py
 
 # Expects tuples of (state, next_state, action, reward, done)
-class ReplayBuffer:
-    def __init__(self, max_size=1e6):
-        self.storage = []
-        self.max_size = max_size
-        self.ptr = 0
+class ReplayBuffer(object):
+    ''' Uniform replay buffer with preallocated storage.
+        Each field is one contiguous array of max_size rows, allocated on
+        the first add (when the shapes are known) and written as a ring.
+        Samples are gathered into output arrays reused between calls.
+
+        With a path the arrays are .npy files in that directory, opened
+        with np.memmap, so the buffer can be larger than RAM. save()
+        writes the ring pointer and size to header.json. When the
+        directory already holds a header, the buffer resumes from it.
+    '''
+    def __init__(self, max_size=1e6, path=None):
+        self.max_size = int(max_size)
+        self.path = path
+        self.header = self._read_header()
+        self.ptr = self.header.get('ptr', 0)
+        self.size = self.header.get('size', 0)
+        self.storage = None
+        if 'storage' in self.header:
+            self.storage = [self._array('storage_{}'.format(i))
+                for i in range(self.header['storage'])]
+        self.batch = None
         self.const_w = None
 
+    def _read_header(self):
+        if self.path is None:
+            return {}
+        header_file = os.path.join(self.path, 'header.json')
+        if not os.path.exists(header_file):
+            return {}
+        with open(header_file) as f:
+            header = json.load(f)
+        if header['max_size'] != self.max_size:
+            raise ValueError('{} holds a buffer of size {}, not {}'.format(
+                self.path, header['max_size'], self.max_size))
+        return header
+
+    def _array(self, name, shape=None, dtype=None, fill=None):
+        ''' A storage array, in RAM or memory-mapped under path.
+            Without a shape, the array saved in the header is reopened.
+        '''
+        if self.path is None:
+            if fill is None:
+                return np.empty(shape, dtype=dtype)
+            return np.full(shape, fill, dtype=dtype)
+        filename = os.path.join(self.path, name + '.npy')
+        if shape is None or name in self.header.get('arrays', []):
+            array = np.load(filename, mmap_mode='r+')
+            if shape is not None and array.shape != tuple(shape):
+                raise ValueError('{} has shape {}, not {}'.format(
+                    filename, array.shape, tuple(shape)))
+            return array
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        # New files are zero filled
+        array = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+            shape=shape)
+        if fill:
+            array[:] = fill
+        self.header.setdefault('arrays', []).append(name)
+        return array
+
+    def _get_header(self):
+        ''' Scalars needed to resume the buffer '''
+        header = {'max_size': self.max_size, 'ptr': self.ptr,
+            'size': self.size, 'arrays': self.header.get('arrays', [])}
+        if self.storage is not None:
+            header['storage'] = len(self.storage)
+        return header
+
+    def save(self, flush=False):
+        ''' Write the header so the buffer can be resumed.
+            flush also writes the arrays to disk, instead of leaving it to
+            the OS page cache.
+        '''
+        if self.path is None:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        if flush:
+            for name in self.header.get('arrays', []):
+                array = self._mapped(name)
+                if array is not None:
+                    array.flush()
+        self.header = self._get_header()
+        header_file = os.path.join(self.path, 'header.json')
+        with open(header_file + '.tmp', 'w') as f:
+            json.dump(self.header, f)
+        os.rename(header_file + '.tmp', header_file)
+
+    def _mapped(self, name):
+        if name.startswith('storage_'):
+            return self.storage[int(name[len('storage_'):])]
+        return getattr(self, name, None)
+
     def add(self, state, new_state, action, reward, done_bool):
-        data = (np.array(state, copy=False), np.array(new_state, copy=False),
-                np.array(action, copy=False), np.array(reward, copy=False),
-                    np.array(done_bool, copy=False))
-        if len(self.storage) == self.max_size:
-            self.storage[int(self.ptr)] = data
-            self.ptr = (self.ptr + 1) % self.max_size
-        else:
-            self.storage.append(data)
+        self._store(self.ptr, state, new_state, action, reward, done_bool)
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
 
-    def sample(self, batch_size, beta):
-        ind = np.random.randint(0, len(self.storage), size=batch_size)
-        x, y, u, r, d = [], [], [], [], []
+    def _store(self, idx, state, new_state, action, reward, done_bool):
+        # Copied in: image stacks may be views into the env's buffer
+        data = (np.asarray(state), np.asarray(new_state),
+                np.asarray(action, dtype=np.float32),
+                np.asarray(reward, dtype=np.float32),
+                np.asarray(done_bool, dtype=np.float32))
+        if self.storage is None:
+            self.storage = [self._array('storage_{}'.format(i),
+                (self.max_size,) + x.shape, x.dtype)
+                for i, x in enumerate(data)]
+        for store, x in zip(self.storage, data):
+            store[idx] = x
+
+    def _evict(self, indices):
+        ''' Called when stored entries stop being valid before being
+            overwritten '''
+        pass
 
-        for i in ind:
-            X, Y, U, R, D = self.storage[i]
-            x.append(X)
-            y.append(Y)
-            u.append(U)
-            r.append(R)
-            d.append(D)
+    def _gather(self, indices):
+        ''' Fields of the entries at indices, in the reused output arrays '''
+        batch_size = len(indices)
+        if self.batch is None or len(self.batch[0]) != batch_size:
+            self.batch = [np.empty((batch_size,) + store.shape[1:],
+                dtype=store.dtype) for store in self.storage]
 
+        # One gather per field
+        for store, out in zip(self.storage, self.batch):
+            np.take(store, indices, axis=0, out=out)
+        return self.batch
+
+    def sample(self, batch_size, beta):
+        # The valid entries are the last size entries written
+        ind = (self.ptr - self.size +
+            np.random.randint(0, self.size, size=batch_size)) % self.max_size
+        if self.const_w is None or len(self.const_w) != batch_size:
+            self.const_w = np.ones((batch_size,), dtype=np.float32)
+        x, y, u, r, d = self._gather(ind)
 
         #print "X.shape = ", np.array(U).shape, "x.shape = ", np.array(u).shape
-        return (np.array(x), np.array(y), np.array(u), np.array(r).reshape(-1, 1),
-                np.array(d).reshape(-1, 1), None, np.ones((batch_size,), dtype=np.float32))
+        return (x, y, u, r.reshape(-1, 1), d.reshape(-1, 1), None,
+                self.const_w)
 
     def update_priorities(self, x, y):
         pass
 
+    def __len__(self):
+        return self.size
+
 class NaivePrioritizedBuffer:
     def __init__(self, capacity, prob_alpha=0.6):
         self.prob_alpha = prob_alpha
@@ -62,8 +175,9 @@ class NaivePrioritizedBuffer:
 
     def add(self, state, next_state, action, reward, done):
         assert state.ndim == next_state.ndim
-        state = np.expand_dims(state, 0)
-        next_state = np.expand_dims(next_state, 0)
+        # Copy the states: image stacks may be views into the env's buffer
+        state = np.expand_dims(np.array(state), 0)
+        next_state = np.expand_dims(np.array(next_state), 0)
 
         max_prio = self.priorities.max() if self.buffer else 1.0
 
@@ -95,16 +209,16 @@ class NaivePrioritizedBuffer:
         samples = [self.buffer[idx] for idx in indices]
         batch = list(zip(*samples))
 
-        if self.states is None:
-            self.states = np.array(np.concatenate(batch[0]), copy=False)
-            self.next_states = np.array(np.concatenate(batch[1]), copy=False)
+        if self.states is None or len(self.states) != batch_size:
+            self.states = np.concatenate(batch[0])
+            self.next_states = np.concatenate(batch[1])
         else:
             np.concatenate(batch[0], out=self.states)
             np.concatenate(batch[1], out=self.next_states)
 
-        actions = np.array(batch[2], copy=False)
-        rewards = np.array(batch[3], copy=False).reshape(-1, 1)
-        dones = np.array(batch[4], copy=False).reshape(-1, 1)
+        actions = np.asarray(batch[2])
+        rewards = np.asarray(batch[3]).reshape(-1, 1)
+        dones = np.asarray(batch[4]).reshape(-1, 1)
 
         return (self.states, self.next_states, actions, rewards, dones,
             indices, weights)
@@ -116,6 +230,198 @@ class NaivePrioritizedBuffer:
     def __len__(self):
         return len(self.buffer)
 
+class PrioritizedReplayBuffer(ReplayBuffer):
+    ''' Proportional prioritized replay over a sum tree and a min tree.
+        Both trees are flat arrays with the leaves in the second half, so
+        sampling a batch is one vectorized descent and updating priorities
+        is one pass per tree level: O(batch_size log N) instead of O(N).
+        Priorities are stored raised to the power alpha.
+    '''
+    def __init__(self, max_size=1e6, prob_alpha=0.6, path=None):
+        ReplayBuffer.__init__(self, max_size, path)
+        self.prob_alpha = prob_alpha
+        self.depth = int(np.ceil(np.log2(max(self.max_size, 2))))
+        self.leaves = 2 ** self.depth
+        self.sum_tree = self._array('sum_tree', (2 * self.leaves,),
+            np.float64, 0.)
+        self.min_tree = self._array('min_tree', (2 * self.leaves,),
+            np.float64, np.inf)
+        self.max_prio = self.header.get('max_prio', 1.0)
+
+    def _get_header(self):
+        header = super(PrioritizedReplayBuffer, self)._get_header()
+        header['max_prio'] = float(self.max_prio)
+        return header
+
+    def _set(self, indices, prios):
+        ''' Set the leaves at indices and recompute their ancestors '''
+        nodes = np.asarray(indices) + self.leaves
+        prios = np.asarray(prios, dtype=np.float64)
+        self.sum_tree[nodes] = prios
+        # Empty leaves must not count as the minimum
+        self.min_tree[nodes] = np.where(prios > 0, prios, np.inf)
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            left, right = 2 * nodes, 2 * nodes + 1
+            self.sum_tree[nodes] = self.sum_tree[left] + self.sum_tree[right]
+            self.min_tree[nodes] = np.minimum(self.min_tree[left],
+                self.min_tree[right])
+
+    def add(self, state, new_state, action, reward, done_bool):
+        idx = self.ptr
+        ReplayBuffer.add(self, state, new_state, action, reward, done_bool)
+        # Single leaf: a scalar walk up is cheaper than the batched _set
+        node = idx + self.leaves
+        self.sum_tree[node] = self.min_tree[node] = \
+            self.max_prio ** self.prob_alpha
+        while node > 1:
+            node //= 2
+            left, right = 2 * node, 2 * node + 1
+            self.sum_tree[node] = self.sum_tree[left] + self.sum_tree[right]
+            self.min_tree[node] = min(self.min_tree[left],
+                self.min_tree[right])
+
+    def _evict(self, indices):
+        self._set(indices, 0.)
+
+    def sample(self, batch_size, beta=0.4):
+        # One uniform sample in each of batch_size equal segments of the total
+        total = self.sum_tree[1]
+        targets = (np.arange(batch_size) + np.random.uniform(
+            size=batch_size)) * (total / batch_size)
+
+        nodes = np.ones((batch_size,), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.sum_tree[left]
+            # Never step into an empty subtree, even when rounding says so
+            go_right = (targets >= left_sum) & (self.sum_tree[left + 1] > 0)
+            targets -= left_sum * go_right
+            nodes = left + go_right
+        indices = nodes - self.leaves
+
+        # Importance sampling weights, normalized by the largest possible one
+        probs = self.sum_tree[nodes] / total
+        min_prob = self.min_tree[1] / total
+        weights = (probs / min_prob) ** (-beta)
+        weights = weights.astype(np.float32)
+
+        x, y, u, r, d = self._gather(indices)
+        return (x, y, u, r.reshape(-1, 1), d.reshape(-1, 1), indices, weights)
+
+    def update_priorities(self, batch_indices, batch_priorities):
+        batch_priorities = np.asarray(batch_priorities,
+            dtype=np.float64).reshape(-1)
+        self.max_prio = max(self.max_prio, batch_priorities.max())
+        # A repeated index keeps its last priority, as in a sequential update
+        self._set(batch_indices, batch_priorities ** self.prob_alpha)
+
+class FrameReplayBuffer(ReplayBuffer):
+    ''' Replay buffer for stacked image observations that stores every
+        frame once.
+
+        Frames go into one ring, in the order they were rendered, and each
+        entry keeps the ring position of the last frame of its state and
+        of the first frame of its episode. The state and next state stacks
+        are rebuilt at sample time; frames from before the start of the
+        episode are replaced by its first frame, as Environment.reset does.
+        Entries are expected in episode order: a state that is not the
+        new_state of the previous add starts a new episode.
+    '''
+    def __init__(self, max_size=1e6, path=None):
+        ReplayBuffer.__init__(self, max_size, path)
+        self._init_frames()
+
+    def _init_frames(self):
+        self.frames = None
+        self.nframes = self.header.get('nframes', 0) # Frames written so far
+        self.new_episode = self.header.get('new_episode', True)
+        self.episode_begin = self.header.get('episode_begin', 0)
+        if 'stack_size' in self.header:
+            self.stack_size = self.header['stack_size']
+            self.frames = self._array('frames')
+            self.frame_pos = self._array('frame_pos')
+            self.episode_pos = self._array('episode_pos')
+
+    def _get_header(self):
+        header = super(FrameReplayBuffer, self)._get_header()
+        header.update(nframes=self.nframes, new_episode=self.new_episode,
+            episode_begin=self.episode_begin)
+        if self.frames is not None:
+            header['stack_size'] = self.stack_size
+        return header
+
+    def _push_frame(self, frame):
+        self.frames[self.nframes % len(self.frames)] = frame
+        self.nframes += 1
+
+    def _store(self, idx, state, new_state, action, reward, done_bool):
+        state = np.asarray(state)
+        if self.frames is None:
+            self.stack_size = state.shape[0]
+            # Enough frames for max_size entries and their stacks
+            self.frames = self._array('frames',
+                (self.max_size + self.stack_size,) + state.shape[1:],
+                state.dtype)
+            self.frame_pos = self._array('frame_pos', (self.max_size,),
+                np.int64, 0)
+            self.episode_pos = self._array('episode_pos', (self.max_size,),
+                np.int64, 0)
+            self.storage = [self._array('storage_{}'.format(i),
+                (self.max_size,) + np.shape(x), np.float32)
+                for i, x in enumerate((action, reward, done_bool))]
+
+        if self.size == self.max_size:
+            self.size -= 1 # idx held the oldest entry
+        # A state that does not follow the last new_state (e.g. after an
+        # evaluation run on the same env) also starts a new episode
+        if self.new_episode or not np.array_equal(state[-1],
+                self.frames[(self.nframes - 1) % len(self.frames)]):
+            self._push_frame(state[-1])
+            self.episode_begin = self.nframes - 1
+        self.frame_pos[idx] = self.nframes - 1
+        self.episode_pos[idx] = self.episode_begin
+        self._push_frame(np.asarray(new_state)[-1])
+        self.new_episode = bool(done_bool)
+        for store, x in zip(self.storage, (action, reward, done_bool)):
+            store[idx] = x
+
+        # Drop the oldest entries whose frames were overwritten
+        oldest = self.nframes - len(self.frames)
+        while self.size > 0:
+            tail = (idx - self.size) % self.max_size
+            first = max(self.frame_pos[tail] - self.stack_size + 1,
+                self.episode_pos[tail])
+            if first >= oldest:
+                break
+            self._evict([tail])
+            self.size -= 1
+
+    def _gather(self, indices):
+        batch_size = len(indices)
+        if self.batch is None or len(self.batch[0]) != batch_size:
+            stack_shape = (batch_size, self.stack_size) + self.frames.shape[1:]
+            self.batch = ([np.empty(stack_shape, dtype=self.frames.dtype)
+                for _ in range(2)] +
+                [np.empty((batch_size,) + store.shape[1:], dtype=store.dtype)
+                for store in self.storage])
+
+        offsets = np.arange(1 - self.stack_size, 1)
+        last = self.frame_pos[indices][:, None]
+        begin = self.episode_pos[indices][:, None]
+        for out, pos in zip(self.batch[:2], (last, last + 1)):
+            frame_idx = np.maximum(pos + offsets, begin) % len(self.frames)
+            np.take(self.frames, frame_idx, axis=0, out=out)
+        for store, out in zip(self.storage, self.batch[2:]):
+            np.take(store, indices, axis=0, out=out)
+        return self.batch
+
+class PrioritizedFrameReplayBuffer(FrameReplayBuffer, PrioritizedReplayBuffer):
+    ''' Prioritized replay with the frame storage of FrameReplayBuffer '''
+    def __init__(self, max_size=1e6, prob_alpha=0.6, path=None):
+        PrioritizedReplayBuffer.__init__(self, max_size, prob_alpha, path)
+        self._init_frames()
+
 class OUNoise:
     '''Ornstein-Uhlenbeck process
        @param mu: mean
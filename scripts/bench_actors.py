@@ -0,0 +1,142 @@
+"""
+    Actor throughput benchmark for the actor/learner training mode
+
+    Starts K actor processes (rl/actor_learner.run_actor) with an untrained
+    actor network, and drains their transition rings for --seconds, as the
+    learner does but without training. With --batched-inference the actors
+    get their actions from an InferenceServer in this process. Reports the
+    environment steps per second for each K, to see how collection scales
+    with the actors and the cores of the machine.
+
+    [Usage] python bench_actors.py [--actors 1 2 4 8] [--mode state]
+                                   [--seconds N] [--batched-inference]
+                                   [-o results.json]
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import torch
+from context import needlemaster
+from needlemaster.environment import Environment
+from rl.actor_learner import TransitionRing, run_actor, serve_actors, mp
+from rl.inference import InferenceServer
+from rl.models import ActorImage, ActorState
+
+MAX_ACTION = 0.25 * np.pi
+
+def bench(actors, env_kwargs, args):
+    env = Environment(**env_kwargs)
+    state = env.reset()
+    if args.mode == 'rgb_array':
+        actor = ActorImage(1, args.stack_size, MAX_ACTION, img_dim=args.img_dim)
+    else:
+        actor = ActorState(np.size(state), 1, MAX_ACTION)
+    actor.eval()
+    actor.share_memory()
+    capacity = 2 * (env.max_time + 2)
+    rings = [TransitionRing(capacity, np.shape(state),
+        np.asarray(state).dtype, 1) for _ in range(actors)]
+    actor_args = argparse.Namespace(seed=0, random_needle=False,
+        ou_noise=False, expl_noise=0.1, mode=args.mode)
+    version = mp.Value('l', 0)
+    lock = mp.Lock()
+    stop = mp.Event()
+    server = None
+    conns = [None] * actors
+    if args.batched_inference:
+        server = InferenceServer(actor, args.mode, max_batch=actors)
+        pipes = [mp.Pipe() for _ in range(actors)]
+        conns = [actor_end for _, actor_end in pipes]
+    processes = [mp.Process(target=run_actor, args=(i, actor_args,
+        env_kwargs, ring, actor, version, lock, stop, MAX_ACTION, conn))
+        for i, (ring, conn) in enumerate(zip(rings, conns))]
+    for p in processes:
+        p.daemon = True
+        p.start()
+    if server is not None:
+        for _, actor_end in pipes:
+            actor_end.close()
+        serve_actors(server, [learner_end for learner_end, _ in pipes])
+
+    def drain():
+        return sum(ring.drain(lambda *x: None) for ring in rings)
+
+    try:
+        # Wait for every actor to start, then let them run for a while
+        while any(ring.written.value == 0 for ring in rings):
+            for p in processes:
+                if not p.is_alive():
+                    raise RuntimeError('Actor process {} exited'.format(p.pid))
+            drain()
+            time.sleep(0.01)
+        deadline = time.time() + args.warmup
+        while time.time() < deadline:
+            drain()
+            time.sleep(0.01)
+        steps = 0
+        if server is not None:
+            server.reset_metrics()
+        start = time.time()
+        while time.time() - start < args.seconds:
+            steps += drain()
+            time.sleep(0.01)
+        total = time.time() - start
+    finally:
+        stop.set()
+        for p in processes:
+            p.join()
+        if server is not None:
+            server.close()
+    result = {'actors': actors,
+              'steps': steps,
+              'steps_per_sec': steps / total,
+              'steps_per_sec_per_actor': steps / total / actors}
+    if server is not None:
+        result['inference'] = server.metrics()
+    return result
+
+def run(args):
+    env_kwargs = dict(filename=args.filename, mode=args.mode,
+        stack_size=args.stack_size, img_dim=args.img_dim,
+        uint8_frames=args.mode == 'rgb_array', async_record=False)
+    results = []
+    for actors in args.actors:
+        r = bench(actors, env_kwargs, args)
+        results.append(r)
+        line = "{:3d} actors {:8.1f} steps/s {:8.1f} steps/s per actor".format(
+            actors, r['steps_per_sec'], r['steps_per_sec_per_actor'])
+        if 'inference' in r:
+            line += " | batch {:.2f}".format(r['inference']['batch_size_mean'])
+        print(line)
+
+    if args.output:
+        output = {'cpus': multiprocessing.cpu_count(),
+                  'torch': torch.__version__,
+                  'options': vars(args),
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+        print("Wrote " + args.output)
+
+#-------------------------------------------------------
+# main()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default='', help='JSON file to write')
+    parser.add_argument('--filename', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+        'environment_1.txt'))
+    parser.add_argument('--actors', type=int, nargs='*', default=[1, 2, 4, 8])
+    parser.add_argument('--mode', default='state',
+        choices=['state', 'rgb_array'])
+    parser.add_argument('--img-dim', type=int, default=56)
+    parser.add_argument('--stack-size', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=10.,
+        help='Time measured per number of actors')
+    parser.add_argument('--warmup', type=float, default=3.)
+    parser.add_argument('--batched-inference', action='store_true',
+        help='Run the actors\' network in this process, batched')
+    run(parser.parse_args())
@@ -0,0 +1,149 @@
+"""
+    Environment throughput benchmark
+
+    Steps every level in state, rgb_array and both modes, for each image
+    size and stack size, with a random and a fixed (straight ahead) action
+    stream. For each configuration it reports steps/s, resets/s and the
+    mean time per step spent in each phase of Environment.step (as charged
+    to the StepTimers in env.timers), and writes
+    everything as JSON to compare runs across commits.
+
+    [Usage] python bench_env.py [-o results.json] [--levels 0 3] [--steps N]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+import pygame
+from context import needlemaster
+from needlemaster.environment import Environment
+from needlemaster.timing import StepTimers
+
+MAX_ACTION = 0.25 * np.pi
+
+def actions(kind, steps, seed):
+    if kind == 'random':
+        rng = np.random.RandomState(seed)
+        return rng.uniform(-MAX_ACTION, MAX_ACTION, (steps, 1))
+    return np.zeros((steps, 1))
+
+def bench(filename, mode, img_dim, stack_size, action_kind, args):
+    timers = StepTimers()
+    env = Environment(mode, stack_size, filename=filename, img_dim=img_dim,
+        direct_render=args.direct_render, supersample=args.supersample,
+        uint8_frames=args.uint8_frames, async_record=False,
+        frame_skip=args.frame_skip)
+    env.record = False
+
+    # Resets
+    start = timers.now()
+    for _ in range(args.resets):
+        env.reset()
+    reset_time = timers.now() - start
+    env.record = False
+
+    # Steps, with the phases timed by the environment
+    env.timers = timers
+    resets = 0
+    step_time = 0.
+    for action in actions(action_kind, args.steps, args.seed):
+        start = timers.now()
+        _, _, done = env.step(action)
+        step_time += timers.now() - start
+        timers.end_step()
+        if done:
+            env.reset()
+            env.record = False
+            resets += 1
+    env.close()
+
+    phases = dict((k, 1000. * sum(v) / args.steps)
+        for k, v in timers.samples.items())
+    phases['other'] = 1000. * step_time / args.steps - sum(phases.values())
+    return {'level': os.path.basename(filename),
+            'mode': mode,
+            'img_dim': img_dim,
+            'stack_size': stack_size,
+            'actions': action_kind,
+            'steps': args.steps,
+            'episodes_ended': resets,
+            'steps_per_sec': args.steps / step_time,
+            'step_ms': 1000. * step_time / args.steps,
+            'resets_per_sec': args.resets / reset_time,
+            'reset_ms': 1000. * reset_time / args.resets,
+            'phase_ms': phases}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    levels = sorted(f for f in os.listdir(args.data) if
+        f.startswith('environment_') and f.endswith('.txt'))
+    if args.levels:
+        levels = ['environment_{}.txt'.format(i) for i in args.levels]
+
+    configs = []
+    for mode in args.modes:
+        if mode == 'state':
+            configs.append((mode, args.img_dims[0], 1))
+        else:
+            configs += [(mode, dim, stack) for dim in args.img_dims
+                for stack in args.stack_sizes]
+
+    results = []
+    for level in levels:
+        for mode, img_dim, stack_size in configs:
+            for action_kind in args.actions:
+                r = bench(os.path.join(args.data, level), mode, img_dim,
+                    stack_size, action_kind, args)
+                results.append(r)
+                print("{:20s} {:9s} dim {:3d} stack {} {:6s} "
+                    "{:8.1f} steps/s {:8.1f} resets/s".format(
+                    r['level'], mode, img_dim, stack_size, action_kind,
+                    r['steps_per_sec'], r['resets_per_sec']))
+
+    output = {'commit': git_commit(),
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pygame': pygame.version.ver,
+              'platform': platform.platform(),
+              'options': vars(args),
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    print("Wrote " + args.output)
+
+#-------------------------------------------------------
+# main()
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'data')
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', '--output', default='bench_env.json',
+    help='JSON file to write')
+parser.add_argument('--data', default=data_dir, help='Directory of levels')
+parser.add_argument('--levels', type=int, nargs='*',
+    help='Level numbers (default: every level in the data directory)')
+parser.add_argument('--modes', nargs='*', default=['state', 'rgb_array', 'both'])
+parser.add_argument('--img-dims', type=int, nargs='*', default=[224, 112, 56])
+parser.add_argument('--stack-sizes', type=int, nargs='*', default=[1, 3, 4])
+parser.add_argument('--actions', nargs='*', default=['random', 'fixed'],
+    help='Action streams: random (seeded) and/or fixed (straight ahead)')
+parser.add_argument('--steps', type=int, default=300,
+    help='Steps per configuration')
+parser.add_argument('--resets', type=int, default=20,
+    help='Resets timed per configuration')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--direct-render', action='store_true')
+parser.add_argument('--supersample', type=int, default=1)
+parser.add_argument('--uint8-frames', action='store_true')
+parser.add_argument('--frame-skip', type=int, default=1)
+run(parser.parse_args())
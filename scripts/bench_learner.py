@@ -0,0 +1,175 @@
+"""
+    Learner micro-benchmark
+
+    Times TD3.train, DDPG.train and DQN.train per update, on the CPU unless
+    --cuda is given, from a replay buffer filled with random transitions.
+    Each update is split into phases:
+        sample      replay_buffer.sample
+        h2d         copy_sample_to_device (host to device copy, normalizing)
+        fwd_bwd     forward and backward passes and optimizer steps
+        priorities  replay_buffer.update_priorities
+        target      update_targets (the soft target network updates)
+
+    [Usage] python bench_learner.py [-o results.json] [--policies td3 dqn]
+                                    [--modes state rgb_array] [--updates N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# The policies pick their device when imported
+if '--cuda' not in sys.argv:
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import numpy as np
+import torch
+from context import needlemaster
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+    '..', 'rl')))
+from rl.utils import ReplayBuffer, PrioritizedReplayBuffer, \
+    FrameReplayBuffer, PrioritizedFrameReplayBuffer
+
+STATE_DIM = 15
+MAX_ACTION = 0.25 * np.pi
+PHASES = ['sample', 'h2d', 'fwd_bwd', 'priorities', 'target']
+
+class PhaseTimer:
+    ''' Accumulates the time spent in wrapped functions '''
+    def __init__(self, cuda):
+        self.cuda = cuda
+        self.totals = {}
+
+    def sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def wrap(self, phase, fn):
+        def timed(*args, **kwargs):
+            self.sync()
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.sync()
+                self.totals[phase] = (self.totals.get(phase, 0.) +
+                    time.time() - start)
+        return timed
+
+def make_policy(name, mode, args):
+    if name == 'td3':
+        from TD3 import TD3
+        return TD3(STATE_DIM, 1, args.stack_size, MAX_ACTION, mode,
+            lr=1e-4, img_dim=args.img_dim)
+    elif name == 'ddpg':
+        from DDPG import DDPG
+        return DDPG(STATE_DIM, 1, args.stack_size, MAX_ACTION, mode,
+            lr=1e-4, img_dim=args.img_dim)
+    elif name == 'dqn':
+        from DQN import DQN
+        return DQN(STATE_DIM, 1, args.action_steps, args.stack_size,
+            MAX_ACTION, mode, lr=1e-4, img_dim=args.img_dim)
+    raise ValueError(name + ' is not recognized as a valid policy')
+
+def make_buffer(mode, args):
+    ''' A buffer of args.buffer_size random transitions '''
+    if mode == 'rgb_array':
+        cls = PrioritizedFrameReplayBuffer if args.prioritized else \
+            FrameReplayBuffer
+        shape = (args.stack_size, args.img_dim, args.img_dim)
+        state = np.random.randint(0, 256, shape).astype(np.uint8)
+    else:
+        cls = PrioritizedReplayBuffer if args.prioritized else ReplayBuffer
+        state = np.random.rand(1, STATE_DIM).astype(np.float32)
+    buf = cls(args.buffer_size)
+    for t in range(args.buffer_size):
+        if mode == 'rgb_array':
+            frame = np.random.randint(0, 256, (1, args.img_dim, args.img_dim))
+            new_state = np.concatenate([state[1:], frame.astype(np.uint8)])
+        else:
+            new_state = np.random.rand(1, STATE_DIM).astype(np.float32)
+        action = np.random.uniform(-MAX_ACTION, MAX_ACTION, (1,))
+        buf.add(state, new_state, action, np.random.rand(), t % 100 == 99)
+        state = new_state
+    return buf
+
+def bench(name, mode, buf, args):
+    policy = make_policy(name, mode, args)
+    timer = PhaseTimer(args.cuda)
+    policy.copy_sample_to_device = timer.wrap('h2d',
+        policy.copy_sample_to_device)
+    policy.update_targets = timer.wrap('target', policy.update_targets)
+    sample, update_priorities = buf.sample, buf.update_priorities
+    buf.sample = timer.wrap('sample', sample)
+    buf.update_priorities = timer.wrap('priorities', update_priorities)
+    train_args = argparse.Namespace(batch_size=args.batch_size,
+        discount=0.99, tau=0.001, actor_tau=0.001, policy_noise=0.04,
+        noise_clip=0.1, policy_freq=2)
+
+    try:
+        for t in range(args.warmup):
+            policy.train(buf, t, 0.4, train_args)
+        timer.totals = {}
+        timer.sync()
+        start = time.time()
+        for t in range(args.updates):
+            policy.train(buf, t, 0.4, train_args)
+        timer.sync()
+        total = time.time() - start
+    finally:
+        buf.sample, buf.update_priorities = sample, update_priorities
+
+    phases = dict((k, 1000. * v / args.updates)
+        for k, v in timer.totals.items())
+    phases['fwd_bwd'] = 1000. * total / args.updates - sum(phases.values())
+    return {'policy': name,
+            'mode': mode,
+            'updates_per_sec': args.updates / total,
+            'update_ms': 1000. * total / args.updates,
+            'phase_ms': phases}
+
+def run(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    results = []
+    for mode in args.modes:
+        buf = make_buffer(mode, args)
+        for name in args.policies:
+            r = bench(name, mode, buf, args)
+            results.append(r)
+            print("{:5s} {:9s} {:7.1f} updates/s {:8.2f} ms | ".format(
+                name, mode, r['updates_per_sec'], r['update_ms']) +
+                ' '.join('{} {:.2f}'.format(p, r['phase_ms'].get(p, 0.))
+                    for p in PHASES))
+
+    if args.output:
+        output = {'torch': torch.__version__,
+                  'threads': torch.get_num_threads(),
+                  'device': 'cuda' if args.cuda else 'cpu',
+                  'options': vars(args),
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+        print("Wrote " + args.output)
+
+#-------------------------------------------------------
+# main()
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', '--output', default='', help='JSON file to write')
+parser.add_argument('--policies', nargs='*', default=['td3', 'ddpg', 'dqn'])
+parser.add_argument('--modes', nargs='*', default=['state', 'rgb_array'])
+parser.add_argument('--batch-size', type=int, default=1024)
+parser.add_argument('--img-dim', type=int, default=56)
+parser.add_argument('--stack-size', type=int, default=3)
+parser.add_argument('--action-steps', type=int, default=50)
+parser.add_argument('--buffer-size', type=int, default=5000)
+parser.add_argument('--prioritized', action='store_true',
+    help='Sample from the prioritized buffers')
+parser.add_argument('--updates', type=int, default=50,
+    help='Updates timed per policy and mode')
+parser.add_argument('--warmup', type=int, default=5)
+parser.add_argument('--threads', type=int, default=0,
+    help='torch threads (default: torch\'s choice)')
+parser.add_argument('--cuda', action='store_true')
+run(parser.parse_args())
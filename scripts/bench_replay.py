@@ -0,0 +1,250 @@
+"""
+    Replay buffer micro-benchmark
+
+    For each buffer, capacity and observation type, fills the buffer to
+    capacity with random transitions in episodes of 100 steps, and reports
+    the add rate, the latency of sample and of update_priorities at each
+    batch size, and the resident memory the buffer added. State entries are
+    [1, 15] float32, image entries are stacks of 4 uint8 frames of 56x56.
+
+    Each configuration runs in a fresh process so the memory of one does not
+    hide that of the next. Configurations estimated (from a short fill) to
+    need more than --max-memory GB are skipped.
+
+    [Usage] python bench_replay.py [-o results.json] [--capacities 1e4 1e5]
+                                   [--buffers ReplayBuffer ReplayMemory]
+"""
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import torch
+from context import needlemaster
+from rl.utils import ReplayBuffer, PrioritizedReplayBuffer, \
+    FrameReplayBuffer, PrioritizedFrameReplayBuffer, NaivePrioritizedBuffer
+from rainbow_dqn.memory import ReplayMemory
+
+STACK = 4
+IMG_DIM = 56
+STATE_DIM = 15
+EPISODE_LEN = 100
+PROBE = 2000
+
+def resident_memory():
+    ''' Resident set size of this process in bytes '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource # Peak, not current, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Observations(object):
+    ''' Precomputed random observations, so the fill only times add '''
+    def __init__(self, image):
+        self.image = image
+        if image:
+            self.pool = np.random.randint(0, 256,
+                (64, IMG_DIM, IMG_DIM)).astype(np.uint8)
+        else:
+            self.pool = np.random.rand(64, 1, STATE_DIM).astype(np.float32)
+
+    def first(self):
+        if self.image:
+            return self.pool[:STACK].copy()
+        return self.pool[0]
+
+    def next(self, state, t):
+        if self.image:
+            # Consecutive stacks share frames, as from the environment
+            return np.concatenate([state[1:], self.pool[t % 64][None]])
+        return self.pool[t % 64]
+
+class RainbowAdapter(object):
+    ''' Gives rainbow_dqn.memory.ReplayMemory the interface of the rl
+        buffers. It stores the last frame of each state as uint8 and
+        samples [n-step return, history] stacks itself.
+    '''
+    def __init__(self, capacity, image):
+        args = argparse.Namespace(history_length=STACK if image else 1,
+            discount=0.99, multi_step=3, priority_weight=0.4,
+            priority_exponent=0.5)
+        self.image = image
+        shape = (IMG_DIM, IMG_DIM) if image else (STATE_DIM,)
+        self.memory = ReplayMemory(args, int(capacity),
+            torch.zeros((args.history_length,) + shape))
+
+    def add(self, state, next_state, action, reward, done):
+        # The rainbow agent passes float tensors in [0, 1]
+        state = torch.from_numpy(state).float()
+        if self.image:
+            state.div_(255)
+        self.memory.append(state, 0, reward, done)
+
+    def sample(self, batch_size, beta):
+        self.memory.priority_weight = beta
+        indices, states, _, _, _, _, weights = self.memory.sample(batch_size)
+        return states, None, None, None, None, indices, weights
+
+    def update_priorities(self, indices, priorities):
+        self.memory.update_priorities(indices, priorities)
+
+BUFFERS = dict([
+    ('ReplayBuffer', lambda c, image, path:
+        (FrameReplayBuffer if image else ReplayBuffer)(c, path=path)),
+    ('PrioritizedReplayBuffer', lambda c, image, path:
+        (PrioritizedFrameReplayBuffer if image else
+            PrioritizedReplayBuffer)(c, path=path)),
+    ('NaivePrioritizedBuffer', lambda c, image, path:
+        NaivePrioritizedBuffer(int(c))),
+    ('ReplayMemory', lambda c, image, path: RainbowAdapter(c, image)),
+])
+NAMES = ['ReplayBuffer', 'PrioritizedReplayBuffer', 'NaivePrioritizedBuffer',
+    'ReplayMemory']
+
+def fill(buf, size, obs):
+    ''' Add size transitions.
+        @returns the time spent in add
+    '''
+    state = obs.first()
+    action = np.zeros((1,))
+    add_time = 0.
+    for t in range(size):
+        new_state = obs.next(state, t)
+        done = t % EPISODE_LEN == EPISODE_LEN - 1
+        start = time.time()
+        buf.add(state, new_state, action, 0., done)
+        add_time += time.time() - start
+        state = obs.next(new_state, t + 1) if done else new_state
+    return add_time
+
+def latency(fn, repeats):
+    ''' Mean and 99th percentile of fn's latency in ms '''
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        fn()
+        times.append(1000. * (time.time() - start))
+    return float(np.mean(times)), float(np.percentile(times, 99))
+
+def bench(name, capacity, image, args):
+    make = BUFFERS[name]
+    obs = Observations(image)
+    path = None
+    if args.path:
+        path = os.path.join(args.path, 'bench')
+        shutil.rmtree(path, ignore_errors=True)
+
+    # Estimate the memory from a short fill
+    gc.collect()
+    base_memory = resident_memory()
+    buf = make(capacity, image, path)
+    probe = min(PROBE, capacity)
+    add_time = fill(buf, probe, obs)
+    estimate = ((resident_memory() - base_memory) * capacity / probe)
+    if estimate > args.max_memory * 2 ** 30:
+        return {'skipped': 'needs about {:.1f} GB'.format(
+            estimate / 2. ** 30)}
+    add_time += fill(buf, capacity - probe, obs)
+    result = {'add_per_sec': capacity / add_time,
+              'memory_mb': (resident_memory() - base_memory) / 2. ** 20}
+
+    for batch_size in args.batch_sizes:
+        samples = []
+        def sample():
+            samples.append(buf.sample(batch_size, beta=0.4)[5])
+        result['sample_ms_{}'.format(batch_size)] = latency(sample,
+            args.repeats)
+        if samples[-1] is None:
+            continue
+        prios = np.random.rand(batch_size).astype(np.float32)
+        indices = iter(samples)
+        result['update_ms_{}'.format(batch_size)] = latency(
+            lambda: buf.update_priorities(next(indices), prios),
+            args.repeats)
+    del buf
+    gc.collect()
+    if path is not None:
+        shutil.rmtree(path, ignore_errors=True)
+    return result
+
+def report(name, capacity, kind, r, batch_sizes):
+    line = "{:24s} {:5s} {:8d} ".format(name, kind, capacity)
+    if 'skipped' in r:
+        print(line + 'skipped, ' + r['skipped'])
+        return
+    if 'error' in r:
+        print(line + 'failed, ' + r['error'])
+        return
+    line += "add {:8.0f}/s mem {:8.1f} MB".format(r['add_per_sec'],
+        r['memory_mb'])
+    for b in batch_sizes:
+        line += " | b{} sample {:7.2f} ms".format(b, r['sample_ms_{}'.format(b)][0])
+        if 'update_ms_{}'.format(b) in r:
+            line += " update {:6.2f} ms".format(r['update_ms_{}'.format(b)][0])
+    print(line)
+
+def run(args):
+    tmp = args.path == 'tmp'
+    if tmp:
+        args.path = tempfile.mkdtemp()
+    # Fork, as this script has no main guard for spawn to import it with
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('fork').Pool(1, maxtasksperchild=1)
+    else:
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = []
+    try:
+        for name in NAMES:
+            if args.buffers and name not in args.buffers:
+                continue
+            for kind in args.observations:
+                for capacity in args.capacities:
+                    capacity = int(float(capacity))
+                    try:
+                        r = pool.apply(bench,
+                            (name, capacity, kind == 'image', args))
+                    except Exception as e:
+                        r = {'error': '{}: {}'.format(type(e).__name__, e)}
+                    report(name, capacity, kind, r, args.batch_sizes)
+                    r.update(buffer=name, observation=kind, capacity=capacity)
+                    results.append(r)
+    finally:
+        pool.terminate()
+        if tmp:
+            shutil.rmtree(args.path)
+
+    if args.output:
+        output = {'numpy': np.__version__,
+                  'torch': torch.__version__,
+                  'options': vars(args),
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+        print("Wrote " + args.output)
+
+#-------------------------------------------------------
+# main()
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', '--output', default='', help='JSON file to write')
+parser.add_argument('--buffers', nargs='*',
+    help='Buffers to run (default: all of {})'.format(
+        ', '.join(NAMES)))
+parser.add_argument('--observations', nargs='*', default=['state', 'image'])
+parser.add_argument('--capacities', nargs='*', default=['1e4', '1e5', '1e6'])
+parser.add_argument('--batch-sizes', type=int, nargs='*',
+    default=[32, 256, 1024])
+parser.add_argument('--repeats', type=int, default=50,
+    help='Sample and update calls timed per batch size')
+parser.add_argument('--max-memory', type=float, default=8.,
+    help='Skip configurations needing more GB than this')
+parser.add_argument('--path', default='',
+    help='Memory-map the rl buffers under this directory '
+    '("tmp" for a temporary one)')
+run(parser.parse_args())
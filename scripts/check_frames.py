@@ -0,0 +1,59 @@
+"""
+    Check of the uint8 frame stack against the float image stack
+
+    Plays random episodes with uint8_frames on and off for each stack size.
+    Every observation must still hold its frames after the next step, as
+    training keeps it to store the transition, and the uint8 stacks must
+    match the float stacks once converted to uint8.
+
+    [Usage] python check_frames.py [level file] [episodes]
+"""
+import sys
+import numpy as np
+from context import needlemaster
+from needlemaster.environment import Environment
+
+def make_env(filename, stack_size, uint8_frames):
+    env = Environment('rgb_array', stack_size, filename=filename, img_dim=64,
+        uint8_frames=uint8_frames, async_record=False)
+    env.record = False
+    return env
+
+def check(filename, stack_size, episodes):
+    ''' Returns the number of failures '''
+    fast = make_env(filename, stack_size, True)
+    slow = make_env(filename, stack_size, False)
+    rng = np.random.RandomState(stack_size)
+    failures = 0
+    for episode in range(episodes):
+        state = fast.reset()
+        slow.reset()
+        done = False
+        while not done:
+            action = rng.uniform(-0.5, 0.5, 1)
+            kept = state.copy()
+            new_state, _, done = fast.step(action)
+            expected, _, _ = slow.step(action)
+            if not np.array_equal(state, kept):
+                print('stack {} episode {} step {}: observation changed by '
+                    'the next step'.format(stack_size, episode, fast.t))
+                failures += 1
+            # FrameStack rounds the luma weights and truncates
+            if np.abs(new_state - expected).max() > 2.:
+                print('stack {} episode {} step {}: uint8 stack differs'
+                    .format(stack_size, episode, fast.t))
+                failures += 1
+            state = new_state
+    return failures
+
+# main()
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else \
+        'data/environment_1.txt'
+    episodes = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    failures = 0
+    for stack_size in [1, 2, 3, 4]:
+        n = check(filename, stack_size, episodes)
+        print('stack size {}: {} failures'.format(stack_size, n))
+        failures += n
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,61 @@
+"""
+    Check needlemaster.geometry against shapely on every level in a directory
+
+    Tests each gate box, top, bottom and surface polygon with random points,
+    the polygon vertices, edge midpoints and the default needle start.
+
+    [Usage] python check_geometry.py <level directory> [points per polygon]
+"""
+import os
+import sys
+import numpy as np
+from shapely.geometry import Polygon, Point
+from context import needlemaster
+from needlemaster.environment import load_level
+
+def check_polygon(poly, corners, n_points):
+    corners = np.asarray(corners, dtype=np.float64)
+    ref = Polygon(corners)
+
+    lo = corners.min(axis=0) - 10
+    hi = corners.max(axis=0) + 10
+    points = [np.random.uniform(lo, hi, size=(n_points, 2)),
+              corners,
+              (corners + np.roll(corners, -1, axis=0)) / 2,
+              np.array([[96, 108]])]
+    points = np.concatenate(points)
+
+    expected = np.array([ref.contains(Point(p)) for p in points])
+    batch = poly.contains_points(points[:, 0], points[:, 1])
+    single = np.array([poly.contains(x, y) for x, y in points])
+    return (np.count_nonzero(batch != expected) +
+            np.count_nonzero(single != expected))
+
+def check_dir(directory, n_points):
+    errors = 0
+    files = sorted(f for f in os.listdir(directory) if f.endswith('.txt'))
+    for file in files:
+        level = load_level(os.path.join(directory, file))
+        level_errors = 0
+        for gate in level.gates:
+            level_errors += check_polygon(gate.box, gate.corners, n_points)
+            level_errors += check_polygon(gate.top_box, gate.top, n_points)
+            level_errors += check_polygon(gate.bottom_box, gate.bottom,
+                    n_points)
+        for s in level.surfaces:
+            level_errors += check_polygon(s.poly, s.corners, n_points)
+        print("{}: {} mismatches".format(file, level_errors))
+        errors += level_errors
+    return errors
+
+#-------------------------------------------------------
+# main()
+args = sys.argv
+if len(args) >= 2:
+    n_points = int(args[2]) if len(args) >= 3 else 10000
+    errors = check_dir(args[1], n_points)
+    print("Total mismatches: {}".format(errors))
+    sys.exit(1 if errors else 0)
+else:
+    print("ERROR: command line arguments required")
+    print("[Usage] python check_geometry.py <level directory> [points per polygon]")
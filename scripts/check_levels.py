@@ -0,0 +1,108 @@
+"""
+    Round-trip check of the binary level format on every level in a directory
+
+    Converts each text level to float64 and float32 binary files and loads
+    them back. The float64 levels must match Environment.load of the text
+    file exactly: the same geometry, and the same observations, rewards and
+    ends over random episodes. The float32 levels must match the geometry
+    to float32 precision; how many of their episodes end at the same step
+    is shown, as rounding can change the course of an episode.
+
+    [Usage] python check_levels.py <level directory> [episodes]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from context import needlemaster
+from needlemaster.environment import Environment
+from needlemaster.level_file import convert_levels
+
+def geometry(level):
+    values = [[level.width, level.height, level.ngates, level.nsurfaces]]
+    for gate in level.gates:
+        values += [[gate.x, gate.y, gate.w], gate.corners.ravel(),
+                   gate.top.ravel(), gate.bottom.ravel()]
+    for s in level.surfaces:
+        values += [[float(s.deep)], s.corners.ravel()]
+    return np.concatenate([np.asarray(v, dtype=np.float64) for v in values])
+
+def make_env(filename):
+    return Environment('state', 1, filename=filename, async_record=False)
+
+def rollout(env, actions):
+    env.reset()
+    env.record = False
+    steps = []
+    for action in actions:
+        state, reward, done = env.step(action)
+        steps.append((state.copy(), reward, done))
+        if done:
+            break
+    return steps
+
+def identical(a, b):
+    return len(a) == len(b) and all(np.array_equal(s1, s2) and r1 == r2 and
+        d1 == d2 for (s1, r1, d1), (s2, r2, d2) in zip(a, b))
+
+def check_level(filename, directory, episodes):
+    ''' Returns the number of failures '''
+    text_env = make_env(filename)
+    expected = geometry(text_env.level)
+    failures = 0
+    line = os.path.basename(filename)
+    rng = np.random.RandomState(0)
+    runs = [rng.uniform(-0.5, 0.5, (text_env.max_time + 1, 1))
+        for _ in range(episodes)]
+    text_runs = [rollout(text_env, actions) for actions in runs]
+
+    for dtype in [np.float64, np.float32]:
+        # A file per level and dtype, as load_level caches by path
+        output = os.path.join(directory, '{}_{}.nml'.format(
+            os.path.splitext(os.path.basename(filename))[0],
+            np.dtype(dtype).name))
+        convert_levels([filename], output, dtype)
+        env = make_env(output + ':0')
+        error = np.abs(geometry(env.level) - expected).max() \
+            if len(expected) else 0.
+        if dtype == np.float64:
+            same = [identical(rollout(env, actions), text) for actions, text in zip(runs, text_runs)]
+            ok = error == 0 and all(same)
+            line += "  float64: geometry {}, {}/{} episodes identical".format(
+                'exact' if error == 0 else 'error {:g}'.format(error),
+                sum(same), episodes)
+        else:
+            # Relative to the largest coordinate, float32 keeps ~7 digits
+            ok = error <= 1e-6 * max(1., np.abs(expected).max())
+            alike = [len(a) == len(b) and a[-1][2] == b[-1][2]
+                for a, b in [(rollout(env, actions), text)
+                    for actions, text in zip(runs, text_runs)]]
+            line += "  float32: geometry error {:.2g}, {}/{} episodes " \
+                "end alike".format(error, sum(alike), episodes)
+        failures += not ok
+    print(line + ('' if failures == 0 else '  FAILED'))
+    return failures
+
+def check_dir(directory, episodes):
+    tmp = tempfile.mkdtemp()
+    failures = 0
+    try:
+        files = sorted(f for f in os.listdir(directory) if f.endswith('.txt')
+            and f.startswith('environment_'))
+        for f in files:
+            failures += check_level(os.path.join(directory, f), tmp, episodes)
+    finally:
+        shutil.rmtree(tmp)
+    return failures
+
+#-------------------------------------------------------
+# main()
+args = sys.argv
+if len(args) >= 2:
+    episodes = int(args[2]) if len(args) >= 3 else 5
+    failures = check_dir(args[1], episodes)
+    print("Total failures: {}".format(failures))
+    sys.exit(1 if failures else 0)
+else:
+    print("ERROR: command line arguments required")
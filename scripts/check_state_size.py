@@ -0,0 +1,61 @@
+"""
+    Check that a level pool gives states of one size in state mode
+
+    Plays every level of a directory through a LevelPoolEnvironment and
+    through an Environment of its own. The pool's states must all have the
+    same size, and match the level's own states with the per-gate flags
+    padded with zeros.
+
+    [Usage] python check_state_size.py [level directory] [steps]
+"""
+import os
+import sys
+import numpy as np
+from context import needlemaster
+from needlemaster.environment import Environment
+from needlemaster.level_pool import LevelPoolEnvironment
+
+# main()
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    pool = LevelPoolEnvironment('state', 1, filename=directory,
+        async_record=False)
+    size = None
+    failures = 0
+    rng = np.random.RandomState(0)
+    for i, name in enumerate(pool.level_names):
+        env = Environment('state', 1, filename=os.path.join(directory, name),
+            async_record=False) if name.endswith('.txt') else None
+        states = [pool.reset(level_id=i)]
+        own = [env.reset()] if env is not None else []
+        pool.record = False
+        for action in rng.uniform(-0.5, 0.5, (steps, 1)):
+            state, _, done = pool.step(action)
+            states.append(state)
+            if env is not None:
+                env.record = False
+                own.append(env.step(action)[0])
+            if done:
+                break
+        if size is None:
+            size = states[0].shape
+        if any(s.shape != size for s in states):
+            print('{}: state shape {}, expected {}'.format(name,
+                states[-1].shape, size))
+            failures += 1
+            continue
+        n = 8 + pool.ngates
+        for s, o in zip(states, own):
+            if not (np.array_equal(s[..., :n], o[..., :n]) and
+                    np.array_equal(s[..., -3:], o[..., -3:]) and
+                    not s[..., n:-3].any()):
+                print('{}: state differs from the level\'s own'.format(name))
+                failures += 1
+                break
+        print('{:24s} {} gates, state size {}'.format(name, pool.ngates,
+            states[0].shape[-1]))
+    print('{} levels, pool max_gates {}, {} failures'.format(
+        len(pool.levels), pool.max_gates, failures))
+    sys.exit(1 if failures else 0)
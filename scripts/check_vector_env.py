@@ -0,0 +1,68 @@
+"""
+    Check of VectorEnvironment against independent Environments
+
+    For every level in a directory, steps a VectorEnvironment of N needles
+    and N Environments with the same random actions, with and without
+    swept collision. States, rewards and dones must match at every step
+    (states and rewards up to float32 rounding). Environments are reset
+    when they finish, as VectorEnvironment resets its needles.
+
+    [Usage] python check_vector_env.py [level directory] [steps] [needles]
+"""
+import os
+import sys
+import numpy as np
+from context import needlemaster
+from needlemaster.environment import Environment
+from needlemaster.vector_environment import VectorEnvironment
+
+def reset(env):
+    state = env.reset()
+    env.record = False
+    return state
+
+def check_level(filename, steps, num_envs, swept_collision):
+    ''' Returns the number of failures '''
+    envs = [Environment('state', 1, filename=filename, async_record=False,
+        swept_collision=swept_collision) for _ in range(num_envs)]
+    vec = VectorEnvironment(num_envs, filename,
+        swept_collision=swept_collision)
+    expected = np.concatenate([reset(env) for env in envs])
+    if not np.allclose(vec.reset(), expected, atol=1e-5):
+        print('{}: reset states differ'.format(filename))
+        return 1
+
+    rng = np.random.RandomState(0)
+    for t in range(steps):
+        actions = rng.uniform(-0.8, 0.8, (num_envs, 1))
+        # Straight ahead now and then, so needles reach gates and tissue
+        if t % 7 == 0:
+            actions[:] = 0.
+        states, rewards, dones = vec.step(actions)
+        for i, env in enumerate(envs):
+            state, reward, done = env.step(actions[i])
+            if done:
+                state = reset(env)
+            if not (done == dones[i] and np.isclose(reward, rewards[i]) and
+                    np.allclose(state, states[i], atol=1e-4)):
+                print('{} step {} needle {}: reward {} / {}, done {} / {}'
+                    .format(os.path.basename(filename), t, i, reward,
+                    rewards[i], done, dones[i]))
+                return 1
+    return 0
+
+# main()
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    num_envs = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    levels = sorted(f for f in os.listdir(directory) if
+        f.startswith('environment_') and f.endswith('.txt'))
+    failures = 0
+    for level in levels:
+        for swept_collision in [False, True]:
+            failures += check_level(os.path.join(directory, level), steps,
+                num_envs, swept_collision)
+    print('{} levels, {} failures'.format(len(levels), failures))
+    sys.exit(1 if failures else 0)
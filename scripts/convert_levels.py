@@ -0,0 +1,57 @@
+"""
+    Convert text level files to the binary level format
+
+    Packs every environment_*.txt of a directory (or the files given) into
+    one binary level file, or with --split writes one .nml per level next
+    to its text file. Load a level from a pack with
+    Environment(filename='levels.nml:<index>') or needlemaster.level_file.
+
+    [Usage] python convert_levels.py <level directory or files> [-o levels.nml]
+                                     [--split] [--float64]
+"""
+import os
+import argparse
+import numpy as np
+from context import needlemaster
+from needlemaster.level_file import convert_levels
+
+def level_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [f for f in os.listdir(path)
+                if f.startswith('environment_') and f.endswith('.txt')]
+            # Numeric order: environment_2 before environment_10
+            names.sort(key=lambda f: int(f[len('environment_'):-4])
+                if f[len('environment_'):-4].isdigit() else f)
+            files += [os.path.join(path, f) for f in names]
+        else:
+            files.append(path)
+    return files
+
+#-------------------------------------------------------
+# main()
+parser = argparse.ArgumentParser()
+parser.add_argument('paths', nargs='+', help='Level directories or files')
+parser.add_argument('-o', '--output', default='',
+    help='Pack to write (default: levels.nml in the first directory)')
+parser.add_argument('--split', action='store_true',
+    help='Write one .nml per text file instead of one pack')
+parser.add_argument('--float64', action='store_true',
+    help='Keep the text values exactly instead of as float32')
+args = parser.parse_args()
+
+dtype = np.float64 if args.float64 else np.float32
+files = level_files(args.paths)
+if args.split:
+    for f in files:
+        convert_levels([f], os.path.splitext(f)[0] + '.nml', dtype)
+    print("Wrote {} level files".format(len(files)))
+else:
+    output = args.output
+    if not output:
+        directory = args.paths[0] if os.path.isdir(args.paths[0]) else \
+            os.path.dirname(args.paths[0])
+        output = os.path.join(directory, 'levels.nml')
+    convert_levels(files, output, dtype)
+    print("Wrote {} levels to {}".format(len(files), output))
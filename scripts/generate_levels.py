@@ -0,0 +1,58 @@
+"""
+    Write procedurally generated levels
+
+    Writes levels 0..N-1 of a seed as environment_<i>.txt files in a
+    directory, or as one binary level pack if the output ends in .nml.
+    The same seed and index always give the same level.
+
+    [Usage] python generate_levels.py <output directory or .nml> [-n 1000]
+                                      [--seed 0] [--gates 1 4]
+"""
+import os
+import time
+import argparse
+import numpy as np
+from context import needlemaster
+from needlemaster.level_generator import LevelGenerator
+from needlemaster.level_file import write_levels
+
+#-------------------------------------------------------
+# main()
+parser = argparse.ArgumentParser()
+parser.add_argument('output', help='Directory, or .nml pack to write')
+parser.add_argument('-n', '--count', type=int, default=1000)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--gates', type=int, nargs=2, default=[1, 4],
+    help='Least and most gates')
+parser.add_argument('--gate-size', type=float, nargs=2, default=[0.1, 0.2],
+    help='Shortest and longest gate, relative to the height')
+parser.add_argument('--gate-spacing', type=float, default=0.15,
+    help='Least horizontal distance between gates, relative to the width')
+parser.add_argument('--max-tilt', type=float, default=45.,
+    help='Most the gates turn from vertical, in degrees')
+parser.add_argument('--surfaces', type=int, nargs=2, default=[0, 2],
+    help='Least and most tissue hills')
+parser.add_argument('--deep-prob', type=float, default=0.5,
+    help='Chance a hill has deep tissue inside')
+parser.add_argument('--float64', action='store_true',
+    help='Store a pack as float64 instead of float32')
+args = parser.parse_args()
+
+generator = LevelGenerator(args.seed, gates=args.gates,
+    gate_size=args.gate_size, gate_spacing=args.gate_spacing,
+    max_tilt=np.radians(args.max_tilt), surfaces=args.surfaces,
+    deep_prob=args.deep_prob)
+start = time.time()
+if args.output.endswith('.nml'):
+    levels = [generator.arrays(i) for i in range(args.count)]
+    write_levels(args.output, levels,
+        ['seed{}_{}'.format(args.seed, i) for i in range(args.count)],
+        np.float64 if args.float64 else np.float32)
+else:
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    for i in range(args.count):
+        generator.write(os.path.join(args.output,
+            'environment_{}.txt'.format(i)), i)
+print("Wrote {} levels to {} in {:.2f}s".format(args.count, args.output,
+    time.time() - start))
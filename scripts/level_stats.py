@@ -0,0 +1,77 @@
+"""
+    Precompute the statistics and solvability of a directory of levels
+
+    Writes a record per level (see needlemaster.level_stats) to an index,
+    by default level_index.json in the directory, where
+    LevelPoolEnvironment looks for it: with level_filter=level_stats.solvable
+    (--solvable-only in rl/main.py) it trains only on the levels the PID
+    controller solved. Levels are processed in parallel.
+
+    [Usage] python level_stats.py <level directory or .nml> [-o index.json]
+                                  [--workers N] [--swept-collision]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from context import needlemaster
+from needlemaster.level_pool import level_files
+from needlemaster.level_stats import INDEX_NAME, build_index
+
+def summary(records):
+    ok = [r for r in records if 'error' not in r]
+    for r in records:
+        if 'error' in r:
+            print("{}: {}".format(r['name'], r['error']))
+    if not ok:
+        return
+    outcomes = {}
+    for r in ok:
+        outcomes[r['pid_outcome']] = outcomes.get(r['pid_outcome'], 0) + 1
+    print("PID outcomes: " + ', '.join('{} {}'.format(k, v)
+        for k, v in sorted(outcomes.items())))
+    for key in ['ngates', 'path_length', 'max_turn', 'tissue_area',
+            'deep_area']:
+        values = np.array([r[key] for r in ok], dtype=np.float64)
+        print("{:12s} mean {:9.3f} min {:9.3f} max {:9.3f}".format(key,
+            values.mean(), values.min(), values.max()))
+
+#-------------------------------------------------------
+# main()
+parser = argparse.ArgumentParser()
+parser.add_argument('path', help='Level directory or binary level pack')
+parser.add_argument('-o', '--output', default='',
+    help='Index to write (default: {} next to the levels)'.format(INDEX_NAME))
+parser.add_argument('--workers', type=int, default=0,
+    help='Worker processes (default: one per CPU)')
+parser.add_argument('--max-time', type=int, default=150,
+    help='Steps the PID controller has to pass every gate')
+parser.add_argument('--swept-collision', action='store_true',
+    help='Test the whole path of each step, as with rl/main.py '
+    '--swept-collision')
+args = parser.parse_args()
+
+output = args.output
+if not output:
+    directory = args.path if os.path.isdir(args.path) else \
+        os.path.dirname(args.path)
+    output = os.path.join(directory, INDEX_NAME)
+names, paths = level_files(args.path)
+if not paths:
+    print("ERROR: no levels in " + args.path)
+    sys.exit(1)
+
+def progress(done):
+    if done % 100 == 0 or done == len(paths):
+        sys.stdout.write("\r{}/{} levels".format(done, len(paths)))
+        sys.stdout.flush()
+
+start = time.time()
+records = build_index(names, paths, output, workers=args.workers or None,
+    env_kwargs=dict(max_time=args.max_time,
+        swept_collision=args.swept_collision),
+    progress=progress)
+print("\nWrote {} records to {} in {:.1f}s".format(len(records), output,
+    time.time() - start))
+summary(records)
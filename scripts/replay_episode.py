@@ -0,0 +1,83 @@
+"""
+    Scrub through an episode recorded by needlemaster.video.EpisodeRecorder
+
+    Keys: left/right step one frame, page up/down step 10 frames,
+          home/end jump to the first/last frame, space plays/pauses,
+          s saves the current frame as PNG, q/escape quits.
+
+    [Usage] python replay_episode.py <episode .mp4 or .npz> [scale]
+"""
+import os
+import sys
+import pygame
+from context import needlemaster
+from needlemaster.video import load_episode
+
+def replay(path, scale=3, fps=10):
+    frames = load_episode(path)
+    if len(frames) == 0:
+        print("Warning: empty episode")
+        return
+    height, width = frames.shape[1:3]
+
+    pygame.init()
+    screen = pygame.display.set_mode((width * scale, height * scale))
+    clock = pygame.time.Clock()
+    name = os.path.basename(path)
+
+    index = 0
+    playing = False
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key in (pygame.K_q, pygame.K_ESCAPE):
+                    running = False
+                elif event.key == pygame.K_SPACE:
+                    playing = not playing
+                elif event.key == pygame.K_RIGHT:
+                    index += 1
+                elif event.key == pygame.K_LEFT:
+                    index -= 1
+                elif event.key == pygame.K_PAGEDOWN:
+                    index += 10
+                elif event.key == pygame.K_PAGEUP:
+                    index -= 10
+                elif event.key == pygame.K_HOME:
+                    index = 0
+                elif event.key == pygame.K_END:
+                    index = len(frames) - 1
+                elif event.key == pygame.K_s:
+                    save_file = '{}_{:04d}.png'.format(
+                        os.path.splitext(path)[0], index)
+                    pygame.image.save(surface, save_file)
+                    print("Saved " + save_file)
+
+        if playing:
+            index += 1
+            if index >= len(frames):
+                index = len(frames) - 1
+                playing = False
+        index = max(0, min(index, len(frames) - 1))
+
+        # Frames are [H, W, 3]; surfarray wants [W, H, 3]
+        surface = pygame.surfarray.make_surface(frames[index].transpose((1, 0, 2)))
+        screen.blit(pygame.transform.scale(surface,
+            (width * scale, height * scale)), (0, 0))
+        pygame.display.set_caption("{} {}/{}".format(
+            name, index + 1, len(frames)))
+        pygame.display.flip()
+        clock.tick(fps if playing else 30)
+
+    pygame.quit()
+
+#-------------------------------------------------------
+# main()
+args = sys.argv
+if len(args) >= 2:
+    replay(args[1], int(args[2]) if len(args) >= 3 else 3)
+else:
+    print("ERROR: command line arguments required")
+    print("[Usage] python replay_episode.py <episode .mp4 or .npz> [scale]")